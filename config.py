@@ -4,8 +4,24 @@ wifi_password = ""
 wifi_country = "GB"
 
 wifi_connect_timeout_seconds = 10
-wifi_connect_retries = 1
+# Backoff after the first failed connection, doubling per consecutive failure up to wifi_backoff_max_seconds
 wifi_retry_backoff_seconds = 5
+wifi_backoff_max_seconds = 300
+# Fraction of each backoff randomised, so devices that lost the same access point don't reconnect in step
+wifi_backoff_jitter = 0.5
+# Minimum change in signal strength in dB published as an event, smaller fluctuations are only cached
+wifi_rssi_change_db = 5
+# Signal strength below which a unit is likely to drop out, reported as weak signal percent in wifi telemetry
+wifi_weak_rssi_dbm = -75
+# Wifi telemetry buffer sizes, RSSI samples at the 5 second status cadence and the last connects and outages
+wifi_telemetry_rssi_window = 360
+wifi_telemetry_event_window = 16
+
+## Boot
+# Start services and the web server first, then run the fan test and show startup text in the background
+enable_fast_boot = False
+# Seconds after power on the web server should be reachable by, a warning is logged if it starts later
+fast_boot_web_target_s = 15
 
 ## Open Meteo
 # lat and long in decimal format array with Lattitude in 0
@@ -13,13 +29,31 @@ wifi_retry_backoff_seconds = 5
 # e.g. latlong[50.9048, -1.4043] for Southampton UK
 lat_long = [50.9048, -1.4043]
 weather_poll_frequency_in_seconds = 300
+# Seconds allowed to connect and send a weather request, and for each read of the response, before it is abandoned
+weather_connect_timeout_s = 10
+weather_read_timeout_s = 10
+
+## DNS
+# Seconds a resolved address is used before it is refreshed in the background, stale addresses are kept if a refresh fails
+dns_cache_ttl_s = 600
+# Seconds a host can go unrequested before it is evicted rather than refreshed, keep above the longest interval between requests to a host
+dns_cache_idle_s = 1200
 
 ## BME280
 i2c_pins = {"sda": 0, "scl": 1}
+# I2C buses by name, each shared by the sensors on it
+i2c_buses = {"main": i2c_pins}
+# Environmental sensors by name, with their bus and I2C address (BME280 is 0x76, or 0x77 with the address jumper cut)
+environment_sensors = {"indoor": {"bus": "main", "address": 0x76}}
 
 ## Fan
 enable_fan = True
 fan_gpio_pin = 2
+# Fan zones as a list of (name, zone config) pairs, each with its own fan output pin and the sensors averaged for its indoor humidity.
+# A zone may set its own "lat_long" for outdoor humidity, otherwise lat_long is used.
+# The first zone in the list is shown on the display and published as fan_speed, indoor_humidity and outdoor_humidity.
+# e.g. [("shed", {"fan_pin": 2, "sensors": ["shed"]}), ("garage", {"fan_pin": 3, "sensors": ["garage 1", "garage 2"]})]
+fan_zones = [("main", {"fan_pin": fan_gpio_pin, "sensors": ["indoor"]})]
 # How much dryer in RH % outside before the fan turns on
 humidity_hysteresis_pc = 1
 # Use PWM to gradually increase fan speed or simply turn fan on and off
@@ -33,6 +67,7 @@ auto_page_scroll_pause_s = 0
 backlight_timeout_s = 30
 
 ## Battery monitor
+enable_battery_monitor = True
 # Set a valid ADC GP pin (26-28)
 battery_adc_pin = 28
 # Voltage divider resistor values in ohms - see documentation for diagram
@@ -40,9 +75,149 @@ r1 = 21600
 r2 = 5040
 # What value to add or subtract to correct a reported voltage
 voltage_correction = 0.12
+# ADC samples averaged per reading, the highest and lowest quarter are discarded as outliers
+battery_oversample_count = 16
+# Readings kept for filtering, the filtered voltage is the median of the window or an exponential moving average
+battery_filter_window = 5
+# "median" or "ema"
+battery_filter = "median"
+# EMA weight of each new reading from 0 to 1, lower is smoother
+battery_ema_alpha = 0.3
+# Battery chemistry for the state of charge lookup, "lead_acid" or "lifepo4"
+battery_chemistry = "lead_acid"
+# Resting voltage to state of charge percent for a 12v battery, ordered by descending voltage
+battery_soc_tables = {
+    "lead_acid": [(12.7, 100), (12.5, 90), (12.42, 80), (12.32, 70), (12.2, 60), (12.06, 50), (11.9, 40), (11.75, 30), (11.58, 20), (11.31, 10), (10.5, 0)],
+    "lifepo4": [(13.6, 100), (13.4, 99), (13.3, 90), (13.2, 70), (13.1, 40), (13.0, 30), (12.9, 20), (12.8, 17), (12.5, 14), (12.0, 9), (10.0, 0)],
+}
+# Battery internal resistance and full duty load currents, used to correct voltage sag under load to a resting voltage
+battery_internal_resistance_ohm = 0.05
+battery_fan_current_a = 0.5
+battery_light_current_a = 1.0
+# Seconds between state of charge history samples and samples kept to project runtime from the discharge slope
+battery_history_interval_s = 300
+battery_history_length = 24
+# Battery state thresholds in volts, the state drops below a threshold and recovers once above it plus the hysteresis
+battery_low_voltage = 12.0
+battery_critical_voltage = 11.6
+battery_state_hysteresis_v = 0.2
+# Readings below this are treated as no battery connected (e.g. USB powered) and leave the state normal
+battery_absent_voltage = 5
+# Load shedding per battery state, normal state runs without limits
+# Multiplier applied to all scheduled polling intervals
+battery_poll_stretch = {"low": 3, "critical": 6}
+# Maximum fan speed from 0 to 1
+battery_fan_max_speed = {"low": 0.5, "critical": 0.2}
+# Without PWM fan speed the fan is on or off, so a capped speed switches it fully on at or above this and off below it
+battery_fan_on_off_threshold = 0.5
+# Maximum light brightness percent, the requested brightness is restored on recovery
+battery_light_max_brightness_pc = {"low": 50, "critical": 20}
+# Backlight timeout in seconds, replacing backlight_timeout_s
+battery_backlight_timeout_s = {"low": 10, "critical": 5}
+# Stop the web server at critical battery, it restarts once the battery recovers
+battery_critical_disables_web = True
 
 ## Web interface
 web_port = 80
+# Maximum number of browsers receiving live updates at once, each holds an open connection
+sse_max_subscribers = 2
+# Events queued per browser before the oldest are dropped for slow clients
+sse_queue_length = 16
+# Seconds between keepalive messages to detect closed live update connections
+sse_keepalive_s = 15
+# Maximum number of browsers holding a WebSocket control connection open at once
+websocket_max_clients = 1
+# Largest accepted WebSocket command in bytes, larger frames close the connection
+websocket_max_frame_size = 64
+# Seconds without a command before an idle WebSocket control connection is closed
+websocket_idle_timeout_s = 300
+# Maximum number of operations accepted in a single /api/batch request
+batch_max_operations = 16
+# Request body bytes allowed per /api/batch operation, the body limit is this times batch_max_operations
+batch_max_operation_bytes = 128
+
+## MQTT
+# Publish state to an MQTT broker and accept light and motion commands, for integrations in place of polling the API
+enable_mqtt = False
+mqtt_broker = ""
+mqtt_port = 1883
+mqtt_user = ""
+mqtt_password = ""
+# Client id and topic name for this unit, defaults to pico-environment-<MAC> if empty
+mqtt_client_id = ""
+# State is published to <prefix>/<client id>/state, commands are received on <prefix>/<client id>/light/set,
+# <prefix>/<client id>/light/brightness/set and <prefix>/<client id>/motion_detection/set
+mqtt_topic_prefix = "pico-environment"
+mqtt_keepalive_s = 60
+mqtt_connect_timeout_s = 10
+# Seconds changes are collected for before publishing, so changes arriving together share one publish
+mqtt_batch_interval_s = 1
+# Seconds between publishes when nothing has changed
+mqtt_heartbeat_s = 300
+# Reconnect backoff after losing the broker, doubling per consecutive failure up to mqtt_reconnect_max_s
+mqtt_reconnect_s = 5
+mqtt_reconnect_max_s = 300
+# Announce entities to Home Assistant through MQTT discovery, configs are generated once and cached in flash
+enable_ha_discovery = True
+ha_discovery_prefix = "homeassistant"
+ha_discovery_cache_file = "/ha_discovery.txt"
+
+## Offline queue
+# Store readings in flash while the push target is unreachable and forward them once it is back
+enable_offline_queue = False
+# "mqtt" publishes batches to <prefix>/<client id>/backlog, "http" POSTs them as a JSON list to offline_queue_http_url
+offline_queue_target = "mqtt"
+offline_queue_http_url = ""
+offline_queue_dir = "/queue"
+# Readings kept in flash, stored in segment files of offline_queue_segment_records readings
+offline_queue_max_records = 1000
+offline_queue_segment_records = 50
+# Readings buffered in memory before writing to flash, fewer writes but more readings lost on power failure
+offline_queue_flush_records = 10
+# When full "oldest" drops the oldest segment, "newest" discards new readings
+offline_queue_drop_policy = "oldest"
+# Readings per forwarded batch and seconds between batches, to avoid saturating the radio and event loop
+offline_queue_batch_records = 20
+offline_queue_batch_interval_s = 2
+# Seconds before retrying while the target is unreachable or after a failed batch
+offline_queue_retry_s = 30
+# NTP server setting the clock for queued reading timestamps, readings queued before the clock is set carry uptime_s instead of t
+ntp_host = "pool.ntp.org"
+
+## Metrics (Prometheus text format on /metrics)
+# Seconds between samples of free memory, garbage collection time and event loop lag
+metrics_sample_interval_s = 10
+# Routes tracked individually for request counts and latency, others are counted as "other"
+metrics_max_routes = 32
+
+## Scheduler
+# Granularity of scheduled job deadlines, jobs due within the same tick share a single wakeup
+scheduler_tick_ms = 100
+
+## Low power
+# Lightsleep between jobs while no web clients are connected, motion is inactive and the light, backlight and fan PWM are idle
+# Enables wifi radio power saving except during weather fetches, web requests may take up to low_power_max_sleep_ms to be answered
+enable_low_power = False
+# Shortest idle period worth entering lightsleep for
+low_power_min_sleep_ms = 50
+# Longest single lightsleep, bounds web server and radio response time
+low_power_max_sleep_ms = 2000
+# How often to check whether sleeping is allowed while busy
+low_power_check_interval_ms = 500
+
+## Task profiler
+# Time each resume of module service tasks and how late they resumed, adds a little overhead to every task switch
+enable_task_profiler = False
+# Seconds between task profiler reports printed to the serial console
+task_profiler_report_s = 60
+
+## Memory profiler
+# Attribute heap usage to module start up, web requests, weather fetches and display redraws and track heap fragmentation
+enable_memory_profiler = False
+# Number of samples kept per subsystem for the rolling report
+memory_profiler_window = 16
+# Seconds between largest allocatable block samples, each sample runs a short allocation search
+memory_profiler_sample_s = 60
 
 ## Motion detection
 enable_motion_detection = True
@@ -51,5 +226,6 @@ pir_pin = 21
 motion_light_off_delay = 60
 
 ## Light
+enable_light = True
 led_pin = 22
 default_brightness_pc = 100
\ No newline at end of file
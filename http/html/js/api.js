@@ -1,4 +1,104 @@
+let liveUpdates = false;
+let controlSocket = null;
+
 document.addEventListener('DOMContentLoaded', function() {
+    if (window.EventSource) {
+        subscribeToEvents('/api/events');
+    } else {
+        updateAllElementsFromAPI();
+    }
+    openControlSocket('/api/ws');
+});
+
+/**
+ * Updates the text content of each HTML element named by a key in the data object.
+ * 
+ * @param {object} data Object of element IDs and their new values.
+ */
+function updateElements(data) {
+    for (const elementId in data) {
+        const element = document.getElementById(elementId);
+
+        if (element) {
+            element.textContent = data[elementId];
+        }
+    }
+}
+
+/**
+ * Opens a long lived WebSocket for light and motion commands, replies carry the resulting light state.
+ * Commands fall back to HTTP PUT requests while the socket is not open.
+ * 
+ * @param {string} socketEndpoint The relative URL of the WebSocket control endpoint.
+ */
+function openControlSocket(socketEndpoint) {
+    if (!window.WebSocket) {
+        return;
+    }
+
+    const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + window.location.host + socketEndpoint);
+
+    socket.onopen = () => {
+        controlSocket = socket;
+    };
+
+    socket.onmessage = event => {
+        const data = JSON.parse(event.data);
+
+        if (data.error) {
+            console.error(data.error);
+        }
+        updateElements(data);
+    };
+
+    socket.onclose = () => {
+        controlSocket = null;
+    };
+}
+
+/**
+ * Sends a command over the control socket if it is open.
+ * 
+ * @param {string} command Control command such as "light on".
+ * @returns {boolean} True if the command was sent.
+ */
+function sendControlCommand(command) {
+    if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+        controlSocket.send(command);
+        return true;
+    }
+    return false;
+}
+
+/**
+ * Subscribes to the live update event stream, each event is an object of element IDs and their new values.
+ * The server sends the current state of every value on connection so no initial polling is required.
+ * Falls back to a single poll of each API endpoint if the server refuses the subscription.
+ * 
+ * @param {string} eventsEndpoint The relative URL of the Server-Sent Events endpoint.
+ */
+function subscribeToEvents(eventsEndpoint) {
+    const source = new EventSource(eventsEndpoint);
+
+    source.onopen = () => {
+        liveUpdates = true;
+    };
+
+    source.onmessage = event => {
+        updateElements(JSON.parse(event.data));
+    };
+
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            liveUpdates = false;
+            console.error('Live updates unavailable, loading values once');
+            updateAllElementsFromAPI();
+        }
+    };
+}
+
+function updateAllElementsFromAPI() {
     updateElementFromAPI('indoor_humidity', '/api/fan/indoor_humidity');
     updateElementFromAPI('outdoor_humidity', '/api/fan/outdoor_humidity');
     updateElementFromAPI('fan_speed', '/api/fan/speed');
@@ -8,7 +108,7 @@ document.addEventListener('DOMContentLoaded', function() {
     updateElementFromAPI('light_motion_detection', '/api/light/motion_detection');
     updateElementFromAPI('motion_state', '/api/motion/state');
     updateElementFromAPI('mac_address', '/api/wlan/mac');
-});
+}
 
 /**
  * Fetches data from a specified API endpoint and updates the text content of an HTML element.
@@ -38,6 +138,10 @@ function updateElementFromAPI(elementId, apiEndpoint) {
 }
 
 function setLightState(state) {
+    if (sendControlCommand(`light ${state}`)) {
+        return;
+    }
+
     const url = '/api/light/state';
     
     fetch(url, {
@@ -55,9 +159,11 @@ function setLightState(state) {
     })
     .then(data => {
         console.log(data);
-        updateElementFromAPI('light_state', '/api/light/state');
-        updateElementFromAPI('light_brightness', '/api/light/brightness');
-        updateElementFromAPI('light_motion_detection', '/api/light/motion_detection');
+        if (!liveUpdates) {
+            updateElementFromAPI('light_state', '/api/light/state');
+            updateElementFromAPI('light_brightness', '/api/light/brightness');
+            updateElementFromAPI('light_motion_detection', '/api/light/motion_detection');
+        }
     })
     .catch(error => {
         console.error('There was a problem with your fetch operation:', error);
@@ -65,6 +171,10 @@ function setLightState(state) {
 }
 
 function setLightMotionDetection(state) {
+    if (sendControlCommand(`motion ${state}`)) {
+        return;
+    }
+
     const url = '/api/light/motion_detection';
     
     fetch(url, {
@@ -82,7 +192,9 @@ function setLightMotionDetection(state) {
     })
     .then(data => {
         console.log(data);
-        updateElementFromAPI('light_motion_detection', '/api/light/motion_detection');
+        if (!liveUpdates) {
+            updateElementFromAPI('light_motion_detection', '/api/light/motion_detection');
+        }
     })
     .catch(error => {
         console.error('There was a problem with your fetch operation:', error);
@@ -13,6 +13,10 @@ import uos as os
 import sys
 import uerrno as errno
 import usocket as socket
+import uhashlib as hashlib
+import ubinascii as binascii
+import ustruct as struct
+import utime as time
 
 
 log = logging.getLogger('WEB')
@@ -31,15 +35,17 @@ def urldecode_plus(s):
     """
     s = s.replace('+', ' ')
     arr = s.split('%')
-    res = arr[0]
+    # Collect parts and join once - string concatenation is quadratic
+    res = [arr[0]]
     for it in arr[1:]:
         if len(it) >= 2:
-            res += chr(int(it[:2], 16)) + it[2:]
+            res.append(chr(int(it[:2], 16)))
+            res.append(it[2:])
         elif len(it) == 0:
-            res += '%'
+            res.append('%')
         else:
-            res += it
-    return res
+            res.append(it)
+    return ''.join(res)
 
 
 def parse_query_string(s):
@@ -65,6 +71,82 @@ class HTTPException(Exception):
         self.code = code
 
 
+class urlencoded_parser:
+    """Incremental parser of urlencoded form data.
+    Payload is fed in chunks as it arrives, every key / value is
+    decoded (including percent-escapes and '+') straight into fixed size
+    buffer, so memory usage depends on field size only, not on payload size.
+
+    Example:
+        parser = urlencoded_parser(64)
+        parser.feed(b'state=o')
+        parser.feed(b'n&value=50%25')
+        parser.finish()  # {'state': 'on', 'value': '50%'}
+    """
+
+    def __init__(self, max_field_size=128):
+        self.buf = bytearray(max_field_size)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+        self.key = None
+        # Count of hex digits still expected after '%'
+        self.esc = 0
+        self.esc_val = 0
+        self.result = {}
+
+    def _put(self, c):
+        if self.pos == len(self.buf):
+            # Field is too large - reject before rest of payload is read
+            raise HTTPException(413)
+        self.buf[self.pos] = c
+        self.pos += 1
+
+    def _take(self):
+        s = str(self.mv[:self.pos], 'utf-8')
+        self.pos = 0
+        return s
+
+    def _end_field(self):
+        if self.key is not None:
+            self.result[self.key] = self._take()
+            self.key = None
+        elif self.pos:
+            self.result[self._take()] = ''
+
+    def feed(self, chunk):
+        """Parse next chunk of payload (bytes / bytearray / memoryview)"""
+        for c in chunk:
+            if self.esc:
+                if 0x30 <= c <= 0x39:
+                    c -= 0x30
+                elif 0x41 <= c <= 0x46 or 0x61 <= c <= 0x66:
+                    c = (c | 0x20) - 0x57
+                else:
+                    raise ValueError('Invalid escape')
+                self.esc_val = (self.esc_val << 4) | c
+                self.esc -= 1
+                if not self.esc:
+                    self._put(self.esc_val)
+            elif c == 0x25:  # %
+                self.esc = 2
+                self.esc_val = 0
+            elif c == 0x2B:  # +
+                self._put(0x20)
+            elif c == 0x3D and self.key is None:  # =
+                self.key = self._take()
+            elif c == 0x26:  # &
+                self._end_field()
+            else:
+                self._put(c)
+
+    def finish(self):
+        """Complete parsing, returns dict of key / value pairs"""
+        if self.esc:
+            raise ValueError('Incomplete escape')
+        self._end_field()
+        return self.result
+
+
 class request:
     """HTTP Request class"""
 
@@ -120,17 +202,32 @@ class request:
             if frags[0] in save_headers:
                 self.headers[frags[0]] = frags[1].strip()
 
+    async def _read_body(self, mv):
+        """Read payload from stream into memoryview, chunk by chunk.
+        Function is generator.
+
+        Returns count of bytes read - less than len(mv) only at the end of payload.
+        """
+        pos = 0
+        while pos < len(mv):
+            n = await self.reader.readinto(mv[pos:])
+            if not n:
+                break
+            pos += n
+        return pos
+
     async def read_parse_form_data(self):
         """Read HTTP form data (payload), if any.
         Function is generator.
 
+        Payload is processed in chunks - urlencoded forms are decoded
+        incrementally into fixed size buffer ('max_field_size' route param),
+        JSON is read into single buffer of exact payload size and parsed in place.
+
         Returns:
             - dict of key / value pairs
             - None in case of no form data present
         """
-        # TODO: Probably there is better solution how to handle
-        # request body, at least for simple urlencoded forms - by processing
-        # chunks instead of accumulating payload.
         gc.collect()
         if b'Content-Length' not in self.headers:
             return {}
@@ -141,15 +238,26 @@ class request:
         size = int(self.headers[b'Content-Length'])
         if size > self.params['max_body_size'] or size < 0:
             raise HTTPException(413)
-        data = await self.reader.readexactly(size)
         # Use only string before ';', e.g:
         # application/x-www-form-urlencoded; charset=UTF-8
         ct = self.headers[b'Content-Type'].split(b';', 1)[0]
         try:
             if ct == b'application/json':
-                return json.loads(data)
+                buf = bytearray(size)
+                if await self._read_body(memoryview(buf)) != size:
+                    raise HTTPException(400)
+                return json.loads(buf)
             elif ct == b'application/x-www-form-urlencoded':
-                return parse_query_string(data.decode())
+                parser = urlencoded_parser(self.params['max_field_size'])
+                chunk = memoryview(bytearray(min(size, 64)))
+                remaining = size
+                while remaining:
+                    n = await self._read_body(chunk[:min(remaining, len(chunk))])
+                    if n == 0:
+                        raise HTTPException(400)
+                    parser.feed(chunk[:n])
+                    remaining -= n
+                return parser.finish()
         except ValueError:
             # Re-generate exception for malformed form data
             raise HTTPException(400)
@@ -164,6 +272,8 @@ class response:
         self.code = 200
         self.version = '1.0'
         self.headers = {}
+        # Set for HEAD requests - payload sent after headers is discarded
+        self.headers_only = False
 
     async def _send_headers(self):
         """Compose and send:
@@ -185,6 +295,12 @@ class response:
         # Collect garbage after small mallocs
         gc.collect()
         await self.send(hdrs)
+        if self.headers_only:
+            self.send = self._discard
+
+    async def _discard(self, buf, sz=-1):
+        """Replacement for send() once HEAD response headers are sent"""
+        pass
 
     async def error(self, code, msg=None):
         """Generate HTTP error response
@@ -254,6 +370,46 @@ class response:
         self.add_header('Content-Type', 'text/html')
         await self._send_headers()
 
+    async def start_event_stream(self):
+        """Start Server-Sent Events response. Connection stays open
+        until either side closes it, so no Content-Length is sent.
+        This function is generator.
+
+        For HEAD requests (headers_only set) the stream never ends and
+        writes are discarded, so disconnects are never detected - handlers
+        must return straight after this call.
+
+        Example:
+            await resp.start_event_stream()
+            if resp.headers_only:
+                return
+            await resp.send_event('{"temperature": 21}')
+        """
+        self.add_header('Content-Type', 'text/event-stream')
+        self.add_header('Cache-Control', 'no-cache')
+        self.add_access_control_headers()
+        await self._send_headers()
+
+    async def send_event(self, data, event=None):
+        """Send single Server-Sent Event.
+        This function is generator.
+
+        Arguments:
+            data - event payload, must not contain new lines
+        Keyword arguments:
+            event - optional event name, by default clients receive it as 'message'
+        """
+        if event:
+            await self.send('event: {}\ndata: {}\n\n'.format(event, data))
+        else:
+            await self.send('data: {}\n\n'.format(data))
+
+    async def send_event_keepalive(self):
+        """Send SSE comment line, ignored by clients but detects closed connections.
+        This function is generator.
+        """
+        await self.send(': keepalive\n\n')
+
     async def send_file(self, filename, content_type=None, content_encoding=None, max_age=2592000, buf_size=128):
         """Send local file as HTTP response.
         This function is generator.
@@ -307,22 +463,211 @@ class response:
                 raise
 
 
-async def restful_resource_handler(req, resp, param=None):
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_OP_TEXT = 0x1
+WS_OP_CLOSE = 0x8
+WS_OP_PING = 0x9
+WS_OP_PONG = 0xA
+
+
+class WebSocketClosed(Exception):
+    """Raised when WebSocket peer closes connection or violates protocol"""
+    pass
+
+
+class websocket:
+    """Server side of WebSocket connection (RFC 6455).
+    Only single frame (not fragmented) text messages are supported.
+    Incoming payload is received into fixed size buffer, so memory usage
+    does not depend on what client sends.
+    """
+
+    def __init__(self, reader, writer, max_frame_size=128):
+        self.reader = reader
+        self.writer = writer
+        self.buf = bytearray(max_frame_size)
+        self.mv = memoryview(self.buf)
+        self.hdr = bytearray(8)
+        self.closed = False
+
+    async def _readinto(self, mv):
+        """Fill whole memoryview from stream"""
+        pos = 0
+        while pos < len(mv):
+            n = await self.reader.readinto(mv[pos:])
+            if not n:
+                raise WebSocketClosed()
+            pos += n
+
+    async def _send_frame(self, opcode, payload=b''):
+        size = len(payload)
+        if size < 126:
+            hdr = struct.pack('!BB', 0x80 | opcode, size)
+        else:
+            hdr = struct.pack('!BBH', 0x80 | opcode, 126, size)
+        await self.writer.awrite(hdr)
+        if size:
+            await self.writer.awrite(payload)
+
+    async def recv(self):
+        """Receive next text message.
+        This function is generator.
+
+        Returns str, raises WebSocketClosed when connection is closed.
+        Control frames (ping / close) are handled transparently.
+        """
+        hmv = memoryview(self.hdr)
+        while True:
+            await self._readinto(hmv[:2])
+            opcode = self.hdr[0] & 0x0F
+            fin = self.hdr[0] & 0x80
+            masked = self.hdr[1] & 0x80
+            size = self.hdr[1] & 0x7F
+            if size == 126:
+                await self._readinto(hmv[:2])
+                size = struct.unpack_from('!H', self.hdr)[0]
+            elif size == 127:
+                # 64 bit lengths are way beyond what we can handle
+                size = len(self.buf) + 1
+            # Clients must mask all frames
+            if not masked:
+                await self.close(1002)
+                raise WebSocketClosed()
+            if size > len(self.buf):
+                await self.close(1009)
+                raise WebSocketClosed()
+            if not fin:
+                await self.close(1003)
+                raise WebSocketClosed()
+            await self._readinto(hmv[4:8])
+            payload = self.mv[:size]
+            await self._readinto(payload)
+            # Unmask in place
+            for i in range(size):
+                payload[i] ^= self.hdr[4 + (i & 3)]
+            if opcode == WS_OP_TEXT:
+                return bytes(payload).decode()
+            elif opcode == WS_OP_PING:
+                await self._send_frame(WS_OP_PONG, bytes(payload))
+            elif opcode == WS_OP_CLOSE:
+                await self.close()
+                raise WebSocketClosed()
+            elif opcode != WS_OP_PONG:
+                # Binary frames are not supported
+                await self.close(1003)
+                raise WebSocketClosed()
+
+    async def send(self, msg):
+        """Send text message.
+        This function is generator.
+        """
+        await self._send_frame(WS_OP_TEXT, msg.encode())
+
+    async def close(self, code=1000):
+        """Send close frame, connection itself is closed by webserver
+        once route handler returns.
+        This function is generator.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self._send_frame(WS_OP_CLOSE, struct.pack('!H', code))
+        except OSError:
+            pass
+
+
+async def websocket_accept(req, resp, max_frame_size=128):
+    """Complete WebSocket handshake for current request.
+    Route must save 'Upgrade' and 'Sec-WebSocket-Key' headers.
+    This function is generator.
+
+    Returns websocket object
+
+    Example:
+        @app.route('/ws', save_headers=['Upgrade', 'Sec-WebSocket-Key'])
+        async def ws(req, resp):
+            ws = await websocket_accept(req, resp)
+            while True:
+                msg = await ws.recv()
+                await ws.send(msg)
+    """
+    # Upgrade is only valid for GET, a HEAD request served by the GET handler
+    # would otherwise hold the connection with its writes discarded
+    if req.method != b'GET':
+        raise HTTPException(405)
+    if req.headers.get(b'Upgrade', b'').lower() != b'websocket' or b'Sec-WebSocket-Key' not in req.headers:
+        raise HTTPException(400)
+    digest = hashlib.sha1(req.headers[b'Sec-WebSocket-Key'] + WEBSOCKET_GUID).digest()
+    resp.code = 101
+    resp.version = '1.1'
+    resp.add_header('Upgrade', 'websocket')
+    resp.add_header('Connection', 'Upgrade')
+    resp.add_header('Sec-WebSocket-Accept', binascii.b2a_base64(digest)[:-1].decode())
+    await resp._send_headers()
+    return websocket(req.reader, resp.writer, max_frame_size)
+
+
+class route_node:
+    """Node of URL router segment trie.
+    Each node maps one URL path segment, holding child segments,
+    optional parameter child (e.g. <topic_id>) and per method handlers.
+    """
+
+    def __init__(self):
+        self.children = {}
+        self.param_child = None
+        self.param_name = None
+        # method (bytestring) -> (function, params)
+        self.handlers = {}
+        self.methods = []
+
+    def add_handler(self, method, f, params):
+        if method in self.handlers:
+            raise ValueError('URL exists')
+        self.handlers[method] = (f, params)
+        self.methods.append(method.decode())
+        # OPTIONS replies with every method available for this URL,
+        # so keep all handlers of the node in sync
+        allowed = ', '.join(self.methods)
+        for _f, _params in self.handlers.values():
+            _params['allowed_access_control_methods'] = allowed
+
+    def find_handler(self, method):
+        """Returns tuple of (function, params) for method.
+        HEAD is served by GET handler, OPTIONS by any handler.
+        If method is not supported - any handler is returned, its list of
+        allowed methods will cause HTTP 405 later on.
+        """
+        if method in self.handlers:
+            return self.handlers[method]
+        if method == b'HEAD' and b'GET' in self.handlers:
+            return self.handlers[b'GET']
+        for h in self.handlers.values():
+            return h
+        return (None, None)
+
+
+async def restful_resource_handler(req, resp, **url_params):
     """Handler for RESTful API endpoins"""
     # Gather data - query string, JSON in request body...
     data = await req.read_parse_form_data()
     # Add parameters from URI query string as well
     # This one is actually for simply development of RestAPI
-    if req.query_string != b'':
+    # JSON bodies may be lists (e.g. batch requests), which are passed on as is
+    if req.query_string != b'' and isinstance(data, dict):
         data.update(parse_query_string(req.query_string.decode()))
-    # Call actual handler
-    _handler, _kwargs = req.params['_callmap'][req.method]
+    # Call actual handler, HEAD is served by GET handler
+    if req.method == b'HEAD':
+        _handler, _kwargs = req.params['_callmap'][b'GET']
+    else:
+        _handler, _kwargs = req.params['_callmap'][req.method]
+    if url_params:
+        _kwargs = dict(_kwargs)
+        _kwargs.update(url_params)
     # Collect garbage before / after handler execution
     gc.collect()
-    if param:
-        res = _handler(data, param, **_kwargs)
-    else:
-        res = _handler(data, **_kwargs)
+    res = _handler(data, **_kwargs)
     gc.collect()
     # Handler result could be:
     # 1. generator - in case of large payload
@@ -389,34 +734,95 @@ class webserver:
         self.max_concurrency = max_concurrency
         self.backlog = backlog
         self.debug = debug
-        self.explicit_url_map = {}
+        # Router - URLs without parameters are found by single dict lookup,
+        # others by walking segment trie starting from root node
+        self.static_routes = {}
+        self.root_route = route_node()
         self.catch_all_handler = None
-        self.parameterized_url_map = {}
         # Currently opened connections
         self.conns = {}
         # Statistics
         self.processed_connections = 0
+        # Optional function called as f(route, code, elapsed_ms, alloc_bytes) once request is served,
+        # alloc_bytes is heap still allocated compared to start of request
+        self.request_observer = None
 
     def _find_url_handler(self, req):
         """Helper to find URL handler.
-        Returns tuple of (function, opts, param) or (None, None) if not found.
+        Returns tuple of (function, opts) or (None, None) if not found.
+        URL parameters, if any, are saved into request.
         """
-        # First try - lookup in explicit (non parameterized URLs)
-        if req.path in self.explicit_url_map:
-            return self.explicit_url_map[req.path]
-        # Second try - strip last path segment and lookup in another map
-        idx = req.path.rfind(b'/') + 1
-        path2 = req.path[:idx]
-        if len(path2) > 0 and path2 in self.parameterized_url_map:
-            # Save parameter into request
-            req._param = req.path[idx:].decode()
-            return self.parameterized_url_map[path2]
+        f, params, url_params = self._lookup_url(req.method, req.path)
+        if url_params:
+            # Save parameters into request
+            req._params = url_params
+        return (f, params)
+
+    def _match_route(self, path):
+        """Helper to find router node by path.
+        Returns tuple of (node, url_params) or (None, None) if not found.
+        """
+        # First try - URLs without parameters
+        node = self.static_routes.get(path)
+        if node:
+            return (node, None)
+        # Second try - walk trie segment by segment
+        node = self.root_route
+        url_params = None
+        for segment in path.split(b'/')[1:]:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.param_child
+                if child is None or segment == b'':
+                    return (None, None)
+                if url_params is None:
+                    url_params = {}
+                url_params[node.param_name] = segment.decode()
+            node = child
+        if not node.handlers:
+            return (None, None)
+        return (node, url_params)
+
+    def _lookup_url(self, method, path):
+        """Helper to find URL handler by method and path.
+        Returns tuple of (function, opts, url_params) or (None, None, None) if not found.
+        """
+        node, url_params = self._match_route(path)
+        if node:
+            return node.find_handler(method) + (url_params,)
 
         if self.catch_all_handler:
-            return self.catch_all_handler
+            return self.catch_all_handler + (None,)
 
         # No handler found
-        return (None, None)
+        return (None, None, None)
+
+    def call_resource(self, method, path, data):
+        """Call RESTful resource handler directly, without HTTP round trip.
+        Used to serve several resource operations from single request.
+
+        Arguments:
+            method - HTTP method as bytestring, e.g. b'GET'
+            path - resource URL as bytestring, e.g. b'/api/fan/speed'
+            data - dict of data to pass to handler, as if it came from request body
+
+        Returns tuple of (HTTP code, result), result is None in case of error.
+        """
+        f, params, url_params = self._lookup_url(method, path)
+        if f is not restful_resource_handler:
+            return (404, None)
+        if method not in params['_callmap']:
+            return (405, None)
+        _handler, _kwargs = params['_callmap'][method]
+        if url_params:
+            _kwargs = dict(_kwargs)
+            _kwargs.update(url_params)
+        res = _handler(data, **_kwargs)
+        if isinstance(res, type_gen):
+            res = ''.join(res)
+        if type(res) == tuple:
+            return (res[1], res[0])
+        return (200, res)
 
     async def _handle_request(self, req, resp):
         await req.read_request_line()
@@ -437,10 +843,12 @@ class webserver:
         HTTP/1.0 protocol implementation
         """
         gc.collect()
+        start_ms = time.ticks_ms()
+        start_alloc = gc.mem_alloc()
+        req = request(reader)
+        resp = response(writer)
 
         try:
-            req = request(reader)
-            resp = response(writer)
             # Read HTTP Request with timeout
             await asyncio.wait_for(self._handle_request(req, resp),
                                    self.request_timeout)
@@ -460,10 +868,14 @@ class webserver:
             if req.method not in req.params['methods']:
                 raise HTTPException(405)
 
+            # HEAD is served by GET handler, only headers are sent
+            if req.method == b'HEAD':
+                resp.headers_only = True
+
             # Handle URL
             gc.collect()
-            if hasattr(req, '_param'):
-                await req.handler(req, resp, req._param)
+            if hasattr(req, '_params'):
+                await req.handler(req, resp, **req._params)
             else:
                 await req.handler(req, resp)
             # Done here
@@ -495,10 +907,15 @@ class webserver:
                 pass
         finally:
             await writer.aclose()
+            if self.request_observer:
+                route = 'other'
+                if getattr(req, 'params', None) and '_url' in req.params:
+                    route = req.params['_url']
+                self.request_observer(route, resp.code, time.ticks_diff(time.ticks_ms(), start_ms), gc.mem_alloc() - start_alloc)
             # Max concurrency support -
             # if queue is full schedule resume of TCP server task
             if len(self.conns) == self.max_concurrency:
-                self.loop.create_task(self._server_coro)
+                self._server_task = self.loop.create_task(self._server_coro)
             # Delete connection, using socket as a key
             del self.conns[id(writer.s)]
 
@@ -506,13 +923,15 @@ class webserver:
         """Add URL to function mapping.
 
         Arguments:
-            url - url to map function with
+            url - url to map function with. Path segments like <name> are parameters,
+                  passed to function as keyword arguments, e.g. '/api/history/<channel>/<tier>'
             f - function to map
 
         Keyword arguments:
             methods - list of allowed methods. Defaults to ['GET', 'POST']
             save_headers - contains list of HTTP headers to be saved. Case sensitive. Default - empty.
             max_body_size - Max HTTP body size (e.g. POST form data). Defaults to 1024
+            max_field_size - Max size of single decoded urlencoded form field. Defaults to 128
             allowed_access_control_headers - Default value for the same name header. Defaults to *
             allowed_access_control_origins - Default value for the same name header. Defaults to *
         """
@@ -522,35 +941,50 @@ class webserver:
         params = {'methods': ['GET'],
                   'save_headers': [],
                   'max_body_size': 1024,
+                  'max_field_size': 128,
                   'allowed_access_control_headers': '*',
                   'allowed_access_control_origins': '*',
                   }
         params.update(kwargs)
+        params['_url'] = url
         params['allowed_access_control_methods'] = ', '.join(params['methods'])
         # Convert methods/headers to bytestring
         params['methods'] = [x.encode() for x in params['methods']]
         params['save_headers'] = [x.encode() for x in params['save_headers']]
-        # If URL has a parameter
-        if url.endswith('>'):
-            idx = url.rfind('<')
-            path = url[:idx]
-            idx += 1
-            param = url[idx:-1]
-            if path.encode() in self.parameterized_url_map:
-                raise ValueError('URL exists')
-            params['_param_name'] = param
-            self.parameterized_url_map[path.encode()] = (f, params)
-
-        if url.encode() in self.explicit_url_map:
-            raise ValueError('URL exists')
-        self.explicit_url_map[url.encode()] = (f, params)
-
-    def add_resource(self, cls, url, **kwargs):
+        # GET handlers serve HEAD requests as well
+        if b'GET' in params['methods']:
+            params['methods'].append(b'HEAD')
+        # Walk / build trie, URL segments like <name> are parameters
+        node = self.root_route
+        has_params = False
+        for segment in url.split('/')[1:]:
+            if segment.startswith('<') and segment.endswith('>'):
+                has_params = True
+                name = segment[1:-1]
+                if node.param_child is None:
+                    node.param_child = route_node()
+                    node.param_name = name
+                elif node.param_name != name:
+                    raise ValueError('Conflicting URL parameter')
+                node = node.param_child
+            else:
+                segment = segment.encode()
+                if segment not in node.children:
+                    node.children[segment] = route_node()
+                node = node.children[segment]
+        for method in params['methods']:
+            if method != b'HEAD':
+                node.add_handler(method, f, params)
+        if not has_params:
+            self.static_routes[url.encode()] = node
+
+    def add_resource(self, cls, url, max_body_size=1024, **kwargs):
         """Map resource (RestAPI) to URL
 
         Arguments:
             cls - Resource class to map to
             url - url to map to class
+            max_body_size - Max HTTP body size, as for add_route(). Defaults to 1024
             kwargs - User defined key args to pass to the handler.
 
         Example:
@@ -577,6 +1011,7 @@ class webserver:
         self.add_route(url, restful_resource_handler,
                        methods=methods,
                        save_headers=['Content-Length', 'Content-Type'],
+                       max_body_size=max_body_size,
                        _callmap=callmap)
 
     def catchall(self):
@@ -589,7 +1024,7 @@ class webserver:
                 await response.start_html()
                 await response.send('<html><body><h1>My custom 404!</h1></html>\n')
         """
-        params = {'methods': [b'GET'], 'save_headers': [], 'max_body_size': 1024, 'allowed_access_control_headers': '*', 'allowed_access_control_origins': '*'}
+        params = {'methods': [b'GET'], 'save_headers': [], 'max_body_size': 1024, 'max_field_size': 128, 'allowed_access_control_headers': '*', 'allowed_access_control_origins': '*'}
 
         def _route(f):
             self.catch_all_handler = (f, params)
@@ -658,8 +1093,9 @@ class webserver:
                 hid = id(csock)
                 handler = self._handler(asyncio.StreamReader(csock),
                                         asyncio.StreamWriter(csock, {}))
-                self.conns[hid] = handler
-                self.loop.create_task(handler)
+                # uasyncio v3 cancels tasks rather than coroutines
+                task = self.loop.create_task(handler)
+                self.conns[hid] = task if IS_UASYNCIO_V3 else handler
                 # In case of max concurrency reached - temporary pause server:
                 # 1. backlog must be greater than max_concurrency, otherwise
                 #    client will got "Connection Reset"
@@ -681,12 +1117,17 @@ class webserver:
             loop_forever - run loo.loop_forever(), otherwise caller must run it by itself.
         """
         self._server_coro = self._tcp_server(host, port, self.backlog)
-        self.loop.create_task(self._server_coro)
+        self._server_task = self.loop.create_task(self._server_coro)
         if loop_forever:
             self.loop.run_forever()
 
     def shutdown(self):
         """Gracefully shutdown Web Server"""
+        if IS_UASYNCIO_V3:
+            self._server_task.cancel()
+            for hid, task in self.conns.items():
+                task.cancel()
+            return
         asyncio.cancel(self._server_coro)
         for hid, coro in self.conns.items():
             asyncio.cancel(coro)
\ No newline at end of file
@@ -1,56 +1,122 @@
-from http.webserver import webserver
+from http.webserver import webserver, HTTPException, websocket_accept, WebSocketClosed
 import config
-from lib.fan import Fan
-from lib.battery import Battery_Monitor
 from json import dumps
-from lib.light import Light
-from lib.motion import Motion_Detector
 from lib.ulogging import uLogger
+from lib.events import Event_Publisher
+from lib.metrics import Metrics
 import uasyncio
+from time import ticks_ms
+from lib.task_profiler import create_task, Task_Profiler
+from lib.memory_profiler import Memory_Profiler
 
 class Web_App:
 
     def __init__(self, log_level: int, module_list: dict) -> None: #TODO: module_list should probably be modules, named list of type dict is confusing.
         """
-        module_list is a dictionary of required modules, this should take the structure:
-        {'fan_module': Fan, 'battery_monitor': Battery_Monitor}
+        module_list is a dictionary of loaded modules, this should take the structure:
+        {'fan': Fan, 'battery_monitor': Battery_Monitor}
+        Optional modules disabled in config are absent and their API routes are not registered.
         """
         self.ulogger = uLogger("Web app", log_level)
         self.ulogger.info("Init webserver")
-        self.app = webserver()
+        # Each live update subscriber and control socket holds a connection open, so allow for them on top of normal requests
+        self.app = webserver(max_concurrency=3 + config.sse_max_subscribers + config.websocket_max_clients)
         self.all_modules = module_list
         self.environment = module_list['environment']
-        self.fan = module_list['fan']
-        self.battery_monitor = module_list['battery_monitor']
-        self.motion = module_list['motion']
-        self.light = module_list['light']
+        self.fan = module_list.get('fan')
+        self.battery_monitor = module_list.get('battery_monitor')
+        self.motion = module_list.get('motion')
+        self.light = module_list.get('light')
+        self.offline_queue = module_list.get('offline_queue')
         self.wlan = module_list['wlan']
         self.display = module_list['display']
+        self.power = module_list['power']
+        self.events: Event_Publisher = module_list['events']
+        self.metrics: Metrics = module_list['metrics']
+        self.task_profiler: Task_Profiler = module_list['task_profiler']
+        self.memory_profiler: Memory_Profiler = module_list['memory_profiler']
+        self.app.request_observer = self.observe_request
+        self.events.add_listener(self.update_from_event)
         self.running = False
+        self.started_ms = 0
+        # Set while a start is held back by critical battery, resume_web_server then starts the server
+        self.start_pending = False
+        self.websocket_clients = 0
         self.create_js()
         self.create_style_css()
         self.create_homepage()
         self.create_api()
+        self.create_event_stream()
+        if self.light:
+            self.create_control_socket()
+        self.create_metrics()
 
     def init_service(self):
-        network_access = uasyncio.run(self.wlan.check_network_access())
+        # Waits without a timeout, so a slow first connection or a later reconnect still starts the server
+        self.ulogger.info("Web server starts once network is available")
+        create_task(self.start_when_network_ready(), "web server start")
+    
+    def web_disabled_by_battery(self) -> bool:
+        return config.battery_critical_disables_web and self.power.battery_state == "critical"
+
+    def start_web_server(self) -> None:
+        if self.web_disabled_by_battery():
+            self.ulogger.warn("Battery critical - web server starts once the battery recovers")
+            self.start_pending = True
+            self.update_status()
+            return
+        self.start_pending = False
+        self.ulogger.info("Starting web server")
+        self.app.run(host='0.0.0.0', port=config.web_port, loop_forever=False)
+        self.running = True
+        # ticks_ms counts from power on
+        self.started_ms = ticks_ms()
+        self.ulogger.info(f"Web server started {self.started_ms}ms after power on")
+        if self.started_ms > config.fast_boot_web_target_s * 1000:
+            self.ulogger.warn(f"Web server started later than the {config.fast_boot_web_target_s}s boot target")
+        self.update_status()
+    
+    def stop_web_server(self) -> None:
+        if self.running:
+            self.ulogger.warn("Stopping web server")
+            self.app.shutdown()
+            self.running = False
+            self.update_status()
 
-        if network_access == True:
-            self.ulogger.info("Starting web server")
+    def resume_web_server(self) -> None:
+        """Restart a web server stopped by stop_web_server, or start one held back by critical battery"""
+        if self.start_pending:
+            self.start_web_server()
+        elif not self.running and self.started_ms:
+            self.ulogger.info("Resuming web server")
             self.app.run(host='0.0.0.0', port=config.web_port, loop_forever=False)
             self.running = True
-            self.ulogger.info("Starting web monitor")
-            uasyncio.create_task(self.status_monitor())
-        else:
-            self.ulogger.error("No network access - web server not started")
+            self.update_status()
+
+    async def start_when_network_ready(self) -> None:
+        await self.wlan.wait_for_link()
+        self.start_web_server()
     
-    async def status_monitor(self) -> None:
-        while True:
-            if self.wlan.dump_status() == 3 and self.running:
-                self.display.update_main_display_values({"web_server": str(self.wlan.ip) + ":" + str(config.web_port)})
-            else:
-                self.display.update_main_display_values({"web_server": "Stopped"})
-            await uasyncio.sleep(5)
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['running'] = self.running
+        all_data['started ms after power on'] = self.started_ms
+        return all_data
+    
+    def observe_request(self, route: str, code: int, elapsed_ms: int, alloc_bytes: int) -> None:
+        self.metrics.observe_request(route, code, elapsed_ms)
+        if self.memory_profiler.enabled:
+            self.memory_profiler.record("web " + route, alloc_bytes, -alloc_bytes)
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        if "link_up" in changed:
+            self.update_status()
+
+    def update_status(self) -> None:
+        if self.wlan.is_connected() and self.running:
+            self.display.update_main_display_values({"web_server": str(self.wlan.ip) + ":" + str(config.web_port)})
+        else:
+            self.display.update_main_display_values({"web_server": "Stopped"})
 
     def create_js(self):
         @self.app.route('/js/api.js')
@@ -67,22 +133,117 @@ class Web_App:
         async def index(request, response):
             await response.send_file('/http/html/index.html')
 
+    def create_event_stream(self) -> None:
+        @self.app.route('/api/events')
+        async def events(request, response):
+            if response.headers_only:
+                # HEAD gets the stream headers without taking a subscriber slot, writes are discarded so the stream would never end
+                await response.start_event_stream()
+                return
+            subscriber = self.events.subscribe()
+            if subscriber is None:
+                raise HTTPException(503)
+            
+            try:
+                await response.start_event_stream()
+                while True:
+                    try:
+                        event = await uasyncio.wait_for(subscriber.get(), config.sse_keepalive_s)
+                    except uasyncio.TimeoutError:
+                        await response.send_event_keepalive()
+                        continue
+                    await response.send_event(dumps(event))
+            finally:
+                self.events.unsubscribe(subscriber)
+
+    def create_control_socket(self) -> None:
+        @self.app.route('/api/ws', save_headers=['Upgrade', 'Sec-WebSocket-Key'])
+        async def control(request, response):
+            if self.websocket_clients >= config.websocket_max_clients:
+                raise HTTPException(503)
+            
+            self.websocket_clients += 1
+            try:
+                ws = await websocket_accept(request, response, config.websocket_max_frame_size)
+                while True:
+                    try:
+                        command = await uasyncio.wait_for(ws.recv(), config.websocket_idle_timeout_s)
+                    except uasyncio.TimeoutError:
+                        await ws.close()
+                        return
+                    await ws.send(dumps(self.run_control_command(command)))
+            except WebSocketClosed:
+                self.ulogger.info("Control socket closed")
+            finally:
+                self.websocket_clients -= 1
+
+    def run_control_command(self, command: str) -> dict:
+        """
+        Run a compact control socket command and return light and motion state.
+        Commands: "light on", "light off", "brightness <0-100>", "motion enabled", "motion disabled", "state"
+        """
+        self.ulogger.info(f"Control socket command: {command}")
+        result = {}
+        args = command.split()
+        name = args[0] if args else ""
+        value = args[1] if len(args) > 1 else ""
+
+        if name == "light" and value in ("on", "off"):
+            if self.motion:
+                self.motion.disable()
+            if value == "on":
+                self.light.on()
+            else:
+                self.light.off()
+        elif name == "brightness" and value.isdigit() and int(value) <= 100:
+            self.light.set_brightness_pc(int(value))
+        elif name == "motion" and value in ("enabled", "disabled") and self.motion:
+            if value == "enabled":
+                self.motion.enable()
+            else:
+                self.motion.disable()
+        elif name != "state":
+            result["error"] = "Unrecognised command: " + command
+
+        result["light_state"] = self.light.get_state()
+        result["light_brightness"] = self.light.get_brightness_pc()
+        result["light_motion_detection"] = self.motion.get_enabled() if self.motion else False
+        return result
+
+    def create_metrics(self) -> None:
+        @self.app.route('/metrics')
+        async def metrics(request, response):
+            response.add_header('Content-Type', 'text/plain; version=0.0.4')
+            await response._send_headers()
+            for line in self.metrics.exposition_lines():
+                await response.send(line)
+
     def create_api(self) -> None:
         @self.app.route('/api')
         async def api(request, response):
             await response.send_file('/http/html/api.html')
         
         self.app.add_resource(all_data, '/api/all_data', environment_modules = self.all_modules, ulogger = self.ulogger)
-        self.app.add_resource(indoor_humidity, '/api/fan/indoor_humidity', fan = self.fan, ulogger = self.ulogger)
-        self.app.add_resource(outdoor_humidity, '/api/fan/outdoor_humidity', fan = self.fan, ulogger = self.ulogger)
-        self.app.add_resource(fan_speed, '/api/fan/speed', fan = self.fan, ulogger = self.ulogger)
-        self.app.add_resource(battery_voltage, '/api/battery/voltage', battery_monitor = self.battery_monitor, ulogger = self.ulogger)
-        self.app.add_resource(light_brightness, '/api/light/brightness', light = self.light, ulogger = self.ulogger)
-        self.app.add_resource(light_state, '/api/light/state', light = self.light, motion = self.motion, ulogger = self.ulogger)
-        self.app.add_resource(light_motion_detection, '/api/light/motion_detection', motion = self.motion, ulogger = self.ulogger)
-        self.app.add_resource(motion_state, '/api/motion/state', motion = self.motion, ulogger = self.ulogger)
+        self.app.add_resource(batch, '/api/batch', max_body_size = config.batch_max_operations * config.batch_max_operation_bytes, app = self.app, ulogger = self.ulogger)
+        if self.fan:
+            self.app.add_resource(indoor_humidity, '/api/fan/indoor_humidity', fan = self.fan, ulogger = self.ulogger)
+            self.app.add_resource(outdoor_humidity, '/api/fan/outdoor_humidity', fan = self.fan, ulogger = self.ulogger)
+            self.app.add_resource(fan_speed, '/api/fan/speed', fan = self.fan, ulogger = self.ulogger)
+        if self.battery_monitor:
+            self.app.add_resource(battery_voltage, '/api/battery/voltage', battery_monitor = self.battery_monitor, ulogger = self.ulogger)
+        if self.light:
+            self.app.add_resource(light_brightness, '/api/light/brightness', light = self.light, ulogger = self.ulogger)
+            self.app.add_resource(light_state, '/api/light/state', light = self.light, motion = self.motion, ulogger = self.ulogger)
+        if self.motion:
+            self.app.add_resource(light_motion_detection, '/api/light/motion_detection', motion = self.motion, ulogger = self.ulogger)
+            self.app.add_resource(motion_state, '/api/motion/state', motion = self.motion, ulogger = self.ulogger)
         self.app.add_resource(wlan_mac, '/api/wlan/mac', wlan = self.wlan, ulogger = self.ulogger)
+        self.app.add_resource(wlan_telemetry, '/api/wlan/telemetry', wlan = self.wlan, ulogger = self.ulogger)
+        if self.offline_queue:
+            self.app.add_resource(offline_queue, '/api/offline_queue', offline_queue = self.offline_queue, ulogger = self.ulogger)
         self.app.add_resource(version, '/api/version', environment = self.environment, ulogger = self.ulogger)
+        self.app.add_resource(task_profile, '/api/profiler/tasks', task_profiler = self.task_profiler, ulogger = self.ulogger)
+        self.app.add_resource(memory_profile, '/api/profiler/memory', memory_profiler = self.memory_profiler, ulogger = self.ulogger)
 
 class all_data():
 
@@ -102,9 +263,56 @@ class all_data():
         ulogger.info(f"Return value: {html}")
         return html
 
+class batch():
+
+    def post(self, data, app: webserver, ulogger: uLogger):
+        """
+        Run a JSON list of resource operations: [{"method": "GET", "path": "/api/fan/speed", "data": {}}, ...]
+        Returns a JSON list of {"method", "path", "status", "result"} in the same order.
+        """
+        ulogger.info("API request - (POST) batch")
+        if type(data) is not list:
+            return {"message": "Expected a JSON list of operations"}, 400
+        if len(data) > config.batch_max_operations:
+            return {"message": "Too many operations, maximum is " + str(config.batch_max_operations)}, 413
+        
+        results = []
+        for operation in data:
+            if type(operation) is not dict:
+                operation = {}
+            method = str(operation.get("method", "GET")).upper()
+            path = str(operation.get("path", ""))
+            status = 400
+            result = None
+            if path == "/api/batch":
+                result = dumps("Nested batch requests are not supported")
+            else:
+                try:
+                    status, result = app.call_resource(method.encode(), path.encode(), operation.get("data", {}))
+                    result = self.result_json(result)
+                except Exception as e:
+                    ulogger.warn(f"Batch operation {method} {path} failed: {e}")
+                    status = 500
+                    result = dumps(str(e))
+            results.append('{"method": ' + dumps(method) + ', "path": ' + dumps(path) + ', "status": ' + str(status) + ', "result": ' + result + '}')
+        
+        html = "[" + ", ".join(results) + "]"
+        ulogger.info(f"Return value: {html}")
+        return html
+
+    def result_json(self, result) -> str:
+        """JSON for an operation result, resources return JSON text or a value sent as JSON, as in an HTTP response"""
+        if result is None:
+            return "null"
+        if type(result) is str:
+            return result
+        if type(result) in (dict, list, int, float, bool):
+            return dumps(result)
+        raise TypeError("Unsupported result type " + type(result).__name__)
+
 class indoor_humidity():
 
-    def get(self, data, fan: Fan, ulogger: uLogger):
+    def get(self, data, fan, ulogger: uLogger):
         ulogger.info("API request - fan/indoor_humidity")
         html = dumps(fan.get_latest_indoor_humidity())
         ulogger.info(f"Return value: {html}")
@@ -112,7 +320,7 @@ class indoor_humidity():
 
 class outdoor_humidity():
 
-    def get(self, data, fan: Fan, ulogger: uLogger):
+    def get(self, data, fan, ulogger: uLogger):
         ulogger.info("API request - fan/outdoor_humidity")
         html = dumps(fan.get_latest_outdoor_humidity())
         ulogger.info(f"Return value: {html}")
@@ -120,7 +328,7 @@ class outdoor_humidity():
     
 class fan_speed():
 
-    def get(self, data, fan: Fan, ulogger: uLogger):
+    def get(self, data, fan, ulogger: uLogger):
         ulogger.info("API request - fan/speed")
         html = dumps(fan.get_fan_speed() * 100)
         ulogger.info(f"Return value: {html}")
@@ -128,21 +336,21 @@ class fan_speed():
     
 class battery_voltage():
 
-    def get(self, data, battery_monitor: Battery_Monitor, ulogger: uLogger):
+    def get(self, data, battery_monitor, ulogger: uLogger):
         ulogger.info("API request - battery/voltage")
-        html = dumps(round(battery_monitor.read_battery_voltage(), 2))
+        html = dumps(round(battery_monitor.get_latest_voltage(), 2))
         ulogger.info(f"Return value: {html}")
         return html
 
 class light_brightness():
 
-    def get(self, data, light: Light, ulogger: uLogger):
+    def get(self, data, light, ulogger: uLogger):
         ulogger.info("API request - light/brightness")
         html = dumps(light.get_brightness_pc())
         ulogger.info(f"Return value: {html}")
         return html
     
-    def put(self, data, light: Light, ulogger: uLogger):
+    def put(self, data, light, ulogger: uLogger):
         ulogger.info("API request - (PUT) fan/indoor_humidity")
         html = {}
         brightness = int(data["value"])
@@ -161,21 +369,23 @@ class light_brightness():
 
 class light_state():
 
-    def get(self, data, light: Light, motion: Motion_Detector, ulogger: uLogger):
+    def get(self, data, light, motion, ulogger: uLogger):
         ulogger.info("API request - light/state")
         html = dumps(light.get_state())
         ulogger.info(f"Return value: {html}")
         return html
     
-    def put(self, data, light: Light, motion: Motion_Detector, ulogger: uLogger):
+    def put(self, data, light, motion, ulogger: uLogger):
         ulogger.info("API request - (PUT) light/state)")
         html = {}
         if data["state"] == "on":
-            motion.disable()
+            if motion:
+                motion.disable()
             light.on()
             html["Message"] = "Light set on"
         elif data["state"] == "off":
-            motion.disable()
+            if motion:
+                motion.disable()
             light.off()
             html["Message"] = "Light set off"
         else:
@@ -187,13 +397,13 @@ class light_state():
     
 class light_motion_detection():
 
-    def get(self, data, motion: Motion_Detector, ulogger: uLogger):
+    def get(self, data, motion, ulogger: uLogger):
         ulogger.info("API request - light/motion_detection")
         html = dumps(motion.get_enabled())
         ulogger.info(f"Return value: {html}")
         return html
     
-    def put(self, data, motion: Motion_Detector, ulogger: uLogger):
+    def put(self, data, motion, ulogger: uLogger):
         ulogger.info("API request - (PUT) light/motion_detection)")
         html = {}
         if data["state"] == "enabled":
@@ -211,7 +421,7 @@ class light_motion_detection():
 
 class motion_state():
 
-    def get(self, data, motion: Motion_Detector, ulogger: uLogger):
+    def get(self, data, motion, ulogger: uLogger):
         ulogger.info("API request - motion/state")
         html = dumps(motion.get_state())
         ulogger.info(f"Return value: {html}")
@@ -225,10 +435,42 @@ class wlan_mac():
         ulogger.info(f"Return value: {html}")
         return html
     
+class wlan_telemetry():
+
+    def get(self, data, wlan, ulogger: uLogger):
+        ulogger.info("API request - wlan/telemetry")
+        html = dumps(wlan.telemetry.get_all_data())
+        ulogger.info(f"Return value: {html}")
+        return html
+
+class offline_queue():
+
+    def get(self, data, offline_queue, ulogger: uLogger):
+        ulogger.info("API request - offline_queue")
+        html = dumps(offline_queue.get_all_data())
+        ulogger.info(f"Return value: {html}")
+        return html
+
 class version():
 
     def get(self, data, environment, ulogger: uLogger):
         ulogger.info("API request - all_data")
         html = dumps(environment.get_version())
         ulogger.info(f"Return value: {html}")
-        return html
\ No newline at end of file
+        return html
+
+class task_profile():
+
+    def get(self, data, task_profiler: Task_Profiler, ulogger: uLogger):
+        ulogger.info("API request - profiler/tasks")
+        html = dumps(task_profiler.get_all_data())
+        ulogger.info(f"Return value: {html}")
+        return html
+
+class memory_profile():
+
+    def get(self, data, memory_profiler: Memory_Profiler, ulogger: uLogger):
+        ulogger.info("API request - profiler/memory")
+        html = dumps(memory_profiler.get_all_data())
+        ulogger.info(f"Return value: {html}")
+        return html
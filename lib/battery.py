@@ -3,14 +3,19 @@ Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni
 """
 
 from machine import ADC
+from array import array
 import config
 from lib.ulogging import uLogger
 import asyncio
+from lib.task_profiler import create_task
 from time import time
 from display import Display
+from lib.events import Event_Publisher
+from lib.scheduler import Scheduler
+from lib.battery_estimator import Battery_Estimator
 
 class Battery_Monitor:
-    def __init__(self, log_level: int, display: Display) -> None:
+    def __init__(self, log_level: int, display: Display, events: Event_Publisher, scheduler: Scheduler) -> None:
         self.logger = uLogger("Battery monitor", log_level)
         self.logger.info(f"Init battery monitor")
         self.r1 = config.r1
@@ -19,44 +24,125 @@ class Battery_Monitor:
         self.scaling_factor = (1 / (self.r2 / (self.r1 + self.r2)))
         self.battery_ADC = ADC(config.battery_adc_pin)
         self.reading_updated = asyncio.Event()
+        # Buffers are preallocated and sorted in place so readings allocate nothing on the heap
+        self.oversample_count = config.battery_oversample_count
+        self.samples = [0] * self.oversample_count
+        self.filter = config.battery_filter
+        self.ema_alpha = config.battery_ema_alpha
+        self.window = array('f', [0] * config.battery_filter_window)
+        self.sorted_window = [0.0] * config.battery_filter_window
+        self.window_count = 0
+        self.ema = 0
+        self.raw_reading = 0
         self.last_reading = 0
+        self.estimator = Battery_Estimator(log_level, events)
         self.last_reading_time = 0
         self.display = display
+        self.events = events
+        self.scheduler = scheduler
+        self.NORMAL = "normal"
+        self.LOW = "low"
+        self.CRITICAL = "critical"
+        self.state = self.NORMAL
+        self.low_voltage = config.battery_low_voltage
+        self.critical_voltage = config.battery_critical_voltage
+        self.hysteresis_v = config.battery_state_hysteresis_v
+        self.max_transitions = 8
+        self.transitions = []
 
     def init_service(self) -> None:
         self.logger.info("Init battery voltage poll")
-        asyncio.create_task(self.poll_battery_voltage())
+        self.scheduler.every("battery poll", 5, self.poll_battery_voltage, run_now=True)
         if self.display.enabled:
             self.logger.info("Init battery voltage display updater")
-            asyncio.create_task(self.battery_display_updater())
+            create_task(self.battery_display_updater(), "battery display updater")
         else:
             self.logger.info("Display disabled, skipping battery display updater service")
 
+    def read_oversampled_adc(self) -> float:
+        """Mean of battery_oversample_count ADC samples, discarding the highest and lowest quarter as outliers"""
+        for index in range(self.oversample_count):
+            self.samples[index] = self.battery_ADC.read_u16()
+        self.samples.sort()
+        trim = self.oversample_count // 4
+        total = 0
+        for index in range(trim, self.oversample_count - trim):
+            total += self.samples[index]
+        return total / (self.oversample_count - (2 * trim))
+
     def read_battery_voltage(self) -> float:
-        adc_value = self.battery_ADC.read_u16()
-        self.logger.info(f"ADC value: {adc_value}")
-        uncalibrated_adc_voltage = adc_value * (3.3 / 65535)
-        self.logger.info(f"Uncalibrated ADC voltage: {uncalibrated_adc_voltage}")
+        """Unfiltered calibrated battery voltage from an oversampled ADC reading"""
+        uncalibrated_adc_voltage = self.read_oversampled_adc() * (3.3 / 65535)
         uncalibrated_battery_voltage = uncalibrated_adc_voltage * self.scaling_factor
-        self.logger.info(f"Uncalibrated battery voltage: {uncalibrated_battery_voltage}")
-        calibrated_battery_voltage = uncalibrated_battery_voltage + self.voltage_correction
-        self.logger.info(f"Calibrated battery voltage: {calibrated_battery_voltage}")
+        return uncalibrated_battery_voltage + self.voltage_correction
 
-        return calibrated_battery_voltage
+    def filter_reading(self, voltage: float) -> float:
+        """Add a reading to the window and EMA, returning the median or EMA as configured"""
+        if self.window_count == 0:
+            # Prime the filter with the first reading so it is valid immediately
+            for index in range(len(self.window)):
+                self.window[index] = voltage
+            self.ema = voltage
+        self.window[self.window_count % len(self.window)] = voltage
+        self.window_count += 1
+        self.ema += self.ema_alpha * (voltage - self.ema)
+        if self.filter == "ema":
+            return self.ema
+        for index in range(len(self.window)):
+            self.sorted_window[index] = self.window[index]
+        self.sorted_window.sort()
+        return self.sorted_window[len(self.sorted_window) // 2]
     
-    async def poll_battery_voltage(self) -> None:
-        while True:
-            self.last_reading = self.read_battery_voltage()
-            self.last_reading_time = time()
-            self.reading_updated.set()
-            await asyncio.sleep(5)
+    def poll_battery_voltage(self) -> None:
+        self.raw_reading = self.read_battery_voltage()
+        self.last_reading = self.filter_reading(self.raw_reading)
+        self.last_reading_time = time()
+        self.logger.info(f"Battery voltage raw: {self.raw_reading} filtered: {self.last_reading}")
+        self.reading_updated.set()
+        self.update_state(self.last_reading)
+        self.estimator.update(self.last_reading)
+        self.events.publish("battery_monitor", {"battery_voltage": round(self.last_reading, 2), "battery_state": self.state, "battery_soc": self.estimator.soc_pc})
+
+    def next_state(self, voltage: float) -> str:
+        """
+        State for a voltage, dropping below each threshold and only recovering once above it plus the hysteresis.
+        A reading below battery_absent_voltage means no battery is connected, so is treated as normal.
+        """
+        if voltage < config.battery_absent_voltage:
+            return self.NORMAL
+        if voltage < self.critical_voltage:
+            return self.CRITICAL
+        if self.state == self.CRITICAL and voltage < self.critical_voltage + self.hysteresis_v:
+            return self.CRITICAL
+        if voltage < self.low_voltage:
+            return self.LOW
+        if self.state != self.NORMAL and voltage < self.low_voltage + self.hysteresis_v:
+            return self.LOW
+        return self.NORMAL
+
+    def update_state(self, voltage: float) -> None:
+        state = self.next_state(voltage)
+        if state == self.state:
+            return
+        self.logger.warn(f"Battery state {self.state} to {state} at {round(voltage, 2)}v")
+        self.transitions.append({"from": self.state, "to": state, "voltage": round(voltage, 2), "time": time()})
+        if len(self.transitions) > self.max_transitions:
+            self.transitions.pop(0)
+        self.state = state
+
+    def get_state(self) -> str:
+        return self.state
 
     async def battery_display_updater(self) -> None:
         while True:
             await self.reading_updated.wait()
             self.reading_updated.clear()
-            self.logger.info(f"{self.last_reading_time}: Battery voltage: {self.last_reading}")
-            self.display.update_main_display_values({"battery_voltage": str(round(self.last_reading, 2)) + "v"})
+            battery_text = str(round(self.last_reading, 2)) + "v " + str(round(self.estimator.soc_pc)) + "%"
+            if self.estimator.runtime_h >= 0:
+                battery_text += " " + str(round(self.estimator.runtime_h)) + "h"
+            if self.state != self.NORMAL:
+                battery_text += " " + self.state
+            self.display.update_main_display_values({"battery_voltage": battery_text})
     
     def get_latest_voltage(self) -> float:
         return self.last_reading    
@@ -64,4 +150,9 @@ class Battery_Monitor:
     def get_all_data(self) -> dict:
         all_data = {}
         all_data['voltage'] = self.get_latest_voltage()
+        all_data['raw voltage'] = self.raw_reading
+        all_data['filter'] = self.filter
+        all_data['estimate'] = self.estimator.get_all_data()
+        all_data['state'] = self.get_state()
+        all_data['transitions'] = self.transitions
         return all_data
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from array import array
+from time import ticks_ms, ticks_add, ticks_diff
+import config
+from lib.ulogging import uLogger
+from lib.events import Event_Publisher
+
+class Battery_Estimator:
+    """
+    Estimates battery state of charge and remaining runtime from the filtered battery voltage.
+    Voltage sags under load, so it is corrected to a resting voltage using the fan and light duty from change events
+    and the battery internal resistance, then mapped to a charge percent through the lookup table for the chemistry.
+    Runtime is projected from the least squares discharge slope of a rolling charge history, kept as running sums
+    so each sample updates the slope without iterating the history.
+    """
+    def __init__(self, log_level: int, events: Event_Publisher) -> None:
+        self.logger = uLogger("Battery estimator", log_level)
+        self.logger.info("Init battery estimator")
+        self.soc_table = config.battery_soc_tables[config.battery_chemistry]
+        self.internal_resistance_ohm = config.battery_internal_resistance_ohm
+        self.fan_current_a = config.battery_fan_current_a
+        self.light_current_a = config.battery_light_current_a
+        self.history_interval_ms = config.battery_history_interval_s * 1000
+        self.history_length = config.battery_history_length
+        self.fan_duty = 0
+        self.light_duty = 0
+        self.light_on = False
+        self.light_brightness_pc = 0
+        self.compensated_voltage = 0
+        self.soc_pc = -1
+        self.runtime_h = -1
+        # Rolling history of (hours since the first sample, charge percent) with running least squares sums
+        self.history_hours = array('f', [0] * self.history_length)
+        self.history_soc = array('f', [0] * self.history_length)
+        self.history_count = 0
+        self.history_start_ms = 0
+        self.last_history_ms = 0
+        self.sum_t = 0.0
+        self.sum_s = 0.0
+        self.sum_tt = 0.0
+        self.sum_ts = 0.0
+        events.add_listener(self.update_from_event)
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        if "fan_speed" in changed:
+            self.fan_duty = changed["fan_speed"] / 100
+        if "light_state" in changed:
+            self.light_on = changed["light_state"]
+        if "light_brightness" in changed:
+            self.light_brightness_pc = changed["light_brightness"]
+        if "light_state" in changed or "light_brightness" in changed:
+            # Matches the gamma corrected PWM duty of the light module
+            self.light_duty = (self.light_brightness_pc / 100) ** 2 if self.light_on else 0
+
+    def load_current_a(self) -> float:
+        return (self.fan_duty * self.fan_current_a) + (self.light_duty * self.light_current_a)
+
+    def voltage_to_soc(self, voltage: float) -> float:
+        """Interpolate charge percent from the (voltage, percent) table, ordered by descending voltage"""
+        table = self.soc_table
+        if voltage >= table[0][0]:
+            return table[0][1]
+        for index in range(1, len(table)):
+            upper = table[index - 1]
+            lower = table[index]
+            if voltage >= lower[0]:
+                return lower[1] + ((voltage - lower[0]) * (upper[1] - lower[1]) / (upper[0] - lower[0]))
+        return table[-1][1]
+
+    def update(self, voltage: float) -> None:
+        """Update the estimate from a filtered voltage reading"""
+        self.compensated_voltage = voltage + (self.load_current_a() * self.internal_resistance_ohm)
+        self.soc_pc = round(self.voltage_to_soc(self.compensated_voltage), 1)
+        now = ticks_ms()
+        if self.history_count == 0 or ticks_diff(now, self.last_history_ms) >= self.history_interval_ms:
+            self.last_history_ms = now
+            self.add_history(now, self.soc_pc)
+
+    def add_history(self, now: int, soc_pc: float) -> None:
+        if self.history_count == 0:
+            self.history_start_ms = now
+        index = self.history_count % self.history_length
+        if self.history_count >= self.history_length:
+            self.remove_from_sums(self.history_hours[index], self.history_soc[index])
+        hours = ticks_diff(now, self.history_start_ms) / 3600000
+        self.history_hours[index] = hours
+        self.history_soc[index] = soc_pc
+        self.history_count += 1
+        if index == self.history_length - 1:
+            # Once per pass of the history, rebase times to the oldest sample and recalculate the sums
+            # to keep the single precision floats small and clear rounding drift from the running sums
+            self.rebase_history()
+            self.recalculate_sums()
+        else:
+            self.add_to_sums(hours, soc_pc)
+        self.runtime_h = self.project_runtime_h()
+
+    def add_to_sums(self, hours: float, soc_pc: float) -> None:
+        self.sum_t += hours
+        self.sum_s += soc_pc
+        self.sum_tt += hours * hours
+        self.sum_ts += hours * soc_pc
+
+    def remove_from_sums(self, hours: float, soc_pc: float) -> None:
+        self.sum_t -= hours
+        self.sum_s -= soc_pc
+        self.sum_tt -= hours * hours
+        self.sum_ts -= hours * soc_pc
+
+    def rebase_history(self) -> None:
+        offset = min(self.history_hours)
+        for index in range(self.history_length):
+            self.history_hours[index] -= offset
+        self.history_start_ms = ticks_add(self.history_start_ms, int(offset * 3600000))
+
+    def recalculate_sums(self) -> None:
+        self.sum_t = 0.0
+        self.sum_s = 0.0
+        self.sum_tt = 0.0
+        self.sum_ts = 0.0
+        for index in range(min(self.history_count, self.history_length)):
+            self.add_to_sums(self.history_hours[index], self.history_soc[index])
+
+    def discharge_slope_pc_per_h(self) -> float:
+        """Least squares slope of charge percent against hours, 0 until there are enough samples"""
+        count = min(self.history_count, self.history_length)
+        if count < 3:
+            return 0
+        denominator = (count * self.sum_tt) - (self.sum_t * self.sum_t)
+        if denominator <= 0:
+            return 0
+        return ((count * self.sum_ts) - (self.sum_t * self.sum_s)) / denominator
+
+    def project_runtime_h(self) -> float:
+        """Hours until empty at the current discharge slope, or -1 if not discharging"""
+        slope = self.discharge_slope_pc_per_h()
+        if slope >= 0:
+            return -1
+        return round(self.soc_pc / -slope, 1)
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['chemistry'] = config.battery_chemistry
+        all_data['compensated voltage'] = round(self.compensated_voltage, 2)
+        all_data['load current a'] = round(self.load_current_a(), 2)
+        all_data['state of charge pc'] = self.soc_pc
+        all_data['discharge pc per h'] = round(self.discharge_slope_pc_per_h(), 2)
+        all_data['runtime h'] = self.runtime_h
+        return all_data
@@ -9,11 +9,12 @@ from lib.ulogging import uLogger
 
 class BME_280:
     
-    def __init__(self, log_level: int) -> None:
-        self.logger = uLogger("BME280", log_level)
-        self.logger.info("Init BME280")
-        self.i2c = PimoroniI2C(**config.i2c_pins)
-        self.bme = BreakoutBME280(self.i2c)
+    def __init__(self, log_level: int, i2c: PimoroniI2C | None = None, address: int = 0x76, name: str = "BME280") -> None:
+        """Pass a shared i2c bus to use several sensors on one bus, otherwise a bus is created on config.i2c_pins"""
+        self.logger = uLogger(name, log_level)
+        self.logger.info(f"Init BME280 at address {hex(address)}")
+        self.i2c = i2c if i2c is not None else PimoroniI2C(**config.i2c_pins)
+        self.bme = BreakoutBME280(self.i2c, address)
         self.get_readings() # Clear incorrect first value after startup
 
     def get_readings(self) -> dict:
@@ -25,4 +26,4 @@ class BME_280:
 
         self.logger.info(f"BME 280 readings collected: {readings}")
 
-        return readings
\ No newline at end of file
+        return readings
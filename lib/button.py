@@ -4,7 +4,7 @@ Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni
 
 from machine import Pin
 from ulogging import uLogger
-from asyncio import Event, sleep
+from asyncio import Event, ThreadSafeFlag, sleep
 
 class Button:
     """
@@ -24,6 +24,9 @@ class Button:
         if pull_up:
             self.pin_pull = Pin.PULL_UP
         self.pin = Pin(GPIO_pin, Pin.IN, self.pin_pull)
+        # Pin changes are signalled by interrupt so the watcher does not poll, and can wake the Pico from lightsleep
+        self.pin_changed = ThreadSafeFlag()
+        self.pin.irq(handler=self.pin_change_handler, trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING)
         self.name = name
         self.pressed_event: Event = pressed_event if pressed_event is not None else Event()
         self.released_event: Event = released_event if released_event is not None else Event()
@@ -37,14 +40,21 @@ class Button:
 
         while True:
             current_value = self.pin.value()
+            await self.pin_changed.wait()
             active = 0
-            while active < 20:
+            polls = 0
+            while active < 20 and polls < 100:
                 if self.pin.value() != current_value:
                     active += 1
                 else:
                     active = 0
+                polls += 1
                 await sleep(0.001)
 
+            if active < 20:
+                # Bounced back to the previous state
+                continue
+
             if self.pin.value() == 0:
                 self.logger.info(f"Button pressed: {self.name}")
                 self.pressed_event.set()
@@ -52,6 +62,9 @@ class Button:
                 self.logger.info(f"Button released: {self.name}")
                 self.released_event.set()
 
+    def pin_change_handler(self, pin: Pin) -> None:
+        self.pin_changed.set()
+
     def clear_pressed(self) -> None:
         self.pressed_event.clear()
     
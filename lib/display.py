@@ -2,25 +2,36 @@
 Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
 """
 
-from picographics import PicoGraphics, DISPLAY_PICO_DISPLAY, PEN_RGB332
-from pimoroni import RGBLED
 from lib.ulogging import uLogger
 import config
-from time import sleep, ticks_ms
-from asyncio import sleep as async_sleep, create_task
+from time import sleep, ticks_ms, ticks_diff
+from asyncio import sleep as async_sleep, Event, wait_for, TimeoutError
+from lib.task_profiler import create_task
+from lib.scheduler import Scheduler
+from lib.memory_profiler import measure
 
 class Display:
-    def __init__(self, log_level: int) -> None:
+    def __init__(self, log_level: int, scheduler: Scheduler) -> None:
         self.log_level = log_level
+        self.scheduler = scheduler
         self.logger = uLogger("Display", self.log_level)
         self.logger.info("Init Display")
         self.enabled = config.enable_display
+        self.backlight_timeout_s = config.backlight_timeout_s
+        self.mode = "startup"
+        self.backlight_state = False
+        # Fast boot queues startup text to be drawn by a task once services have started
+        self.fast_boot = config.enable_fast_boot
+        self.pending_text_lines = []
+        self.text_line_added = Event()
         if self.enabled:
             self.init_display()
         else:
             self.logger.info("Display disabled in config")
 
     def init_display(self) -> None:
+        # Graphics libraries are only imported when the display is enabled
+        from picographics import PicoGraphics, DISPLAY_PICO_DISPLAY, PEN_RGB332
         self.display = PicoGraphics(display=DISPLAY_PICO_DISPLAY, pen_type=PEN_RGB332, rotate=0)
         self.auto_page_scroll_pause_s = config.auto_page_scroll_pause_s
         self.GREEN = self.display.create_pen(0, 255, 0)
@@ -47,41 +58,51 @@ class Display:
     def startup_display(self) -> None:
         self.mode = "startup"
         self.logger.info("Startup Display")
+        from pimoroni import RGBLED
         self.rgb_led = RGBLED(2, 0, 0)
         self.backlight_on()
         self.print_startup_text()
 
     def init_service(self) -> None:
-        self.logger.info("Loading backlight monitor")
-        create_task(self.manage_backlight_timeout())
+        if not self.enabled:
+            self.logger.info("Display disabled in config - display services not loaded")
+            return
+        if self.fast_boot:
+            self.logger.info("Loading startup text renderer")
+            create_task(self.render_startup_text(), "startup text renderer")
 
     def backlight_on(self) -> None:
+        if not self.enabled:
+            return
         self.logger.info("Backlight on")
         self.display.set_backlight(1.0)
         self.backlight_on_time_ms = ticks_ms()
         self.backlight_state = True
+        self.scheduler.after("backlight timeout", self.backlight_timeout_s, self.backlight_timeout)
 
     def backlight_off(self) -> None:
+        if not self.enabled:
+            return
         self.logger.info("Backlight off")
         self.display.set_backlight(0)
         self.backlight_on_time_ms = 0
         self.backlight_state = False
+        self.scheduler.cancel("backlight timeout")
     
-    def should_backlight_be_switched_off(self) -> bool:
-        if self.backlight_on_time_ms > 0 and (self.backlight_on_time_ms + (config.backlight_timeout_s * 1000)) < ticks_ms() and self.mode != "startup":
-            return True
-        else:
-            return False
-    
-    async def manage_backlight_timeout(self) -> None:
-        if self.enabled:
-            self.logger.info("Starting backlight timeout management")
-            while True:
-                if self.should_backlight_be_switched_off():
-                    self.backlight_off()
-                await async_sleep(0.1)
+    def set_backlight_timeout_s(self, timeout_s: float) -> None:
+        """Set the backlight timeout, applied to the current on period if the backlight is on"""
+        self.logger.info(f"Backlight timeout set to {timeout_s}s")
+        self.backlight_timeout_s = timeout_s
+        if self.backlight_state:
+            remaining_s = max(0, timeout_s - (ticks_diff(ticks_ms(), self.backlight_on_time_ms) / 1000))
+            self.scheduler.after("backlight timeout", remaining_s, self.backlight_timeout)
+
+    def backlight_timeout(self) -> None:
+        """Scheduled backlight_timeout_s after the backlight is switched on, the backlight stays on during startup"""
+        if self.mode == "startup":
+            self.scheduler.after("backlight timeout", 1, self.backlight_timeout)
         else:
-            self.logger.info("Display not enabled - backlight monitor not started")
+            self.backlight_off()
 
     def clear_screen(self) -> None:
         self.display.set_pen(self.BACKGROUND)
@@ -107,28 +128,67 @@ class Display:
             
         return line_count
     
+    def text_line_end_y(self, text: str) -> int:
+        return self.current_y + (((self.font_height * self.normal_font_scale) + self.line_spacing) * self.get_text_line_count(text, self.normal_font_scale))
+    
+    def text_line_overflows_page(self, text: str) -> bool:
+        return self.text_line_end_y(text) > (self.HEIGHT - self.bottom_margin)
+    
     def add_text_line(self, text: str) -> None:
         if self.enabled:
-            next_y_start = self.current_y
-            next_y_end = next_y_start + (((self.font_height * self.normal_font_scale) + self.line_spacing) * self.get_text_line_count(text, self.normal_font_scale))
-            self.logger.info(f"Calculated next_y_end: {next_y_end}")
-            
-            if next_y_end > (self.HEIGHT - self.bottom_margin):
+            if self.mode == "main":
+                self.logger.info(f"Display text not shown over main display: {text}")
+                return
+
+            if self.fast_boot:
+                self.pending_text_lines.append(text)
+                self.text_line_added.set()
+                return
+
+            if self.text_line_overflows_page(text):
                 sleep(self.auto_page_scroll_pause_s)
                 self.clear_screen()
-                next_y_start = self.current_y
-                next_y_end = next_y_start + (((self.font_height * self.normal_font_scale) + self.line_spacing) * self.get_text_line_count(text, self.normal_font_scale))
-                self.logger.info(f"Reset to top of page and calculated next_y_end: {next_y_end}")
+                self.logger.info("Reset to top of page")
             
-            self.display.set_pen(self.WHITE)
-            self.display.text(text, self.left_margin, next_y_start, self.useable_width, self.normal_font_scale)
-            self.display.update()
-            self.current_y = next_y_end
-            self.logger.info(f"Current_y now set to : {self.current_y}")
+            self.draw_text_line(text)
         else:
             self.logger.info(f"Display text not shown as display disabled: {text}")
+    
+    def draw_text_line(self, text: str) -> None:
+        next_y_end = self.text_line_end_y(text)
+        self.logger.info(f"Calculated next_y_end: {next_y_end}")
+        self.display.set_pen(self.WHITE)
+        self.display.text(text, self.left_margin, self.current_y, self.useable_width, self.normal_font_scale)
+        self.display.update()
+        self.current_y = next_y_end
+        self.logger.info(f"Current_y now set to : {self.current_y}")
+    
+    async def render_startup_text(self) -> None:
+        """
+        Draw startup text queued during fast boot, pausing between pages without blocking.
+        Lines added by services while drawing or during the final pause are drawn too, the main display is shown
+        once no line has been added for a page pause.
+        """
+        while True:
+            self.text_line_added.clear()
+            while self.pending_text_lines:
+                text = self.pending_text_lines.pop(0)
+                if self.text_line_overflows_page(text):
+                    await async_sleep(self.auto_page_scroll_pause_s)
+                    self.clear_screen()
+                self.draw_text_line(text)
+                await async_sleep(0)
+            try:
+                await wait_for(self.text_line_added.wait(), self.auto_page_scroll_pause_s)
+            except TimeoutError:
+                break
+        # Lines added from here are logged rather than drawn over the main display
+        self.mode = "main"
+        self.update_main_display()
 
     def update_main_display_values(self, display_data: dict) -> None:
+        if not self.enabled:
+            return
         for key in display_data:
             if key in self.display_data:
                 self.display_data[key][1] = display_data[key]
@@ -138,15 +198,16 @@ class Display:
         self.update_main_display()
 
     def update_main_display(self) -> None:
-        if self.mode == "main":
-            self.clear_screen()
-            self.display.set_pen(self.WHITE)
-            next_y_start = self.current_y
-            for item in self.display_data:
-                text = self.display_data[item][0] + ": " + str(self.display_data[item][1])
-                self.display.text(text, self.left_margin, next_y_start, self.useable_width, self.normal_font_scale)
-                next_y_start = next_y_start + ((self.font_height * self.normal_font_scale) + self.line_spacing)
-            self.display.update()
+        if self.enabled and self.mode == "main":
+            with measure("display redraw"):
+                self.clear_screen()
+                self.display.set_pen(self.WHITE)
+                next_y_start = self.current_y
+                for item in self.display_data:
+                    text = self.display_data[item][0] + ": " + str(self.display_data[item][1])
+                    self.display.text(text, self.left_margin, next_y_start, self.useable_width, self.normal_font_scale)
+                    next_y_start = next_y_start + ((self.font_height * self.normal_font_scale) + self.line_spacing)
+                self.display.update()
 
     def get_backlight_state(self) -> bool:
         return self.backlight_state
\ No newline at end of file
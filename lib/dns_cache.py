@@ -0,0 +1,101 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+import socket
+from time import ticks_ms, ticks_add, ticks_diff
+import asyncio
+import config
+from lib.ulogging import uLogger
+from lib.scheduler import Scheduler
+from lib.task_profiler import create_task
+import uaiohttpclient
+
+class DNS_Entry:
+    def __init__(self, address: str, port: int, expires_ms: int, used_ms: int) -> None:
+        self.address = address
+        self.port = port
+        self.expires_ms = expires_ms
+        # Tick of the last resolve, entries idle for longer than dns_cache_idle_s are evicted
+        self.used_ms = used_ms
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+
+class DNS_Cache:
+    """
+    Caches resolved addresses for outbound requests, as getaddrinfo blocks the whole event loop for the DNS round trip.
+    Installed as the uaiohttpclient resolver so requests connect straight to a cached address. Entries are refreshed by
+    a scheduled job before they expire, and if a refresh fails the stale address keeps being used.
+    Each refresh runs as its own task so the event loop runs between lookups, and hosts not requested
+    for dns_cache_idle_s are evicted rather than refreshed. Only a host's first lookup blocks in the request path.
+    """
+    def __init__(self, log_level: int, scheduler: Scheduler) -> None:
+        self.logger = uLogger("DNS cache", log_level)
+        self.logger.info("Init DNS cache")
+        self.scheduler = scheduler
+        self.ttl_ms = config.dns_cache_ttl_s * 1000
+        self.idle_ms = config.dns_cache_idle_s * 1000
+        self.entries = {}
+        self.misses = 0
+        self.evictions = 0
+        uaiohttpclient.set_resolver(self.resolve)
+
+    def init_service(self) -> None:
+        self.logger.info("Loading DNS refresh")
+        # Refresh at half the TTL so entries are renewed before they expire
+        self.scheduler.every("dns refresh", config.dns_cache_ttl_s / 2, self.refresh_expiring)
+
+    def lookup(self, host: str, port: int) -> str:
+        return socket.getaddrinfo(host, port)[0][-1][0]
+
+    def resolve(self, host: str, port: int) -> str:
+        """Address for host, from the cache if present even when expired, otherwise looked up and cached"""
+        entry = self.entries.get(host)
+        if entry is not None:
+            entry.hits += 1
+            entry.used_ms = ticks_ms()
+            return entry.address
+        self.misses += 1
+        self.logger.info(f"Resolving {host}")
+        address = self.lookup(host, port)
+        now = ticks_ms()
+        self.entries[host] = DNS_Entry(address, port, ticks_add(now, self.ttl_ms), now)
+        return address
+
+    def refresh_expiring(self) -> None:
+        """Evict entries idle for longer than dns_cache_idle_s and start a refresh task for each entry expiring before the next pass"""
+        now = ticks_ms()
+        idle = [host for host in self.entries if ticks_diff(now, self.entries[host].used_ms) > self.idle_ms]
+        for host in idle:
+            self.logger.info(f"Evicting {host}, not requested for {ticks_diff(now, self.entries[host].used_ms) // 1000}s")
+            del self.entries[host]
+        self.evictions += len(idle)
+        for host in self.entries:
+            entry = self.entries[host]
+            if ticks_diff(entry.expires_ms, now) <= self.ttl_ms // 2:
+                create_task(self.refresh(host, entry), "dns refresh")
+
+    async def refresh(self, host: str, entry: DNS_Entry) -> None:
+        """Look up one host, keeping the stale address if the lookup fails"""
+        # Yield first so each queued refresh blocks the loop in its own turn rather than all in one
+        await asyncio.sleep(0)
+        try:
+            entry.address = self.lookup(host, entry.port)
+            entry.expires_ms = ticks_add(ticks_ms(), self.ttl_ms)
+            entry.refreshes += 1
+        except OSError as e:
+            entry.failures += 1
+            self.logger.warn(f"DNS refresh of {host} failed, using stale address {entry.address}: {e}")
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['misses'] = self.misses
+        all_data['evictions'] = self.evictions
+        entries = {}
+        now = ticks_ms()
+        for host in self.entries:
+            entry = self.entries[host]
+            entries[host] = {'address': entry.address, 'expires in s': ticks_diff(entry.expires_ms, now) // 1000, 'idle s': ticks_diff(now, entry.used_ms) // 1000, 'hits': entry.hits, 'refreshes': entry.refreshes, 'failures': entry.failures}
+        all_data['entries'] = entries
+        return all_data
@@ -2,17 +2,20 @@
 Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
 """
 
-from lib.fan import Fan
 from lib.display import Display
 from lib.ulogging import uLogger
-from time import sleep
+from time import sleep, ticks_ms, ticks_diff
 import config
-from lib.battery import Battery_Monitor
 from lib.networking import Wireless_Network
+from lib.events import Event_Publisher
+from lib.metrics import Metrics
+from lib.scheduler import Scheduler
+from lib.power import Power_Manager
+from lib.dns_cache import DNS_Cache
 from http.website import Web_App
-from motion import Motion_Detector
-from button import Button
-from asyncio import create_task, get_event_loop
+from asyncio import get_event_loop
+from lib.task_profiler import Task_Profiler, create_task, install as install_task_profiler
+from lib.memory_profiler import Memory_Profiler, measure, install as install_memory_profiler
 
 class Environment:
     def __init__(self, log_level: int) -> None:
@@ -24,50 +27,137 @@ class Environment:
         self.logger = uLogger("Environment", log_level)
         self.version = "1.6.0"
         self.logger.info(f"Init environment module version: {self.version}")
-        self.display = Display(self.log_level)
+        # ticks_ms counts from power on, so the first phase covers firmware start and module imports
+        self.boot_phases = {}
+        self.boot_phase_start_ms = 0
+        self.boot_phase_complete("imports")
+        self.task_profiler = Task_Profiler(self.log_level)
+        if self.task_profiler.enabled:
+            install_task_profiler(self.task_profiler)
+        self.memory_profiler = Memory_Profiler(self.log_level)
+        if self.memory_profiler.enabled:
+            install_memory_profiler(self.memory_profiler)
+        self.scheduler = Scheduler(self.log_level)
+        self.display = Display(self.log_level, self.scheduler)
+        self.boot_phase_complete("display")
+        self.events = Event_Publisher(self.log_level)
+        self.metrics = Metrics(self.log_level, self.events)
+        self.dns_cache = DNS_Cache(self.log_level, self.scheduler)
         self.display.add_text_line("Configuring WiFi")
-        self.wlan = Wireless_Network(log_level, self.display)
+        self.wlan = Wireless_Network(log_level, self.display, self.events, self.scheduler)
         self.display.add_text_line(f"MAC: {self.wlan.mac}")
-        self.display.add_text_line("Configuring fan")
-        self.fan = Fan(self.log_level, self.display, self.wlan)
-        self.display.add_text_line(f"Configuring battery monitor")
-        self.battery = Battery_Monitor(log_level, self.display)
-        self.display.add_text_line("Configuring motion detector")
-        self.motion = Motion_Detector(self.log_level)
-        self.display.add_text_line(f"Configuring pico display buttons")
-        self.buttons = self.init_pico_display_buttons()
-        self.modules = {
-                        'fan': self.fan,
-                        'battery_monitor': self.battery,
-                        'motion': self.motion,
-                        'light': self.motion.light,
-                        'wlan': self.wlan,
-                        'display': self.display,
-                        'environment': self
-                        }
+        self.boot_phase_complete("wlan")
+        # Modules by name for lookup, MicroPython dicts don't keep insertion order so service_order holds the start order
+        self.modules = {}
+        self.service_order = []
+        self.add_module('scheduler', self.scheduler)
+        self.add_module('events', self.events)
+        self.add_module('metrics', self.metrics)
+        self.add_module('task_profiler', self.task_profiler)
+        self.add_module('memory_profiler', self.memory_profiler)
+        self.add_module('display', self.display)
+        self.add_module('wlan', self.wlan)
+        self.add_module('dns_cache', self.dns_cache)
+        self.load_optional_modules()
+        self.buttons = {}
+        if self.display.enabled:
+            self.display.add_text_line(f"Configuring pico display buttons")
+            self.buttons = self.init_pico_display_buttons()
+            self.boot_phase_complete("buttons")
+        self.power = Power_Manager(self.log_level, self.modules)
+        self.add_module('power', self.power)
+        self.add_module('environment', self)
         self.display.add_text_line(f"Configuring web server")
         self.web_app = Web_App(self.log_level, self.modules)
-        self.modules['web_app'] = self.web_app
-        self.service_modules = self.modules
+        self.add_module('web_app', self.web_app)
+        self.boot_phase_complete("web_app")
+
+    def add_module(self, name: str, module) -> None:
+        """Add a module for lookup by name, its service is started after those of modules added before it"""
+        self.modules[name] = module
+        self.service_order.append(name)
+
+    def load_optional_modules(self) -> None:
+        """
+        Import and construct the optional modules enabled in config, in dependency order.
+        Disabled modules are never imported, so allocate no pins, PWM or buffers and are absent from the modules dict.
+        """
+        optional_modules = (
+            ('light', config.enable_light, self.load_light),
+            ('motion', config.enable_motion_detection, self.load_motion),
+            ('fan', config.enable_fan, self.load_fan),
+            ('battery_monitor', config.enable_battery_monitor, self.load_battery_monitor),
+            ('mqtt', config.enable_mqtt, self.load_mqtt),
+            ('offline_queue', config.enable_offline_queue, self.load_offline_queue),
+        )
+        for name, enabled, loader in optional_modules:
+            if enabled:
+                self.add_module(name, loader())
+                self.boot_phase_complete(name)
+            else:
+                self.logger.info(f"{name} disabled in config - not loaded")
+
+    def load_light(self):
+        from lib.light import Light
+        self.display.add_text_line("Configuring light")
+        return Light(self.log_level, self.events)
+
+    def load_motion(self):
+        from lib.motion import Motion_Detector
+        self.display.add_text_line("Configuring motion detector")
+        return Motion_Detector(self.log_level, self.events, self.modules.get('light'), self.scheduler)
+
+    def load_fan(self):
+        from lib.fan import Fan
+        self.display.add_text_line("Configuring fan")
+        return Fan(self.log_level, self.display, self.wlan, self.events, self.scheduler)
+
+    def load_battery_monitor(self):
+        from lib.battery import Battery_Monitor
+        self.display.add_text_line(f"Configuring battery monitor")
+        return Battery_Monitor(self.log_level, self.display, self.events, self.scheduler)
+
+    def load_mqtt(self):
+        from lib.mqtt import MQTT_Publisher
+        self.display.add_text_line(f"Configuring MQTT")
+        return MQTT_Publisher(self.log_level, self.modules)
+
+    def load_offline_queue(self):
+        from lib.offline_queue import Offline_Queue
+        self.display.add_text_line(f"Configuring offline queue")
+        return Offline_Queue(self.log_level, self.modules)
+
+    def boot_phase_complete(self, phase: str) -> None:
+        """Record time taken since the previous boot phase completed"""
+        now = ticks_ms()
+        self.boot_phases[phase] = ticks_diff(now, self.boot_phase_start_ms)
+        self.boot_phase_start_ms = now
+        self.logger.info(f"Boot phase {phase} took {self.boot_phases[phase]}ms")
 
     def main_loop(self) -> None:                
         self.logger.info("Entering main loop")
         self.display.add_text_line(f"Entering main loop")
-        sleep(config.auto_page_scroll_pause_s)
-        self.display.mode = "main"
-        self.display.update_main_display()
+        if not config.enable_fast_boot:
+            # Fast boot leaves the startup text renderer to switch to the main display
+            sleep(config.auto_page_scroll_pause_s)
+            self.display.mode = "main"
+            self.display.update_main_display()
+        self.boot_phase_complete("main_loop")
         self.loop_running = True
         loop = get_event_loop()
         loop.run_forever()
     
     def init_modules(self) -> None:
         """Load all module services into asyncio loop ready to start"""
-        for module in self.service_modules:
+        for module in self.service_order:
             self.logger.info(f"Loading {module} service")
             self.display.add_text_line(f"Loading {module} service")
-            self.modules[module].init_service()
+            with measure(f"init {module}"):
+                self.modules[module].init_service()
+            self.boot_phase_complete(f"init {module}")
 
     def init_pico_display_buttons(self) -> dict:
+        from lib.button import Button
         self.logger.info("Init pico buttons")
         buttons_to_create = {"A": 12, "B": 13, "X": 14, "Y": 15}
         buttons = {}
@@ -81,7 +171,7 @@ class Environment:
     def do_button_function(self, button_name: str) -> None:
         self.logger.info(f"Doing button function for button {button_name}")
     
-    async def button_pressed_event_watcher(self, button: Button) -> None:
+    async def button_pressed_event_watcher(self, button) -> None:
         self.logger.info(f"Starting button pressed watcher for {button.name}")
         while True:
             await button.pressed_event.wait()
@@ -97,10 +187,10 @@ class Environment:
     def init_service(self) -> None:
         for button in self.buttons:
             self.logger.info(f"Init pico button watcher for {button}")
-            button_object: Button = self.buttons[button]
-            create_task(button_object.wait_for_press())
+            button_object = self.buttons[button]
+            create_task(button_object.wait_for_press(), f"button {button} poller")
             self.logger.info(f"Init pico button pressed watcher for {button}")
-            create_task(self.button_pressed_event_watcher(button_object))
+            create_task(self.button_pressed_event_watcher(button_object), f"button {button} watcher")
 
     def get_version(self) -> str:
         """Get current firmware version of Pico Environemt Control"""
@@ -109,4 +199,7 @@ class Environment:
     def get_all_data(self) -> dict:
         all_data = {}
         all_data['version'] = self.get_version()
+        all_data['boot phases ms'] = self.boot_phases
+        all_data['fast boot'] = config.enable_fast_boot
+        all_data['modules'] = self.service_order
         return all_data
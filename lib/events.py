@@ -0,0 +1,99 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from asyncio import Event
+from lib.ulogging import uLogger
+import config
+
+class Event_Subscriber:
+    """
+    Bounded queue of change events for a single consumer such as a Server-Sent Events client.
+    When the queue is full the oldest event is dropped so a slow client can never grow the heap.
+    """
+    def __init__(self, max_queue_length: int) -> None:
+        self.max_queue_length = max_queue_length
+        self.queue = []
+        self.dropped = 0
+        self.updated = Event()
+
+    def put(self, event: dict) -> None:
+        if len(self.queue) >= self.max_queue_length:
+            self.queue.pop(0)
+            self.dropped += 1
+        self.queue.append(event)
+        self.updated.set()
+
+    async def get(self) -> dict:
+        """Wait for and return the oldest queued event"""
+        while not self.queue:
+            self.updated.clear()
+            await self.updated.wait()
+        return self.queue.pop(0)
+
+class Event_Publisher:
+    """
+    Collects change events from modules and fans them out to subscribers.
+    Modules publish a dict of values keyed the same as the display values, only changed values are queued.
+    New subscribers are primed with the current state of every source so they need no initial polling.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("Events", log_level)
+        self.logger.info("Init event publisher")
+        self.max_subscribers = config.sse_max_subscribers
+        self.max_queue_length = config.sse_queue_length
+        self.subscribers = []
+        self.listeners = []
+        self.state = {}
+        self.published = 0
+
+    def init_service(self) -> None:
+        self.logger.info("Event publisher has no service to start")
+
+    def publish(self, source: str, data: dict) -> None:
+        """Publish values from a source module, values unchanged since the last publish are discarded"""
+        source_state = self.state.setdefault(source, {})
+        changed = {}
+        for key in data:
+            if key not in source_state or source_state[key] != data[key]:
+                source_state[key] = data[key]
+                changed[key] = data[key]
+
+        if not changed:
+            return
+
+        self.published += 1
+        self.logger.info(f"Publishing {source} event: {changed}")
+        for listener in self.listeners:
+            listener(source, changed)
+        for subscriber in self.subscribers:
+            subscriber.put(changed)
+
+    def add_listener(self, listener) -> None:
+        """Register a function called immediately with (source, changed values) on every change, it must not block"""
+        self.listeners.append(listener)
+
+    def subscribe(self) -> Event_Subscriber | None:
+        """Returns a new subscriber primed with current state, or None if the subscriber limit is reached"""
+        if len(self.subscribers) >= self.max_subscribers:
+            self.logger.warn("Subscriber limit reached")
+            return None
+
+        subscriber = Event_Subscriber(self.max_queue_length)
+        for source in self.state:
+            subscriber.put(dict(self.state[source]))
+        self.subscribers.append(subscriber)
+        self.logger.info(f"Subscriber added, {len(self.subscribers)} active")
+        return subscriber
+
+    def unsubscribe(self, subscriber: Event_Subscriber) -> None:
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        self.logger.info(f"Subscriber removed, {len(self.subscribers)} active")
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['subscribers'] = len(self.subscribers)
+        all_data['published'] = self.published
+        all_data['dropped'] = sum([subscriber.dropped for subscriber in self.subscribers])
+        return all_data
@@ -7,47 +7,120 @@ import config
 from lib.networking import Wireless_Network
 from lib.helpers import Status_LED, decimal_to_percent_str
 from lib.open_meteo import Weather_API
-from lib.bme_280 import BME_280
+from lib.sensor_manager import Sensor_Manager
 from lib.ulogging import uLogger
 from lib.display import Display
-from asyncio import create_task, sleep
+from lib.events import Event_Publisher
+from lib.scheduler import Scheduler
+from lib.task_profiler import create_task
+from lib.memory_profiler import measure
+
+class Fan_Zone:
+    """A fan output with the sensors averaged for its indoor conditions and the location used for its outdoor humidity"""
+    def __init__(self, log_level: int, name: str, zone_config: dict) -> None:
+        self.logger = uLogger(f"Fan zone {name}", log_level)
+        self.name = name
+        self.sensors = zone_config["sensors"]
+        self.latlong = zone_config.get("lat_long", config.lat_long)
+        self.location = tuple(self.latlong)
+        self.max_pwm_duty = 65535
+        self.requested_speed = 0
+        self.fan_pwm_pin = PWM(Pin(zone_config["fan_pin"], Pin.OUT))
+        self.fan_pwm_pin.freq(100)
+        self.readings = {}
+        self.weather_data = {}
+
+    def merge_readings(self, sensor_readings: dict) -> None:
+        """Average the readings of the zone sensors that returned data"""
+        totals = {}
+        counts = {}
+        for sensor in self.sensors:
+            readings = sensor_readings.get(sensor, {})
+            for key in readings:
+                totals[key] = totals.get(key, 0) + readings[key]
+                counts[key] = counts.get(key, 0) + 1
+        self.readings = {}
+        for key in totals:
+            self.readings[key] = round(totals[key] / counts[key], 2)
+
+    def set_speed(self, speed: float, max_speed: float) -> float:
+        """Set the requested speed, capped at max_speed, returning the applied speed"""
+        self.requested_speed = speed
+        speed = min(speed, max_speed)
+        if not config.enable_PWM_fan_speed and 0 < speed < 1:
+            # A partial duty on an on/off fan chatters the relay and keeps PWM running through lightsleep
+            speed = 1 if speed >= config.battery_fan_on_off_threshold else 0
+        duty = int(self.max_pwm_duty * speed)
+        self.fan_pwm_pin.duty_u16(duty)
+        self.logger.info(f"Fan speed set to speed {speed}, which is duty {duty}")
+        return speed
+
+    def get_fan_speed(self) -> float:
+        return self.fan_pwm_pin.duty_u16() / self.max_pwm_duty
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['sensors'] = self.sensors
+        all_data['lat long'] = self.latlong
+        all_data['indoor humidity'] = self.readings.get("humidity", -1)
+        all_data['indoor temperature'] = self.readings.get("temperature", -1)
+        all_data['outdoor humidity'] = self.weather_data.get("humidity", -1)
+        all_data['fan speed'] = self.get_fan_speed()
+        return all_data
 
 class Fan:
-    def __init__(self, log_level: int, display: Display, wlan: Wireless_Network) -> None:
+    """
+    Humidity driven fan control for one or more zones from config.fan_zones, each with its own PWM fan output.
+    Each cycle reads all environmental sensors in one batched pass, fetches outdoor humidity once per distinct location
+    and sets each zone fan from its averaged indoor humidity. The first zone is reported on the display and events.
+    """
+    def __init__(self, log_level: int, display: Display, wlan: Wireless_Network, events: Event_Publisher, scheduler: Scheduler) -> None:
         self.logger = uLogger("Fan", log_level)
         self.logger.info(f"Init fan")
         self.status_led = Status_LED(log_level)
         self.display = display
-        self.max_pwm_duty = 65535
-        self.fan_pwm_pin = PWM(Pin(config.fan_gpio_pin, Pin.OUT))
-        self.fan_pwm_pin.freq(100)
+        self.events = events
+        self.scheduler = scheduler
+        # Speed cap applied by battery load shedding, the requested speed is restored when it is lifted
+        self.max_speed = 1
+        # A list in config as MicroPython dicts don't keep insertion order, so the first zone is well defined
+        self.zones = {}
+        for name, zone_config in config.fan_zones:
+            self.zones[name] = Fan_Zone(log_level, name, zone_config)
+        self.primary_zone = self.zones[config.fan_zones[0][0]]
         self.switch_off()
         self.wlan = wlan
         self.display.add_text_line("Init weather API")
-        self.weather = Weather_API(log_level)
-        self.display.add_text_line(f"LatLong: {self.weather.latlong}")
-        self.display.add_text_line("Init BME280")
-        self.sensor = BME_280(log_level)
-        self.display.add_text_line(f"I2c Pins: scl: {config.i2c_pins['scl']} sda: {config.i2c_pins['sda']}")
+        self.weather_apis = {}
+        for zone in self.zones.values():
+            if zone.location not in self.weather_apis:
+                self.weather_apis[zone.location] = Weather_API(log_level, zone.latlong)
+                self.display.add_text_line(f"LatLong: {zone.latlong}")
+        self.display.add_text_line("Init sensors")
+        self.sensors = Sensor_Manager(log_level)
+        for name in config.i2c_buses:
+            self.display.add_text_line(f"I2c {name}: scl: {config.i2c_buses[name]['scl']} sda: {config.i2c_buses[name]['sda']}")
         self.humidity_hysteresis_pc = config.humidity_hysteresis_pc
-        self.readings = {}
-        self.weather_data = {}
         self.config_enabled = config.enable_fan
-        if config.enable_startup_fan_test and config.enable_fan:
+        if config.enable_startup_fan_test and config.enable_fan and not config.enable_fast_boot:
             self.fan_test()
     
     def init_service(self) -> None:
         self.logger.info("Loading fan management")
-        create_task(self.start_fan_management())
+        create_task(self.start_fan_management(), "fan management")
     
     async def start_fan_management(self) -> None:
         if self.config_enabled == False:
             self.logger.info("Fan disabled in config - fan management disabled")
             return
         
-        while True:
-            create_task(self.assess_fan_state())
-            await sleep(config.weather_poll_frequency_in_seconds)
+        if config.enable_startup_fan_test and config.enable_fast_boot:
+            await self.fan_test_async()
+        
+        self.scheduler.every("fan assessment", config.weather_poll_frequency_in_seconds, self.start_fan_assessment, run_now=True)
+    
+    def start_fan_assessment(self) -> None:
+        create_task(self.assess_fan_state(), "fan assessment")
     
     def pwm_fan_test(self) -> None:
         self.set_speed(0.1)
@@ -69,6 +142,27 @@ class Fan:
         self.logger.info("Fan test complete")
         self.display.add_text_line("Fan test complete")
     
+    async def pwm_fan_test_async(self) -> None:
+        self.set_speed(0.1)
+        self.display.add_text_line("Testing fan - 1/10 speed")
+        await self.status_led.flash(4, 2)
+        self.set_speed(0.5)
+        self.display.add_text_line("Testing fan - 1/2 speed")
+        await self.status_led.flash(10, 5)
+    
+    async def fan_test_async(self) -> None:
+        """Fan test run after services start in fast boot mode, so the LED flashes do not hold up boot"""
+        self.logger.info("Testing fan")
+        self.display.add_text_line("Testing fan")
+        if config.enable_PWM_fan_speed:
+           await self.pwm_fan_test_async()
+        self.set_speed(1)
+        self.display.add_text_line("Testing fan - full speed")
+        await self.status_led.flash(40, 10)
+        self.set_speed(0)
+        self.logger.info("Fan test complete")
+        self.display.add_text_line("Fan test complete")
+    
     def switch_on(self) -> None:
         self.set_speed(1)
         self.logger.info("Fan switched on")
@@ -79,13 +173,24 @@ class Fan:
 
     def set_speed(self, speed: float) -> None:
         """
-        Speed argument is decimal value between 0 (stopped) to 1(max speed)
+        Set every zone fan, speed argument is decimal value between 0 (stopped) to 1(max speed)
         """
-        duty = int(self.max_pwm_duty * speed)
-        self.fan_pwm_pin.duty_u16(duty)
-        self.logger.info(f"Fan speed set to speed {speed}, which is duty {duty}")
-        self.display.update_main_display_values({"fan_speed": decimal_to_percent_str(speed)})
+        for zone in self.zones.values():
+            self.set_zone_speed(zone, speed)
+
+    def set_zone_speed(self, zone: Fan_Zone, speed: float) -> None:
+        speed = zone.set_speed(speed, self.max_speed)
+        if zone is self.primary_zone:
+            self.display.update_main_display_values({"fan_speed": decimal_to_percent_str(speed)})
+            self.events.publish("fan", {"fan_speed": speed * 100})
     
+    def set_max_speed(self, max_speed: float) -> None:
+        if max_speed != self.max_speed:
+            self.logger.info(f"Fan max speed set to {max_speed}")
+            self.max_speed = max_speed
+            for zone in self.zones.values():
+                self.set_zone_speed(zone, zone.requested_speed)
+
     def calculate_required_fan_speed(self, inside_humidity, outside_humidity) -> float:
         speed = 0
         humidity_difference = inside_humidity - (outside_humidity + self.humidity_hysteresis_pc)
@@ -97,78 +202,94 @@ class Fan:
         self.logger.info(f"calculated fan speed is {speed}")
         return speed
     
-    async def set_fan_from_humidity(self, inside_humidity: float, outside_humidity: float) -> None:
+    async def set_fan_from_humidity(self, zone: Fan_Zone, inside_humidity: float, outside_humidity: float) -> None:
         if inside_humidity >= outside_humidity + self.humidity_hysteresis_pc:
-            self.logger.info("Turning on fan")
+            self.logger.info(f"Turning on fan in zone {zone.name}")
             await self.status_led.flash(1, 1)
-            self.set_speed(self.calculate_required_fan_speed(inside_humidity, outside_humidity))
+            self.set_zone_speed(zone, self.calculate_required_fan_speed(inside_humidity, outside_humidity))
         if inside_humidity <= outside_humidity:
-            self.logger.info("Turning off fan")
+            self.logger.info(f"Turning off fan in zone {zone.name}")
             await self.status_led.flash(2, 1)
-            self.switch_off()
+            self.set_zone_speed(zone, 0)
 
-    def parse_humidity_data(self) -> bool:
-        self.logger.info(f"Checking humidity data for open meteo: {self.weather_data} and sensor data: {self.readings}")
+    def parse_humidity_data(self, zone: Fan_Zone) -> bool:
+        self.logger.info(f"Checking humidity data for zone {zone.name} open meteo: {zone.weather_data} and sensor data: {zone.readings}")
         data_ok = True
-        if "humidity" not in self.weather_data:
-            self.weather_data["humidity"] = "Data missing"
+        if "humidity" not in zone.weather_data:
             data_ok = False
-            self.logger.warn("Humidity missing from Open Meteo data")
-        if "humidity" not in self.readings:
-            self.readings["humidity"] = "Data missing"
+            self.logger.warn(f"Humidity missing from Open Meteo data for zone {zone.name}")
+        if "humidity" not in zone.readings:
             data_ok = False
-            self.logger.warn("Humidity missing from sensor data")
+            self.logger.warn(f"Humidity missing from sensor data for zone {zone.name}")
         
         self.logger.info(f"Data_ok set to: {data_ok}")
         return data_ok
+
+    async def fetch_weather(self) -> dict:
+        """Outdoor conditions for each distinct zone location, empty for a location that failed"""
+        weather = {}
+        # Radio power saving adds latency, so is suspended for the fetch in low power mode
+        radio_power_saving = self.wlan.power_saving
+        if radio_power_saving:
+            self.wlan.set_power_saving(False)
+        for location in self.weather_apis:
+            try:
+                with measure("weather fetch"):
+                    weather[location] = await self.weather_apis[location].get_humidity_async()
+            except Exception as e:
+                self.logger.error(f"Error encountered querying OpenMeteo API for {location}: {e}")
+                weather[location] = {}
+        if radio_power_saving:
+            self.wlan.set_power_saving(True)
+        return weather
     
     async def assess_fan_state(self) -> None:
         self.logger.info("Assessing fan state")
         await self.status_led.flash(4, 4)
-        network_access = await self.wlan.check_network_access()
-        
-        if network_access == True:
-            
-            self.weather_data = {}
-            try:
-                self.weather_data = await self.weather.get_humidity_async()
-            except:
-                self.logger.error(f"Error encountered querying OpenMeteo API, setting fan to ON")
-                self.switch_on()
-            
-            self.readings = {}
-            self.readings = self.sensor.get_readings()
-            data_ok = self.parse_humidity_data()
-            self.display.update_main_display_values({"indoor_humidity": self.readings["humidity"], "outdoor_humidity": self.weather_data["humidity"]})
-            if data_ok:
-                await self.set_fan_from_humidity(self.readings["humidity"], self.weather_data["humidity"])
+        network_access = await self.wlan.wait_for_link(config.wifi_connect_timeout_seconds)
+        weather = await self.fetch_weather() if network_access else {}
+        sensor_readings = await self.sensors.read_all()
+
+        for zone in self.zones.values():
+            zone.merge_readings(sensor_readings)
+            zone.weather_data = weather.get(zone.location, {})
+            if zone is self.primary_zone:
+                self.display.update_main_display_values({"indoor_humidity": zone.readings.get("humidity", "Data missing"), "outdoor_humidity": zone.weather_data.get("humidity", "Data missing")})
+                self.events.publish("fan", {"indoor_humidity": self.get_latest_indoor_humidity(), "outdoor_humidity": self.get_latest_outdoor_humidity()})
+            if not network_access:
+                self.logger.error(f"No network access - setting fan in zone {zone.name} to 100%")
+                self.set_zone_speed(zone, 1)
+            elif self.parse_humidity_data(zone):
+                await self.set_fan_from_humidity(zone, zone.readings["humidity"], zone.weather_data["humidity"])
             else:
-                self.logger.error("Humidity data not available - setting fan to 100%")
-                self.switch_on()
-        else:
-            self.logger.error("No network access - setting fan to 100%")
-            self.switch_on()
+                self.logger.error(f"Humidity data not available - setting fan in zone {zone.name} to 100%")
+                self.set_zone_speed(zone, 1)
     
     def get_latest_indoor_humidity(self) -> float:
-        if "humidity" in self.readings:
-            return self.readings["humidity"]
-        else:
-            return -1
+        return self.primary_zone.readings.get("humidity", -1)
 
     def get_latest_outdoor_humidity(self) -> float:
-        if "humidity" in self.weather_data:
-            return self.weather_data["humidity"]
-        else:
-            return -1
+        return self.primary_zone.weather_data.get("humidity", -1)
     
     def get_fan_speed(self) -> float:
-        duty = self.fan_pwm_pin.duty_u16()
-        speed = duty / self.max_pwm_duty
-        return speed
+        """Highest speed of the zone fans"""
+        return max([zone.get_fan_speed() for zone in self.zones.values()])
+
+    def pwm_active(self) -> bool:
+        """True if any zone fan is at a partial PWM duty, which stops during lightsleep"""
+        for zone in self.zones.values():
+            if zone.get_fan_speed() not in (0, 1):
+                return True
+        return False
     
     def get_all_data(self) -> dict:
         all_data = {}
         all_data['indoor humidity'] = self.get_latest_indoor_humidity()
         all_data['outdoor humidity'] = self.get_latest_outdoor_humidity()
         all_data['fan speed'] = self.get_fan_speed()
+        zones = {}
+        for name in self.zones:
+            zones[name] = self.zones[name].get_all_data()
+        all_data['zones'] = zones
+        all_data['sensors'] = self.sensors.get_all_data()
         return all_data
\ No newline at end of file
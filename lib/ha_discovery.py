@@ -0,0 +1,121 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from json import dumps
+import config
+from lib.ulogging import uLogger
+from lib.mqtt_client import MQTT_Client
+
+class HA_Discovery:
+    """
+    Home Assistant MQTT discovery configs for the entities of the loaded modules.
+    Configs are generated once from the modules dict and cached in flash as alternating topic and payload lines,
+    headed by a signature of the inputs so they are only regenerated when the firmware version, modules or topics change.
+    On each broker connection the cache is streamed a line at a time, so no config is rebuilt or held in memory.
+    Abbreviated discovery keys keep the payloads small.
+    """
+    def __init__(self, log_level: int, modules: dict, device_id: str, base_topic: str) -> None:
+        self.logger = uLogger("HA discovery", log_level)
+        self.logger.info("Init Home Assistant discovery")
+        self.modules = modules
+        self.device_id = device_id
+        self.base_topic = base_topic
+        self.prefix = config.ha_discovery_prefix
+        self.cache_file = config.ha_discovery_cache_file
+        self.entity_count = 0
+        self.generated = False
+        self.publishes = 0
+        # Entities per module as (component, object id, name, state document key, extra config)
+        self.entity_definitions = {
+            'fan': (
+                ("sensor", "indoor_humidity", "Indoor humidity", "indoor_humidity", {"unit_of_meas": "%", "dev_cla": "humidity", "stat_cla": "measurement"}),
+                ("sensor", "outdoor_humidity", "Outdoor humidity", "outdoor_humidity", {"unit_of_meas": "%", "dev_cla": "humidity", "stat_cla": "measurement"}),
+                ("sensor", "fan_speed", "Fan speed", "fan_speed", {"unit_of_meas": "%", "stat_cla": "measurement", "ic": "mdi:fan"}),
+            ),
+            'battery_monitor': (
+                ("sensor", "battery_voltage", "Battery voltage", "battery_voltage", {"unit_of_meas": "V", "dev_cla": "voltage", "stat_cla": "measurement"}),
+                ("sensor", "battery_soc", "Battery", "battery_soc", {"unit_of_meas": "%", "dev_cla": "battery", "stat_cla": "measurement"}),
+                ("sensor", "battery_state", "Battery state", "battery_state", {}),
+            ),
+            'light': (
+                ("light", "light", "Light", "light_state", {"cmd_t": "~/light/set", "pl_on": "on", "pl_off": "off",
+                    "stat_val_tpl": "{{ 'on' if value_json.light_state else 'off' }}",
+                    "bri_cmd_t": "~/light/brightness/set", "bri_stat_t": "~/state", "bri_scl": 100,
+                    "bri_val_tpl": "{{ value_json.light_brightness }}"}),
+            ),
+            'motion': (
+                ("binary_sensor", "motion", "Motion", "motion_state", {"dev_cla": "motion",
+                    "val_tpl": "{{ 'ON' if value_json.motion_state else 'OFF' }}"}),
+                ("switch", "motion_detection", "Motion light", "light_motion_detection", {"cmd_t": "~/motion_detection/set",
+                    "pl_on": "enabled", "pl_off": "disabled", "stat_on": "enabled", "stat_off": "disabled",
+                    "val_tpl": "{{ 'enabled' if value_json.light_motion_detection else 'disabled' }}"}),
+            ),
+            'wlan': (
+                ("sensor", "wifi_rssi", "WiFi signal", "wifi_rssi", {"unit_of_meas": "dBm", "dev_cla": "signal_strength",
+                    "stat_cla": "measurement", "ent_cat": "diagnostic"}),
+            ),
+        }
+
+    def get_version(self) -> str:
+        environment = self.modules.get('environment')
+        return environment.get_version() if environment else "Unknown"
+
+    def signature(self) -> str:
+        modules = ",".join([name for name in self.entity_definitions if name in self.modules])
+        return f"{self.get_version()}|{self.device_id}|{self.base_topic}|{self.prefix}|{modules}"
+
+    def ensure_cache(self) -> None:
+        """Generate the cached configs if the cache is missing or was generated from different inputs"""
+        signature = self.signature()
+        try:
+            with open(self.cache_file) as cache:
+                if cache.readline().rstrip("\n") == signature:
+                    self.entity_count = sum(1 for unused in cache) // 2
+                    self.logger.info(f"Using {self.entity_count} cached discovery configs")
+                    return
+        except OSError:
+            pass
+        self.generate(signature)
+
+    def generate(self, signature: str) -> None:
+        self.logger.info("Generating discovery configs")
+        device = {"ids": [self.device_id], "name": self.device_id, "mdl": "Pico W", "mf": "pico-environment", "sw": self.get_version()}
+        self.entity_count = 0
+        with open(self.cache_file, "w") as cache:
+            cache.write(signature + "\n")
+            for name in self.entity_definitions:
+                if name not in self.modules:
+                    continue
+                for component, object_id, entity_name, state_key, extra in self.entity_definitions[name]:
+                    entity = {"~": self.base_topic, "name": entity_name, "uniq_id": f"{self.device_id}_{object_id}",
+                              "stat_t": "~/state", "avty_t": "~/availability", "dev": device}
+                    if component == "sensor":
+                        entity["val_tpl"] = "{{ value_json." + state_key + " }}"
+                    entity.update(extra)
+                    cache.write(f"{self.prefix}/{component}/{self.device_id}/{object_id}/config\n")
+                    cache.write(dumps(entity) + "\n")
+                    self.entity_count += 1
+        self.generated = True
+        self.logger.info(f"Cached {self.entity_count} discovery configs in {self.cache_file}")
+
+    async def publish(self, client: MQTT_Client) -> None:
+        """Publish the cached configs retained, called on each broker connection"""
+        with open(self.cache_file) as cache:
+            cache.readline()
+            while True:
+                topic = cache.readline().rstrip("\n")
+                payload = cache.readline().rstrip("\n")
+                if not topic or not payload:
+                    break
+                await client.publish(topic, payload, retain=True)
+        self.publishes += 1
+        self.logger.info(f"Published {self.entity_count} discovery configs")
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['entities'] = self.entity_count
+        all_data['generated this boot'] = self.generated
+        all_data['publishes'] = self.publishes
+        all_data['cache file'] = self.cache_file
+        return all_data
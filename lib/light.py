@@ -5,21 +5,25 @@ Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni
 from ulogging import uLogger
 import config
 from machine import Pin, PWM
+from lib.events import Event_Publisher
 
 class Light:
     """
     Module for controlling LED lighting (or any lighting that supports PWM for dimming) via GPIO.
     Includes methods for getting and setting on/off and brightness and a get all data method for APIs.
     """
-    def __init__(self, log_level: int) -> None:
+    def __init__(self, log_level: int, events: Event_Publisher) -> None:
         self.log_level = log_level
         self.logger = uLogger("Light", log_level)
         self.logger.info("Init light")
+        self.events = events
         self.pin = config.led_pin
         self.max_pwm_duty = 65535
         self.pwm_pin = PWM(Pin(self.pin, Pin.OUT))
         self.pwm_pin.freq(1000)
         self.brightness_pc = config.default_brightness_pc
+        # Brightness cap applied by battery load shedding, the requested brightness is kept
+        self.max_brightness_pc = 100
         self.off()
 
     def init_service(self) -> None:
@@ -30,24 +34,38 @@ class Light:
         square = decimal * decimal
         return square
     
+    def brightness_duty(self, brightness_pc: float) -> int:
+        return int(self.max_pwm_duty * self.brightness_to_corrected_duty(min(brightness_pc, self.max_brightness_pc)))
+    
     def off(self) -> None:
         """Set brightness to 0"""
         self.logger.info("Turning light off")
         self.pwm_pin.duty_u16(0)
+        self.publish_state()
 
     def on(self) -> None:
         """Set brightness to maximum"""
         self.logger.info("Turning light on")
-        duty = int(self.max_pwm_duty * self.brightness_to_corrected_duty(self.brightness_pc))
-        self.pwm_pin.duty_u16(duty)
+        self.pwm_pin.duty_u16(self.brightness_duty(self.brightness_pc))
+        self.publish_state()
     
     def set_brightness_pc(self, pc_brightness: float) -> None:
         """Set light to specific brightness as a percentage"""
         self.brightness_pc = pc_brightness
         self.logger.info(f"Setting light to {pc_brightness}%")
-        duty = int(self.max_pwm_duty * self.brightness_to_corrected_duty(pc_brightness))
-        self.pwm_pin.duty_u16(duty)
+        self.pwm_pin.duty_u16(self.brightness_duty(pc_brightness))
+        self.publish_state()
+    
+    def set_max_brightness_pc(self, max_brightness_pc: float) -> None:
+        """Cap brightness without changing the brightness setting, applied immediately if the light is on"""
+        self.logger.info(f"Light max brightness set to {max_brightness_pc}%")
+        self.max_brightness_pc = max_brightness_pc
+        if self.get_state():
+            self.pwm_pin.duty_u16(self.brightness_duty(self.brightness_pc))
         
+    def publish_state(self) -> None:
+        self.events.publish("light", {"light_state": self.get_state(), "light_brightness": self.get_brightness_pc()})
+
     def get_state(self) -> bool:
         "Is the light on or off"
         state = self.pwm_pin.duty_u16()
@@ -65,4 +83,5 @@ class Light:
         all_data = {}
         all_data['brightness pc'] = self.get_brightness_pc()
         all_data['state'] = self.get_state()
+        all_data['max brightness pc'] = self.max_brightness_pc
         return all_data
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from array import array
+import gc
+import asyncio
+import config
+from lib.ulogging import uLogger
+from lib.task_profiler import create_task
+
+# Profiler installed by Environment when enabled in config, None makes measurements a no-op
+_profiler = None
+
+def install(profiler) -> None:
+    global _profiler
+    _profiler = profiler
+
+class Null_Measurement:
+    """Shared context manager used while the memory profiler is not installed"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_measurement = Null_Measurement()
+
+class Memory_Measurement:
+    """Context manager sampling heap usage before and after a block of code and attributing the delta to a subsystem"""
+    def __init__(self, profiler, subsystem: str) -> None:
+        self.profiler = profiler
+        self.subsystem = subsystem
+
+    def __enter__(self):
+        self.start_alloc = gc.mem_alloc()
+        self.start_free = gc.mem_free()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.subsystem, gc.mem_alloc() - self.start_alloc, gc.mem_free() - self.start_free)
+        return False
+
+def measure(subsystem: str):
+    """
+    Attribute heap usage of a block to a subsystem: with measure("display redraw"): ...
+    Costs nothing beyond the call while the profiler is not installed.
+    """
+    if _profiler is None:
+        return _null_measurement
+    return Memory_Measurement(_profiler, subsystem)
+
+class Subsystem_Memory_Stats:
+    """Rolling window of heap allocation deltas for one subsystem"""
+    def __init__(self, window: int) -> None:
+        self.samples = 0
+        self.alloc_deltas = array('l', [0] * window)
+        self.max_alloc_delta = 0
+        self.last_free_delta = 0
+
+    def record(self, alloc_delta: int, free_delta: int) -> None:
+        self.alloc_deltas[self.samples % len(self.alloc_deltas)] = alloc_delta
+        self.samples += 1
+        self.max_alloc_delta = max(self.max_alloc_delta, alloc_delta)
+        self.last_free_delta = free_delta
+
+    def get_report(self) -> dict:
+        count = min(self.samples, len(self.alloc_deltas))
+        report = {}
+        report['samples'] = self.samples
+        report['last alloc delta'] = self.alloc_deltas[(self.samples - 1) % len(self.alloc_deltas)] if self.samples else 0
+        report['avg alloc delta'] = sum(self.alloc_deltas[:count]) // count if count else 0
+        report['max alloc delta'] = self.max_alloc_delta
+        report['last free delta'] = self.last_free_delta
+        return report
+
+class Memory_Profiler:
+    """
+    Opt in heap accounting per subsystem (module service start up, web requests, weather fetches and display redraws).
+    Also samples the largest allocatable block against free memory as a heap fragmentation indicator.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("Memory profiler", log_level)
+        self.logger.info("Init memory profiler")
+        self.enabled = config.enable_memory_profiler
+        self.window = config.memory_profiler_window
+        self.subsystems = {}
+        self.free_history = array('L', [0] * self.window)
+        self.largest_block_history = array('L', [0] * self.window)
+        self.fragmentation_samples = 0
+
+    def init_service(self) -> None:
+        if self.enabled:
+            self.logger.info("Loading memory fragmentation sampler")
+            create_task(self.fragmentation_sampler(), "memory fragmentation sampler")
+        else:
+            self.logger.info("Memory profiler disabled in config")
+
+    def record(self, subsystem: str, alloc_delta: int, free_delta: int) -> None:
+        if subsystem not in self.subsystems:
+            self.subsystems[subsystem] = Subsystem_Memory_Stats(self.window)
+        self.subsystems[subsystem].record(alloc_delta, free_delta)
+
+    def largest_free_block(self) -> int:
+        """Binary search for the largest bytearray the heap can currently allocate"""
+        gc.collect()
+        low = 0
+        high = gc.mem_free()
+        while high - low > 64:
+            middle = (low + high) // 2
+            try:
+                block = bytearray(middle)
+                del block
+                low = middle
+            except MemoryError:
+                high = middle
+        gc.collect()
+        return low
+
+    async def fragmentation_sampler(self) -> None:
+        while True:
+            index = self.fragmentation_samples % self.window
+            self.largest_block_history[index] = self.largest_free_block()
+            self.free_history[index] = gc.mem_free()
+            self.fragmentation_samples += 1
+            await asyncio.sleep(config.memory_profiler_sample_s)
+
+    def get_fragmentation_report(self) -> dict:
+        count = min(self.fragmentation_samples, self.window)
+        report = {}
+        report['samples'] = self.fragmentation_samples
+        if count:
+            last = (self.fragmentation_samples - 1) % self.window
+            report['mem free'] = self.free_history[last]
+            report['largest block'] = self.largest_block_history[last]
+            report['fragmentation pc'] = round(100 - (100 * self.largest_block_history[last] / max(1, self.free_history[last])), 1)
+            report['min largest block'] = min(self.largest_block_history[:count])
+        return report
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['enabled'] = self.enabled
+        all_data['heap'] = self.get_fragmentation_report()
+        subsystems = {}
+        for subsystem in self.subsystems:
+            subsystems[subsystem] = self.subsystems[subsystem].get_report()
+        all_data['subsystems'] = subsystems
+        return all_data
@@ -0,0 +1,134 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from array import array
+from time import ticks_ms, ticks_us, ticks_diff
+from asyncio import sleep_ms
+from lib.task_profiler import create_task
+import gc
+import config
+from lib.ulogging import uLogger
+from lib.events import Event_Publisher
+
+class Metrics:
+    """
+    Registry of preallocated gauges and counters rendered in Prometheus text exposition format.
+    Values are held in arrays so updates are in place and allocate nothing on the heap.
+    Module gauges are updated from change events, request metrics by the web server and system metrics by a sampler task.
+    """
+    def __init__(self, log_level: int, events: Event_Publisher) -> None:
+        self.logger = uLogger("Metrics", log_level)
+        self.logger.info("Init metrics")
+        # Gauge name, help text and the event key that updates it, or None for system gauges
+        self.gauge_definitions = (
+            ("pico_fan_speed_percent", "Fan PWM duty in percent", "fan_speed"),
+            ("pico_indoor_humidity_percent", "Indoor relative humidity from the BME280", "indoor_humidity"),
+            ("pico_outdoor_humidity_percent", "Outdoor relative humidity from Open-Meteo", "outdoor_humidity"),
+            ("pico_battery_voltage_volts", "Calibrated battery voltage", "battery_voltage"),
+            ("pico_battery_soc_percent", "Estimated battery state of charge", "battery_soc"),
+            ("pico_wifi_connected", "1 if the wireless link is up", "wifi_status"),
+            ("pico_wifi_rssi_dbm", "Wireless signal strength", "wifi_rssi"),
+            ("pico_light_brightness_percent", "Light brightness setting in percent", "light_brightness"),
+            ("pico_light_on", "1 if the light is on", "light_state"),
+            ("pico_motion_detected", "1 if motion is currently detected", "motion_state"),
+            ("pico_mem_free_bytes", "Free heap after garbage collection", None),
+            ("pico_mem_alloc_bytes", "Allocated heap after garbage collection", None),
+            ("pico_gc_duration_ms", "Duration of the last sampled garbage collection", None),
+            ("pico_loop_lag_ms", "Event loop lag of the last sampler wakeup", None),
+        )
+        self.gauges = array('f', [0] * len(self.gauge_definitions))
+        self.gauge_index = {}
+        self.event_gauge_index = {}
+        for index, definition in enumerate(self.gauge_definitions):
+            self.gauge_index[definition[0]] = index
+            if definition[2]:
+                self.event_gauge_index[definition[2]] = index
+
+        self.latency_buckets_ms = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+        self.bucket_count = len(self.latency_buckets_ms) + 1
+        self.max_routes = config.metrics_max_routes
+        self.route_index = {"other": 0}
+        self.request_counts = array('L', [0] * self.max_routes)
+        self.request_errors = array('L', [0] * self.max_routes)
+        self.latency_sum_ms = array('L', [0] * self.max_routes)
+        self.latency_histogram = array('L', [0] * (self.max_routes * self.bucket_count))
+        self.sample_interval_ms = config.metrics_sample_interval_s * 1000
+
+        events.add_listener(self.update_from_event)
+
+    def init_service(self) -> None:
+        self.logger.info("Loading metrics sampler")
+        create_task(self.system_sampler(), "metrics sampler")
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[self.gauge_index[name]] = value
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        for key in changed:
+            if key not in self.event_gauge_index:
+                continue
+            value = changed[key]
+            if key == "wifi_status":
+                value = value == "Connected"
+            if type(value) in (int, float, bool):
+                self.gauges[self.event_gauge_index[key]] = value
+
+    def observe_request(self, route: str, code: int, elapsed_ms: int) -> None:
+        """Count a served request and its handler latency against its route"""
+        index = self.route_index.get(route)
+        if index is None:
+            index = 0
+            if len(self.route_index) < self.max_routes:
+                index = len(self.route_index)
+                self.route_index[route] = index
+        self.request_counts[index] += 1
+        if code >= 400:
+            self.request_errors[index] += 1
+        self.latency_sum_ms[index] += elapsed_ms
+        bucket = 0
+        while bucket < len(self.latency_buckets_ms) and elapsed_ms > self.latency_buckets_ms[bucket]:
+            bucket += 1
+        self.latency_histogram[index * self.bucket_count + bucket] += 1
+
+    async def system_sampler(self) -> None:
+        while True:
+            start = ticks_ms()
+            await sleep_ms(self.sample_interval_ms)
+            self.set_gauge("pico_loop_lag_ms", max(0, ticks_diff(ticks_ms(), start) - self.sample_interval_ms))
+            gc_start = ticks_us()
+            gc.collect()
+            self.set_gauge("pico_gc_duration_ms", ticks_diff(ticks_us(), gc_start) / 1000)
+            self.set_gauge("pico_mem_free_bytes", gc.mem_free())
+            self.set_gauge("pico_mem_alloc_bytes", gc.mem_alloc())
+
+    def exposition_lines(self):
+        """Generator of text exposition format lines, so the response is streamed rather than built as one string"""
+        for index, definition in enumerate(self.gauge_definitions):
+            yield f"# HELP {definition[0]} {definition[1]}\n# TYPE {definition[0]} gauge\n"
+            yield f"{definition[0]} {self.gauges[index]}\n"
+
+        yield "# HELP pico_http_requests_total Requests served per route\n# TYPE pico_http_requests_total counter\n"
+        for route in self.route_index:
+            yield f'pico_http_requests_total{{route="{route}"}} {self.request_counts[self.route_index[route]]}\n'
+
+        yield "# HELP pico_http_request_errors_total Requests answered with an error code per route\n# TYPE pico_http_request_errors_total counter\n"
+        for route in self.route_index:
+            yield f'pico_http_request_errors_total{{route="{route}"}} {self.request_errors[self.route_index[route]]}\n'
+
+        yield "# HELP pico_http_request_duration_ms Handler latency per route\n# TYPE pico_http_request_duration_ms histogram\n"
+        for route in self.route_index:
+            index = self.route_index[route]
+            cumulative = 0
+            for bucket in range(self.bucket_count):
+                cumulative += self.latency_histogram[index * self.bucket_count + bucket]
+                le = self.latency_buckets_ms[bucket] if bucket < len(self.latency_buckets_ms) else "+Inf"
+                yield f'pico_http_request_duration_ms_bucket{{route="{route}",le="{le}"}} {cumulative}\n'
+            yield f'pico_http_request_duration_ms_sum{{route="{route}"}} {self.latency_sum_ms[index]}\n'
+            yield f'pico_http_request_duration_ms_count{{route="{route}"}} {self.request_counts[index]}\n'
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        for index, definition in enumerate(self.gauge_definitions):
+            all_data[definition[0]] = self.gauges[index]
+        return all_data
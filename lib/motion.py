@@ -5,86 +5,105 @@ Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni
 from ulogging import uLogger
 import config
 from machine import Pin
-from asyncio import Event, create_task, sleep
-from light import Light
+from asyncio import Event, ThreadSafeFlag
+from lib.task_profiler import create_task
 from time import time
+from lib.events import Event_Publisher
+from lib.scheduler import Scheduler
 
 class Motion_Detector:
-    def __init__(self, log_level: int) -> None:
+    def __init__(self, log_level: int, events: Event_Publisher, light, scheduler: Scheduler) -> None:
+        """light is the Light module switched by motion, or None when the light is disabled in config"""
         self.log_level = log_level
         self.logger = uLogger("Motion", log_level)
         self.logger.info("Init motion detector")
+        self.events = events
+        self.scheduler = scheduler
         self.pin = Pin(config.pir_pin, Pin.IN, Pin.PULL_DOWN)
+        self.old_motion_value = 0
+        # PIR changes are signalled by interrupt rather than polled, which also wakes the Pico from lightsleep
+        self.pin_changed = ThreadSafeFlag()
         self.ON = 1
         self.OFF = -1
         self.motion_detected = False
         self.motion_updated = Event()
-        self.light = Light(log_level)
+        self.light = light
         self.light_off_delay = config.motion_light_off_delay
-        self.light_off_time = 0
         self.enabled = True
         self.config_enabled = config.enable_motion_detection
+        self.publish_state()
 
     def init_service(self) -> None:
-        self.logger.info("Loading motion monitor")
-        create_task(self.motion_monitor())
-        self.logger.info("Loading motion light timer")
-        create_task(self.motion_light_off_timer())
-    
-    async def motion_monitor(self) -> None:
         if self.config_enabled == False:
             self.logger.info("Motion disabled in config - motion monitor disabled")
             return
         
-        old_motion_value = 0
+        self.logger.info("Loading motion monitor")
+        self.pin.irq(handler=self.pin_change_handler, trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING)
+        create_task(self.motion_monitor(), "motion monitor")
+    
+    def pin_change_handler(self, pin: Pin) -> None:
+        self.pin_changed.set()
+    
+    async def motion_monitor(self) -> None:
+        self.check_motion()
         while True:
-            if self.enabled:
-                new_motion_value = self.pin.value()
-                transition = new_motion_value - old_motion_value
-                
-                if transition == self.ON:
-                    await self.trigger_motion_detected()
-                if transition == self.OFF:
-                    await self.trigger_motion_no_longer_detected()
-                
-                old_motion_value = new_motion_value
-            await sleep(0.5)
+            await self.pin_changed.wait()
+            self.check_motion()
     
-    async def trigger_motion_detected(self) -> None:
+    def check_motion(self) -> None:
+        if self.enabled:
+            new_motion_value = self.pin.value()
+            transition = new_motion_value - self.old_motion_value
+            
+            if transition == self.ON:
+                self.trigger_motion_detected()
+            if transition == self.OFF:
+                self.trigger_motion_no_longer_detected()
+            
+            self.old_motion_value = new_motion_value
+    
+    def trigger_motion_detected(self) -> None:
         self.logger.info("Motion detected")
         self.motion_detected = True
         self.motion_updated.set()
-        self.light.on()
+        self.publish_state()
+        if self.light:
+            self.scheduler.cancel("motion light timeout")
+            self.light.on()
 
-    async def trigger_motion_no_longer_detected(self) -> None:
+    def trigger_motion_no_longer_detected(self) -> None:
         self.logger.info("Motion no longer detected")
-        self.light_off_time = time() + self.light_off_delay
-        self.logger.info(f"Time now: {time()} - Light off time {self.light_off_time}")
         self.motion_detected = False
         self.motion_updated.set()
+        self.publish_state()
+        if self.light:
+            self.logger.info(f"Time now: {time()} - Light off in {self.light_off_delay}s")
+            self.scheduler.after("motion light timeout", self.light_off_delay, self.motion_light_timeout)
     
-    async def motion_light_off_timer(self) -> None:
-        if self.config_enabled == False:
-            self.logger.info("Motion disabled in config - motion light off timer disabled")
-            return
-        
-        while True:
-            if self.motion_detected == 0 and self.light_off_time < time() and self.light.get_state() and self.enabled:
-                self.logger.info("Motion light timeout exceeded")
-                self.light.off()
-            await sleep(0.1)
+    def motion_light_timeout(self) -> None:
+        if not self.motion_detected and self.light.get_state() and self.enabled:
+            self.logger.info("Motion light timeout exceeded")
+            self.light.off()
     
+    def publish_state(self) -> None:
+        self.events.publish("motion", {"motion_state": self.get_state(), "light_motion_detection": self.get_enabled()})
+
     def get_state(self) -> bool:
         return self.motion_detected
     
     def enable(self) -> None:
         self.logger.info("Motion detection enabled")
         self.enabled = True
+        self.publish_state()
+        if self.light and not self.motion_detected:
+            self.scheduler.after("motion light timeout", self.light_off_delay, self.motion_light_timeout)
         return
 
     def disable(self) -> None:
         self.logger.info("Motion detection disabled")
         self.enabled = False
+        self.publish_state()
         return
     
     def get_enabled(self) -> bool:
@@ -0,0 +1,167 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from json import dumps
+from time import ticks_ms, ticks_diff
+import asyncio
+import config
+from lib.ulogging import uLogger
+from lib.task_profiler import create_task
+from lib.mqtt_client import MQTT_Client
+from lib.ha_discovery import HA_Discovery
+
+class MQTT_Publisher:
+    """
+    Publishes module state to an MQTT broker for integrations such as Home Assistant, in place of polling the REST API.
+    State is collected from change events and published as one retained JSON document on the state topic, at most once
+    per mqtt_batch_interval_s so changes arriving together share a publish, and every mqtt_heartbeat_s without changes.
+    Light and motion detection commands on the command topics are routed to the light and motion modules.
+    Home Assistant discovery configs are published from the flash cache on each connection when enabled.
+    """
+    def __init__(self, log_level: int, modules: dict) -> None:
+        self.logger = uLogger("MQTT", log_level)
+        self.logger.info("Init MQTT publisher")
+        self.wlan = modules['wlan']
+        self.light = modules.get('light')
+        self.motion = modules.get('motion')
+        self.device_id = config.mqtt_client_id or "pico-environment-" + self.wlan.get_mac().replace(":", "")
+        self.base_topic = f"{config.mqtt_topic_prefix}/{self.device_id}"
+        self.state_topic = self.base_topic + "/state"
+        self.availability_topic = self.base_topic + "/availability"
+        self.command_topics = {
+            self.base_topic + "/light/set": self.command_light,
+            self.base_topic + "/light/brightness/set": self.command_brightness,
+            self.base_topic + "/motion_detection/set": self.command_motion_detection,
+        }
+        self.client = MQTT_Client(self.device_id, config.mqtt_broker, config.mqtt_port, config.mqtt_user, config.mqtt_password, config.mqtt_keepalive_s)
+        self.client.set_last_will(self.availability_topic, "offline")
+        self.client.on_message = self.handle_message
+        self.discovery = HA_Discovery(log_level, modules, self.device_id, self.base_topic) if config.enable_ha_discovery else None
+        # Event keys published, as named in the state document
+        self.state_keys = ("fan_speed", "indoor_humidity", "outdoor_humidity", "battery_voltage", "battery_soc", "battery_state",
+                           "light_state", "light_brightness", "motion_state", "light_motion_detection", "wifi_rssi")
+        self.state = {}
+        self.state_changed = asyncio.Event()
+        self.connection_lost = asyncio.Event()
+        self.failures = 0
+        self.connects = 0
+        self.publishes = 0
+        self.commands = 0
+        self.last_publish_ms = 0
+        modules['events'].add_listener(self.update_from_event)
+
+    def init_service(self) -> None:
+        if self.discovery:
+            # Run at service start as the modules dict is complete by then
+            self.discovery.ensure_cache()
+        self.logger.info("Loading MQTT connection manager")
+        create_task(self.connection_manager(), "mqtt connection manager")
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        for key in changed:
+            if key in self.state_keys:
+                self.state[key] = changed[key]
+                self.state_changed.set()
+
+    async def connection_manager(self) -> None:
+        """Connect once the wireless link is up, then publish until the connection fails and reconnect with backoff"""
+        while True:
+            await self.wlan.wait_for_link()
+            try:
+                await self.client.connect(config.mqtt_connect_timeout_s)
+                self.connects += 1
+                self.failures = 0
+                self.logger.info(f"Connected to MQTT broker {config.mqtt_broker}:{config.mqtt_port}")
+                await self.client.publish(self.availability_topic, "online", retain=True)
+                for topic in self.command_topics:
+                    await self.client.subscribe(topic)
+                if self.discovery:
+                    await self.discovery.publish(self.client)
+                self.connection_lost.clear()
+                tasks = (create_task(self.run_until_failed(self.client.receive_loop()), "mqtt receiver"),
+                         create_task(self.run_until_failed(self.state_publisher()), "mqtt state publisher"))
+                await self.connection_lost.wait()
+                for task in tasks:
+                    task.cancel()
+            except Exception as e:
+                self.failures += 1
+                self.logger.warn(f"MQTT connection failed: {e}")
+            await self.client.close()
+            # A dropped connection leaves failures at 0 and retries after the base delay, like a first failed connect
+            backoff_s = min(config.mqtt_reconnect_max_s, config.mqtt_reconnect_s * (2 ** min(max(self.failures - 1, 0), 8)))
+            self.logger.info(f"Reconnecting to MQTT broker in {backoff_s}s")
+            await asyncio.sleep(backoff_s)
+
+    async def run_until_failed(self, coro) -> None:
+        """Run a connection task, signalling the connection manager to reconnect if it fails"""
+        try:
+            await coro
+        except Exception as e:
+            self.logger.warn(f"MQTT connection lost: {e}")
+        self.connection_lost.set()
+
+    async def state_publisher(self) -> None:
+        """Publish state on change, batching changes within mqtt_batch_interval_s, or on the heartbeat if unchanged"""
+        while True:
+            await self.publish_state()
+            try:
+                await asyncio.wait_for(self.state_changed.wait(), config.mqtt_heartbeat_s)
+                # Let changes arriving together, such as light state and brightness, go out in one publish
+                await asyncio.sleep(config.mqtt_batch_interval_s)
+            except asyncio.TimeoutError:
+                pass
+
+    async def publish_state(self) -> None:
+        self.state_changed.clear()
+        await self.client.publish(self.state_topic, dumps(self.state), retain=True)
+        self.publishes += 1
+        self.last_publish_ms = ticks_ms()
+
+    def handle_message(self, topic: str, message: bytes) -> None:
+        command = self.command_topics.get(topic)
+        if command is None:
+            return
+        value = message.decode().strip().lower()
+        self.logger.info(f"MQTT command {topic}: {value}")
+        self.commands += 1
+        try:
+            command(value)
+        except Exception as e:
+            self.logger.error(f"MQTT command {topic} failed: {e}")
+
+    def command_light(self, value: str) -> None:
+        if not self.light or value not in ("on", "off"):
+            return
+        # Manual control overrides motion detection, as for the web control socket
+        if self.motion:
+            self.motion.disable()
+        if value == "on":
+            self.light.on()
+        else:
+            self.light.off()
+
+    def command_brightness(self, value: str) -> None:
+        if self.light and value.isdigit() and int(value) <= 100:
+            self.light.set_brightness_pc(int(value))
+
+    def command_motion_detection(self, value: str) -> None:
+        if not self.motion or value not in ("enabled", "disabled"):
+            return
+        if value == "enabled":
+            self.motion.enable()
+        else:
+            self.motion.disable()
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['broker'] = f"{config.mqtt_broker}:{config.mqtt_port}"
+        all_data['connected'] = self.client.is_connected()
+        all_data['base topic'] = self.base_topic
+        all_data['connects'] = self.connects
+        all_data['publishes'] = self.publishes
+        all_data['commands'] = self.commands
+        all_data['last publish s ago'] = ticks_diff(ticks_ms(), self.last_publish_ms) // 1000 if self.publishes else -1
+        if self.discovery:
+            all_data['ha discovery'] = self.discovery.get_all_data()
+        return all_data
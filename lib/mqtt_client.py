@@ -0,0 +1,174 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+import asyncio
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+class MQTT_Error(Exception):
+    pass
+
+def encode_length(length: int) -> bytes:
+    """MQTT remaining length, 7 bits per byte with the top bit set on all but the last byte"""
+    encoded = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+def encode_string(value) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+    return len(value).to_bytes(2, "big") + value
+
+def packet(packet_type: int, body: bytes) -> bytes:
+    return bytes([packet_type]) + encode_length(len(body)) + body
+
+class MQTT_Client:
+    """
+    Minimal asyncio MQTT 3.1.1 client supporting QoS 0 publish, subscribe, keepalive pings and a last will.
+    Uses only asyncio streams, so it runs under CPython against a local broker as well as on the Pico.
+    Received publishes are passed to the on_message callback from receive_loop, which must be running while connected.
+    """
+    def __init__(self, client_id: str, server: str, port: int = 1883, user: str = "", password: str = "", keepalive_s: int = 60) -> None:
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive_s = keepalive_s
+        self.will = None
+        self.on_message = None
+        self.reader = None
+        self.writer = None
+        self.packet_id = 0
+        self.awaiting_ping = False
+
+    def set_last_will(self, topic: str, message: str, retain: bool = True) -> None:
+        """Message the broker publishes for this client if it disconnects without a DISCONNECT"""
+        self.will = (topic, message, retain)
+
+    def is_connected(self) -> bool:
+        return self.writer is not None
+
+    async def connect(self, timeout_s: float = 10) -> None:
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.server, self.port), timeout_s)
+        flags = 0x02
+        payload = encode_string(self.client_id)
+        if self.will:
+            topic, message, retain = self.will
+            flags |= 0x04 | (0x20 if retain else 0)
+            payload += encode_string(topic) + encode_string(message)
+        if self.user:
+            flags |= 0x80
+            payload += encode_string(self.user)
+            if self.password:
+                flags |= 0x40
+                payload += encode_string(self.password)
+        body = encode_string("MQTT") + bytes([4, flags]) + self.keepalive_s.to_bytes(2, "big") + payload
+        try:
+            await self.send(packet(CONNECT, body))
+            packet_type, response = await asyncio.wait_for(self.read_packet(), timeout_s)
+            if packet_type != CONNACK or len(response) != 2:
+                raise MQTT_Error("Unexpected response to connect")
+            if response[1] != 0:
+                raise MQTT_Error(f"Connection refused with code {response[1]}")
+        except Exception:
+            await self.close()
+            raise
+        self.awaiting_ping = False
+
+    async def send(self, data: bytes) -> None:
+        if self.writer is None:
+            raise MQTT_Error("Not connected")
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def publish(self, topic: str, message, retain: bool = False) -> None:
+        if isinstance(message, str):
+            message = message.encode()
+        await self.send(packet(PUBLISH | (0x01 if retain else 0), encode_string(topic) + message))
+
+    async def subscribe(self, topic: str) -> None:
+        """Subscribe at QoS 0, the SUBACK is handled by receive_loop"""
+        self.packet_id = (self.packet_id % 0xFFFF) + 1
+        await self.send(packet(SUBSCRIBE, self.packet_id.to_bytes(2, "big") + encode_string(topic) + b"\x00"))
+
+    async def read_packet(self) -> tuple:
+        """Read one packet as (packet type, body), the type with its flag bits in the low nibble"""
+        header = await self.reader.readexactly(1)
+        return await self.read_remaining(header[0])
+
+    def handle_publish(self, flags: int, body: bytes) -> None:
+        topic_length = int.from_bytes(body[:2], "big")
+        topic = body[2:2 + topic_length].decode()
+        start = 2 + topic_length
+        if flags & 0x06:
+            # QoS 1 and 2 publishes carry a packet id, not expected as subscriptions are QoS 0
+            start += 2
+        if self.on_message:
+            self.on_message(topic, bytes(body[start:]))
+
+    async def receive_loop(self) -> None:
+        """
+        Dispatch incoming packets until the connection fails, pinging after half the keepalive without traffic.
+        Raises MQTT_Error if a ping is not answered within another half keepalive.
+        """
+        while True:
+            try:
+                # Only the first byte is timed, so a cancelled read never loses part of a packet
+                first = await asyncio.wait_for(self.reader.readexactly(1), self.keepalive_s / 2)
+            except asyncio.TimeoutError:
+                if self.awaiting_ping:
+                    raise MQTT_Error("Ping not answered")
+                self.awaiting_ping = True
+                await self.send(packet(PINGREQ, b""))
+                continue
+            self.awaiting_ping = False
+            packet_type, body = await self.read_remaining(first[0])
+            if packet_type & 0xF0 == PUBLISH:
+                self.handle_publish(packet_type & 0x0F, body)
+
+    async def read_remaining(self, header: int) -> tuple:
+        """Read the remaining length and body of a packet after its first byte"""
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await self.reader.readexactly(length) if length else b""
+        return header, body
+
+    async def disconnect(self) -> None:
+        """Clean disconnect, the last will is not published"""
+        try:
+            await self.send(packet(DISCONNECT, b""))
+        except Exception:
+            pass
+        await self.close()
+
+    async def close(self) -> None:
+        writer = self.writer
+        self.reader = None
+        self.writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
@@ -2,20 +2,31 @@
 Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
 """
 
-from time import ticks_ms
+from time import ticks_ms, ticks_diff
 from math import ceil
+from random import getrandbits
 import rp2
 import network
 from binascii import hexlify
 import config
 from lib.ulogging import uLogger
 from lib.helpers import Status_LED
-from asyncio import create_task, sleep
+from asyncio import sleep, Event, wait_for, TimeoutError
+from lib.task_profiler import create_task
 from display import Display
+from lib.events import Event_Publisher
+from lib.scheduler import Scheduler
+from lib.wifi_telemetry import Wifi_Telemetry
 
 class Wireless_Network:
-
-    def __init__(self, log_level: int, display: Display) -> None:
+    """
+    Owns the wireless link through a single connection manager task, which connects, reconnects with exponential
+    backoff and jitter when the link drops, and publishes link up and down as events.
+    Consumers await wait_for_link or read is_connected rather than driving reconnects themselves.
+    Link status, RSSI and IP config are sampled into a cache by one scheduled job and read from there by the API,
+    display and web app, with display and event updates only on transitions.
+    """
+    def __init__(self, log_level: int, display: Display, events: Event_Publisher, scheduler: Scheduler) -> None:
         self.logger = uLogger("WiFi", log_level)
         self.logger.info(f"Init WiFi")
         self.status_led = Status_LED(log_level)
@@ -24,8 +35,13 @@ class Wireless_Network:
         self.wifi_country = config.wifi_country
         rp2.country(self.wifi_country)
         self.disable_power_management = 0xa11140
+        # Firmware default radio power saving, used in low power mode
+        self.power_saving_power_management = 0xa11c82
+        self.power_saving = False
         self.led_retry_backoff_frequency = 4
         self.display = display
+        self.events = events
+        self.scheduler = scheduler
         
         # Reference: https://datasheets.raspberrypi.com/picow/connecting-to-the-internet-with-pico-w.pdf
         self.CYW43_LINK_DOWN = 0
@@ -48,6 +64,19 @@ class Wireless_Network:
         self.subnet = "Unknown"
         self.gateway = "Unknown"
         self.dns = "Unknown"
+        self.status = None
+        self.rssi = 0
+        self.sampled_ms = 0
+        self.wifi_status = "Unknown"
+        self.rssi_change_db = config.wifi_rssi_change_db
+        self.telemetry = Wifi_Telemetry(log_level)
+        self.connected = False
+        self.connecting = False
+        self.failures = 0
+        self.reconnects = 0
+        self.backoff_s = 0
+        self.link_up = Event()
+        self.link_lost = Event()
 
         self.configure_wifi()
 
@@ -57,30 +86,61 @@ class Wireless_Network:
         self.wlan.config(pm=self.disable_power_management)
         self.mac = hexlify(self.wlan.config('mac'),':').decode()
         self.logger.info("MAC: " + self.mac)
+        self.events.publish("wlan", {"mac_address": self.mac})
+
+    def set_power_saving(self, enabled: bool) -> None:
+        self.logger.info(f"Radio power saving: {enabled}")
+        self.wlan.config(pm=self.power_saving_power_management if enabled else self.disable_power_management)
+        self.power_saving = enabled
 
     def init_service(self) -> None:
-        create_task(self.network_status_monitor())
+        self.logger.info("Loading wifi connection manager")
+        create_task(self.connection_manager(), "wifi connection manager")
+        self.scheduler.every("wlan status monitor", 5, self.update_network_status, run_now=True)
 
-    async def network_status_monitor(self) -> None:
-        while True:
-            status = self.dump_status()
-            if status == 3:
-                self.display.update_main_display_values({"wifi_status": "Connected"})
-            elif status >= 0:
-                self.display.update_main_display_values({"wifi_status": "Connecting"})
-            else:
-                self.display.update_main_display_values({"wifi_status": "Error"})
-            await sleep(5)
+    def update_network_status(self) -> None:
+        """Sample link status and RSSI into the cache, updating the display and publishing events on transitions"""
+        status = self.read_status()
+        if self.connected and not self.connecting and status != self.CYW43_LINK_UP:
+            self.logger.warn("Wireless link lost")
+            self.set_link_state(False)
+            self.link_lost.set()
+        if status == 3:
+            wifi_status = "Connected"
+        elif status >= 0:
+            wifi_status = "Connecting"
+        else:
+            wifi_status = "Error"
+        if wifi_status != self.wifi_status:
+            self.wifi_status = wifi_status
+            self.display.update_main_display_values({"wifi_status": wifi_status})
+            self.events.publish("wlan", {"wifi_status": wifi_status})
+        rssi = self.wlan.status('rssi') if status == self.CYW43_LINK_UP else 0
+        if status == self.CYW43_LINK_UP:
+            self.telemetry.record_rssi(rssi)
+        # RSSI fluctuates by a few dB between samples, so is only published on a larger change
+        if abs(rssi - self.rssi) >= self.rssi_change_db or (rssi == 0) != (self.rssi == 0):
+            self.rssi = rssi
+            self.events.publish("wlan", {"wifi_rssi": rssi})
     
     def dump_status(self):
         status = self.wlan.status()
         self.logger.info(f"active: {1 if self.wlan.active() else 0}, status: {status} ({self.status_names[status]})")
         return status
+
+    def read_status(self) -> int:
+        """Read link status from the radio into the cache, logged only when it changes"""
+        status = self.wlan.status()
+        self.sampled_ms = ticks_ms()
+        if status != self.status:
+            self.status = status
+            self.dump_status()
+        return status
     
     async def wait_status(self, expected_status, *, timeout=config.wifi_connect_timeout_seconds, tick_sleep=0.5) -> bool:
         for unused in range(ceil(timeout / tick_sleep)):
             await sleep(tick_sleep)
-            status = self.dump_status()
+            status = self.read_status()
             if status == expected_status:
                 return True
             if status < 0:
@@ -88,7 +148,7 @@ class Wireless_Network:
         return False
     
     async def disconnect_wifi_if_necessary(self) -> None:
-        status = self.dump_status()
+        status = self.read_status()
         if status >= self.CYW43_LINK_JOIN and status <= self.CYW43_LINK_UP:
             self.logger.info("Disconnecting...")
             self.wlan.disconnect()
@@ -98,10 +158,11 @@ class Wireless_Network:
                 raise Exception(f"Failed to disconnect: {x}")
         self.logger.info("Ready for connection!")
     
-    def generate_connection_info(self, elapsed_ms) -> None:
+    def update_ip_config(self) -> None:
         self.ip, self.subnet, self.gateway, self.dns = self.wlan.ifconfig()
         self.logger.info(f"IP: {self.ip}, Subnet: {self.subnet}, Gateway: {self.gateway}, DNS: {self.dns}")
-        
+
+    def generate_connection_info(self, elapsed_ms) -> None:
         self.logger.info(f"Elapsed: {elapsed_ms}ms")
         if elapsed_ms > 5000:
             self.logger.warn(f"took {elapsed_ms} milliseconds to connect to wifi")
@@ -132,34 +193,81 @@ class Wireless_Network:
         except Exception:
             raise Exception(f"Failed to connect to network")
 
-        elapsed_ms = ticks_ms() - start_ms
+        elapsed_ms = ticks_diff(ticks_ms(), start_ms)
+        self.telemetry.record_connect(elapsed_ms)
         self.generate_connection_info(elapsed_ms)
 
     def get_status(self) -> int:
-        return self.wlan.status()
+        """Cached link status from the last sample"""
+        return self.status if self.status is not None else self.read_status()
     
-    async def network_retry_backoff(self) -> None:
-        self.logger.info(f"Backing off retry for {config.wifi_retry_backoff_seconds} seconds")
-        await self.status_led.flash((config.wifi_retry_backoff_seconds * self.led_retry_backoff_frequency), self.led_retry_backoff_frequency)
-
-    async def check_network_access(self) -> bool:
-        self.logger.info("Checking for network access")
-        retries = 0
-        while self.get_status() != 3 and retries <= config.wifi_connect_retries:
-            try:
-                await self.connect_wifi()
-                return True
-            except Exception:
-                self.logger.warn(f"Error connecting to wifi on attempt {retries + 1} of {config.wifi_connect_retries + 1}")
-                retries += 1
-                await self.network_retry_backoff()
+    def next_backoff_s(self) -> float:
+        """Backoff doubling from wifi_retry_backoff_seconds per consecutive failure up to wifi_backoff_max_seconds, with the
+        upper wifi_backoff_jitter fraction randomised so devices that lost the same access point don't retry in step"""
+        backoff = min(config.wifi_backoff_max_seconds, config.wifi_retry_backoff_seconds * (2 ** min(self.failures - 1, 16)))
+        return backoff * (1 - config.wifi_backoff_jitter * getrandbits(8) / 255)
+
+    async def network_retry_backoff(self, backoff_s: float) -> None:
+        self.logger.info(f"Backing off retry for {backoff_s:.1f} seconds")
+        # The LED only flashes for the base backoff to avoid keeping the CPU awake through long backoffs
+        flash_s = min(backoff_s, config.wifi_retry_backoff_seconds)
+        await self.status_led.flash(int(flash_s * self.led_retry_backoff_frequency), self.led_retry_backoff_frequency)
+        await sleep(backoff_s - flash_s)
 
-        if self.get_status() == 3:
+    def set_link_state(self, connected: bool) -> None:
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if connected:
+            self.update_ip_config()
+            self.link_up.set()
+            self.telemetry.link_up()
+        else:
+            self.link_up.clear()
+            self.telemetry.link_down()
+        self.events.publish("wlan", {"link_up": connected})
+
+    async def connection_manager(self) -> None:
+        """Connect, then wait for the status monitor to report the link lost and reconnect with backoff"""
+        while True:
+            if self.read_status() != self.CYW43_LINK_UP:
+                self.connecting = True
+                try:
+                    await self.connect_wifi()
+                    self.failures = 0
+                except Exception:
+                    self.failures += 1
+                    self.telemetry.record_connect_failure()
+                    self.backoff_s = self.next_backoff_s()
+                    self.logger.warn(f"Error connecting to wifi, {self.failures} consecutive failures")
+                    await self.network_retry_backoff(self.backoff_s)
+                    continue
+                finally:
+                    self.connecting = False
             self.logger.info("Connected to wireless network")
+            self.backoff_s = 0
+            self.link_lost.clear()
+            self.set_link_state(True)
+            self.update_network_status()
+            await self.link_lost.wait()
+            self.reconnects += 1
+
+    def is_connected(self) -> bool:
+        """Cached link state from the connection manager, does not touch the radio"""
+        return self.connected
+
+    async def wait_for_link(self, timeout_s: float | None = None) -> bool:
+        """Wait up to timeout_s, or indefinitely if None, for the connection manager to bring the link up"""
+        if self.connected:
             return True
-        else:
-            self.logger.warn("Unable to connect to wireless network")
-            return False
+        try:
+            if timeout_s is None:
+                await self.link_up.wait()
+            else:
+                await wait_for(self.link_up.wait(), timeout_s)
+        except TimeoutError:
+            self.logger.warn(f"Wireless link not up after {timeout_s}s")
+        return self.connected
         
     def get_mac(self) -> str:
         return self.mac
@@ -174,4 +282,15 @@ class Wireless_Network:
         status = self.get_status()
         all_data['status description'] = self.get_wlan_status_description(status)
         all_data['status code'] = status
+        all_data['rssi dbm'] = self.rssi
+        all_data['ip'] = self.ip
+        all_data['subnet'] = self.subnet
+        all_data['gateway'] = self.gateway
+        all_data['dns'] = self.dns
+        all_data['sampled ms ago'] = ticks_diff(ticks_ms(), self.sampled_ms)
+        all_data['link up'] = self.connected
+        all_data['consecutive failures'] = self.failures
+        all_data['backoff s'] = round(self.backoff_s, 1)
+        all_data['reconnects'] = self.reconnects
+        all_data['telemetry'] = self.telemetry.get_all_data()
         return all_data
@@ -0,0 +1,224 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+import os
+from json import dumps
+from time import time, ticks_ms
+import asyncio
+import ntptime
+import config
+from lib.ulogging import uLogger
+from lib.task_profiler import create_task
+import uaiohttpclient
+
+class Offline_Queue:
+    """
+    Store and forward queue of timestamped readings observed while the push target is unreachable.
+    Queueing starts once the target has been reachable and is lost, so readings from boot before the first connection are not queued.
+    The clock is set from NTP once the link is up, readings queued before then are stamped with uptime as the RTC starts unset.
+    Readings from change events are buffered in memory and flushed to numbered segment files in flash, as JSON lines,
+    bounded to offline_queue_max_records by dropping the oldest segment or discarding new readings.
+    Once the target is reachable the backlog is drained oldest first in rate limited batches, to the MQTT backlog topic
+    or POSTed to an HTTP endpoint, and each segment is deleted once sent. Delivery is at least once, a restart while
+    draining resends the current segment.
+    """
+    def __init__(self, log_level: int, modules: dict) -> None:
+        self.logger = uLogger("Offline queue", log_level)
+        self.logger.info("Init offline queue")
+        self.wlan = modules['wlan']
+        self.mqtt = modules.get('mqtt')
+        self.target = config.offline_queue_target
+        if self.target == "mqtt" and self.mqtt is None:
+            self.logger.warn("MQTT target configured but MQTT is disabled, the backlog will not drain")
+        self.directory = config.offline_queue_dir
+        self.segment_records = config.offline_queue_segment_records
+        self.max_segments = max(1, config.offline_queue_max_records // self.segment_records)
+        self.drop_policy = config.offline_queue_drop_policy
+        self.reading_keys = ("fan_speed", "indoor_humidity", "outdoor_humidity", "battery_voltage", "battery_soc", "battery_state",
+                             "light_state", "light_brightness", "motion_state", "wifi_rssi")
+        self.pending = []
+        # Segment files in flash as [segment number, record count], oldest first
+        self.segments = []
+        self.read_offset = 0
+        self.backlog_changed = asyncio.Event()
+        self.armed = False
+        self.clock_synced = False
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.send_failures = 0
+        modules['events'].add_listener(self.update_from_event)
+
+    def init_service(self) -> None:
+        self.recover_segments()
+        self.logger.info("Loading offline queue forwarder")
+        create_task(self.clock_sync(), "offline queue clock sync")
+        create_task(self.forwarder(), "offline queue forwarder")
+
+    async def clock_sync(self) -> None:
+        """Set the clock from NTP once the link is up, retrying until it succeeds"""
+        ntptime.host = config.ntp_host
+        while True:
+            await self.wlan.wait_for_link()
+            try:
+                ntptime.settime()
+                self.clock_synced = True
+                self.logger.info(f"Clock set from {config.ntp_host}")
+                return
+            except Exception as e:
+                self.logger.warn(f"Setting clock from {config.ntp_host} failed: {e}")
+            await asyncio.sleep(config.offline_queue_retry_s)
+
+    def segment_path(self, number: int) -> str:
+        return f"{self.directory}/{number}.jsonl"
+
+    def recover_segments(self) -> None:
+        """Load the backlog left in flash by a previous boot"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+            names = []
+        numbers = sorted([int(name.split(".")[0]) for name in names if name.endswith(".jsonl")])
+        for number in numbers:
+            with open(self.segment_path(number)) as segment:
+                self.segments.append([number, sum(1 for unused in segment)])
+        if self.segments:
+            self.logger.info(f"Recovered {self.backlog()} queued readings")
+            self.backlog_changed.set()
+
+    def backlog(self) -> int:
+        return sum([segment[1] for segment in self.segments]) - self.read_offset + len(self.pending)
+
+    def target_online(self) -> bool:
+        if self.target == "mqtt":
+            return self.mqtt is not None and self.mqtt.client.is_connected()
+        return self.wlan.is_connected()
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        if self.target_online():
+            self.armed = True
+            return
+        if not self.armed:
+            # The target has not been reached since boot, so it is unconfigured or still connecting rather than lost
+            return
+        reading = {}
+        for key in changed:
+            if key in self.reading_keys:
+                reading[key] = changed[key]
+        if not reading:
+            return
+        if self.clock_synced:
+            reading['t'] = time()
+        else:
+            reading['uptime_s'] = ticks_ms() // 1000
+        self.pending.append(reading)
+        self.queued += 1
+        if len(self.pending) >= config.offline_queue_flush_records:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append buffered readings to the newest segment, starting new segments and applying the drop policy when full"""
+        if not self.pending:
+            return
+        for reading in self.pending:
+            if not self.segments or self.segments[-1][1] >= self.segment_records:
+                if not self.start_segment():
+                    self.dropped += 1
+                    continue
+            with open(self.segment_path(self.segments[-1][0]), "a") as segment:
+                segment.write(dumps(reading) + "\n")
+            self.segments[-1][1] += 1
+        self.pending = []
+        self.backlog_changed.set()
+
+    def start_segment(self) -> bool:
+        """Start a new segment, returns False if the queue is full and the drop policy discards new readings"""
+        if len(self.segments) >= self.max_segments:
+            if self.drop_policy == "newest":
+                return False
+            number, count = self.segments.pop(0)
+            self.dropped += count - self.read_offset
+            self.read_offset = 0
+            os.remove(self.segment_path(number))
+            self.logger.warn(f"Offline queue full, dropped oldest segment of {count} readings")
+        number = self.segments[-1][0] + 1 if self.segments else 0
+        self.segments.append([number, 0])
+        return True
+
+    def read_batch(self) -> list:
+        """Next batch of unsent lines from the oldest segment"""
+        lines = []
+        with open(self.segment_path(self.segments[0][0])) as segment:
+            for index, line in enumerate(segment):
+                if index < self.read_offset:
+                    continue
+                lines.append(line.rstrip("\n"))
+                if len(lines) >= config.offline_queue_batch_records:
+                    break
+        return lines
+
+    def batch_sent(self, number: int, count: int) -> None:
+        self.sent += count
+        if not self.segments or self.segments[0][0] != number:
+            # The drop policy removed the segment while the batch was being sent
+            return
+        self.read_offset += count
+        if self.read_offset >= self.segments[0][1]:
+            number = self.segments.pop(0)[0]
+            self.read_offset = 0
+            os.remove(self.segment_path(number))
+
+    async def send_batch(self, payload: str) -> None:
+        if self.target == "mqtt":
+            await self.mqtt.client.publish(self.mqtt.base_topic + "/backlog", payload)
+            return
+        response = await uaiohttpclient.request("POST", config.offline_queue_http_url, data=payload)
+        await response.read()
+        if response.status < 200 or response.status > 299:
+            raise OSError(f"HTTP status {response.status}")
+
+    async def forwarder(self) -> None:
+        """Drain the backlog in rate limited batches while the target is reachable"""
+        while True:
+            if self.backlog() == 0:
+                self.backlog_changed.clear()
+                await self.backlog_changed.wait()
+                continue
+            await self.wlan.wait_for_link()
+            if not self.target_online():
+                await asyncio.sleep(config.offline_queue_retry_s)
+                continue
+            self.flush()
+            if not self.segments:
+                continue
+            if len(self.segments) == 1:
+                # Close the segment being drained so new readings start another
+                self.segments.append([self.segments[-1][0] + 1, 0])
+            number = self.segments[0][0]
+            try:
+                lines = self.read_batch()
+                await self.send_batch("[" + ",".join(lines) + "]")
+                self.batch_sent(number, len(lines))
+                self.logger.info(f"Forwarded {len(lines)} queued readings, {self.backlog()} remaining")
+                await asyncio.sleep(config.offline_queue_batch_interval_s)
+            except Exception as e:
+                self.send_failures += 1
+                self.logger.warn(f"Forwarding queued readings failed: {e}")
+                await asyncio.sleep(config.offline_queue_retry_s)
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['target'] = self.target
+        all_data['backlog'] = self.backlog()
+        all_data['max records'] = self.max_segments * self.segment_records
+        all_data['drop policy'] = self.drop_policy
+        all_data['queueing armed'] = self.armed
+        all_data['clock synced'] = self.clock_synced
+        all_data['segments'] = len(self.segments)
+        all_data['queued'] = self.queued
+        all_data['sent'] = self.sent
+        all_data['dropped'] = self.dropped
+        all_data['send failures'] = self.send_failures
+        return all_data
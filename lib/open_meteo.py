@@ -15,10 +15,10 @@ class Weather_API:
     Class for interacting with the Open_Meteo API using async requests
     Provides example for retrieving and processing humidity information
     """
-    def __init__(self, log_level: int) -> None:
+    def __init__(self, log_level: int, latlong: list | None = None) -> None:
         self.logger = uLogger("Open-Meteo", log_level)
         self.logger.info("Init Open-Meteo")
-        self.latlong = config.lat_long
+        self.latlong = latlong if latlong is not None else config.lat_long
         self.baseurl = "http://api.open-meteo.com/v1/forecast?latitude={}&longitude={}".format(self.latlong[0], self.latlong[1])
         
     async def get_humidity_async(self) -> dict:
@@ -30,15 +30,20 @@ class Weather_API:
         self.url = self.baseurl + self.parameters
         weather = {}
         self.logger.info(self.url)
-        request = await uaiohttpclient.request("GET", self.url)
+        request = await uaiohttpclient.request("GET", self.url, connect_timeout=config.weather_connect_timeout_s, read_timeout=config.weather_read_timeout_s)
         self.logger.info(f"request: {request}")
-        response = await request.read()
-        self.logger.info(f"response data: {response}")
-        
-        if request.status == 200:
-            weather = self.process_weather(loads(response))
-        else:
-            self.logger.error("Failure to get weather data.\nStatus code: {}\nResponse text: {}".format(request.status, response))
+        try:
+            response = await request.read()
+            self.logger.info(f"response data: {response}")
+
+            if request.status == 200:
+                weather = self.process_weather(loads(response))
+            else:
+                self.logger.error("Failure to get weather data.\nStatus code: {}\nResponse text: {}".format(request.status, response))
+        except Exception:
+            # Closes the socket if the body read failed part way, a fully read response is already released
+            request.close()
+            raise
 
         gc.collect()
 
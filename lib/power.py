@@ -0,0 +1,147 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from time import ticks_ms, ticks_diff
+import machine
+import asyncio
+import asyncio.core
+import config
+from lib.ulogging import uLogger
+from lib.task_profiler import create_task
+
+class Pico_Clock:
+    """Clock and task queue used by the power manager, replace with a simulated clock providing the same methods to test off device"""
+    def ticks_ms(self) -> int:
+        return ticks_ms()
+
+    def lightsleep(self, ms: int) -> None:
+        machine.lightsleep(ms)
+
+    def next_task_due_ms(self) -> int | None:
+        """Tick the next queued asyncio task is due, None if no task is queued"""
+        # The asyncio task queue is ordered by the tick each task is due
+        task = asyncio.core._task_queue.peek()
+        return task.ph_key if task is not None else None
+
+class Power_Manager:
+    """
+    Low power mode putting the Pico into lightsleep while it is idle, until the next asyncio task or scheduled job is due.
+    The CPU stays awake while web clients are connected, motion is active, the light or backlight is on or the fan is
+    running at a partial PWM duty, as PWM counters stop during lightsleep. Pin interrupts from the motion sensor and
+    buttons wake it early. Radio power saving is enabled while in low power mode, except during weather fetches.
+    Also sheds load as the battery state changes, whether or not low power mode is enabled.
+    """
+    def __init__(self, log_level: int, modules: dict, clock: Pico_Clock | None = None) -> None:
+        self.logger = uLogger("Power", log_level)
+        self.logger.info("Init power manager")
+        self.enabled = config.enable_low_power
+        self.modules = modules
+        self.clock = clock if clock is not None else Pico_Clock()
+        self.min_sleep_ms = config.low_power_min_sleep_ms
+        self.max_sleep_ms = config.low_power_max_sleep_ms
+        self.check_interval_ms = config.low_power_check_interval_ms
+        self.start_ms = self.clock.ticks_ms()
+        self.asleep_ms = 0
+        self.sleeps = 0
+        self.battery_state = "normal"
+        modules['events'].add_listener(self.update_from_event)
+
+    def init_service(self) -> None:
+        if not self.enabled:
+            self.logger.info("Low power mode disabled in config")
+            return
+        self.logger.info("Loading low power idle sleeper")
+        self.modules['wlan'].set_power_saving(True)
+        create_task(self.idle_sleeper(), "low power idle sleeper")
+
+    def update_from_event(self, source: str, changed: dict) -> None:
+        if "battery_state" in changed:
+            self.apply_battery_state(changed["battery_state"])
+
+    def apply_battery_state(self, state: str) -> None:
+        """Stretch polling, cap the fan and light, shorten the backlight timeout and stop the web server as configured for the state"""
+        self.logger.info(f"Applying battery state {state}")
+        self.battery_state = state
+        self.modules['scheduler'].set_period_scale(config.battery_poll_stretch.get(state, 1))
+        fan = self.modules.get('fan')
+        if fan:
+            fan.set_max_speed(config.battery_fan_max_speed.get(state, 1))
+        light = self.modules.get('light')
+        if light:
+            light.set_max_brightness_pc(config.battery_light_max_brightness_pc.get(state, 100))
+        self.modules['display'].set_backlight_timeout_s(config.battery_backlight_timeout_s.get(state, config.backlight_timeout_s))
+        web_app = self.modules.get('web_app')
+        if web_app and config.battery_critical_disables_web:
+            if state == "critical":
+                web_app.stop_web_server()
+            else:
+                web_app.resume_web_server()
+
+    def web_clients_connected(self) -> bool:
+        web_app = self.modules.get('web_app')
+        return web_app is not None and len(web_app.app.conns) > 0
+
+    def outputs_active(self) -> bool:
+        motion = self.modules.get('motion')
+        if motion and motion.get_state():
+            return True
+        light = self.modules.get('light')
+        if light and light.get_state():
+            return True
+        fan = self.modules.get('fan')
+        if fan and fan.pwm_active():
+            return True
+        return self.modules['display'].get_backlight_state()
+
+    def can_sleep(self) -> bool:
+        return not self.web_clients_connected() and not self.outputs_active()
+
+    def next_wakeup_ms(self, now: int) -> int:
+        """Milliseconds until the next asyncio task or scheduled job is due, capped at low_power_max_sleep_ms"""
+        delay = self.max_sleep_ms
+        task_due_ms = self.clock.next_task_due_ms()
+        if task_due_ms is not None:
+            delay = min(delay, max(0, ticks_diff(task_due_ms, now)))
+        scheduler_delay = self.modules['scheduler'].next_deadline_ms(now)
+        if scheduler_delay >= 0:
+            delay = min(delay, scheduler_delay)
+        return delay
+
+    def sleep(self, ms: int) -> None:
+        start = self.clock.ticks_ms()
+        self.clock.lightsleep(ms)
+        self.asleep_ms += ticks_diff(self.clock.ticks_ms(), start)
+        self.sleeps += 1
+
+    def try_sleep(self) -> bool:
+        """Sleep until the next task is due if idle and it is far enough away, returns True if slept"""
+        if not self.can_sleep():
+            return False
+        delay = self.next_wakeup_ms(self.clock.ticks_ms())
+        if delay < self.min_sleep_ms:
+            return False
+        self.sleep(delay)
+        return True
+
+    async def idle_sleeper(self) -> None:
+        while True:
+            if self.try_sleep():
+                # Let tasks that became due while asleep run before checking again
+                await asyncio.sleep_ms(0)
+            else:
+                await asyncio.sleep_ms(self.check_interval_ms)
+
+    def get_duty_cycle_pc(self) -> float:
+        """Estimated percentage of time awake since boot"""
+        elapsed = max(1, ticks_diff(self.clock.ticks_ms(), self.start_ms))
+        return round(100 * (elapsed - min(self.asleep_ms, elapsed)) / elapsed, 1)
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['enabled'] = self.enabled
+        all_data['duty cycle pc'] = self.get_duty_cycle_pc()
+        all_data['asleep ms'] = self.asleep_ms
+        all_data['sleeps'] = self.sleeps
+        all_data['battery state'] = self.battery_state
+        return all_data
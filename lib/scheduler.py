@@ -0,0 +1,134 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from time import ticks_ms, ticks_add, ticks_diff
+import asyncio
+import config
+from lib.ulogging import uLogger
+from lib.task_profiler import create_task
+
+class Scheduled_Job:
+    """A callback due at a tick, repeating every period_ms or run once when period_ms is 0"""
+    def __init__(self, name: str, callback, period_ms: int, due_ms: int) -> None:
+        self.name = name
+        self.callback = callback
+        self.base_period_ms = period_ms
+        self.period_ms = period_ms
+        self.due_ms = due_ms
+        self.runs = 0
+
+class Scheduler:
+    """
+    Single task running the periodic and one shot jobs registered by modules, in place of a sleep loop per module.
+    Deadlines are aligned to a shared grid, periodic jobs to multiples of their period and one shot jobs to the tick,
+    so jobs with compatible periods run in the same wakeup. The task sleeps until the next deadline.
+    Callbacks run in the scheduler task so must not block, async work should be started with create_task.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("Scheduler", log_level)
+        self.logger.info("Init scheduler")
+        self.tick_ms = config.scheduler_tick_ms
+        self.epoch_ms = ticks_ms()
+        self.jobs = {}
+        self.wakeups = 0
+        self.period_scale = 1
+        self.jobs_changed = asyncio.Event()
+
+    def init_service(self) -> None:
+        self.logger.info("Loading scheduler")
+        create_task(self.run(), "scheduler")
+
+    def round_to_tick(self, ms: int) -> int:
+        return max(self.tick_ms, ((ms + self.tick_ms - 1) // self.tick_ms) * self.tick_ms)
+
+    def next_aligned_due(self, period_ms: int, now: int) -> int:
+        """First multiple of period_ms after now, counted from the scheduler epoch"""
+        return ticks_add(self.epoch_ms, ((ticks_diff(now, self.epoch_ms) // period_ms) + 1) * period_ms)
+
+    def every(self, name: str, period_s: float, callback, run_now: bool = False) -> None:
+        """Run callback every period_s seconds, replacing any job with the same name"""
+        job = Scheduled_Job(name, callback, self.round_to_tick(int(period_s * 1000)), 0)
+        job.period_ms = self.round_to_tick(int(job.base_period_ms * self.period_scale))
+        now = ticks_ms()
+        job.due_ms = now if run_now else self.next_aligned_due(job.period_ms, now)
+        self.add_job(job)
+
+    def after(self, name: str, delay_s: float, callback) -> None:
+        """Run callback once after delay_s seconds, replacing any job with the same name"""
+        now = ticks_ms()
+        due_ms = self.next_aligned_due(self.tick_ms, ticks_add(now, int(delay_s * 1000) - 1))
+        self.add_job(Scheduled_Job(name, callback, 0, due_ms))
+
+    def set_period_scale(self, scale: float) -> None:
+        """Stretch the period of all periodic jobs by scale, e.g. to poll less often on low battery"""
+        if scale == self.period_scale:
+            return
+        self.logger.info(f"Scaling periodic jobs by {scale}")
+        self.period_scale = scale
+        now = ticks_ms()
+        for name in self.jobs:
+            job = self.jobs[name]
+            if job.period_ms:
+                job.period_ms = self.round_to_tick(int(job.base_period_ms * scale))
+                job.due_ms = self.next_aligned_due(job.period_ms, now)
+        self.jobs_changed.set()
+
+    def cancel(self, name: str) -> None:
+        if name in self.jobs:
+            del self.jobs[name]
+
+    def add_job(self, job: Scheduled_Job) -> None:
+        self.logger.info(f"Scheduling {job.name} in {ticks_diff(job.due_ms, ticks_ms())}ms")
+        self.jobs[job.name] = job
+        # Wake the scheduler in case the new job is due before its current deadline
+        self.jobs_changed.set()
+
+    def next_deadline_ms(self, now: int) -> int:
+        """Milliseconds until the next job is due, or -1 if there are no jobs"""
+        delay = -1
+        for name in self.jobs:
+            job_delay = max(0, ticks_diff(self.jobs[name].due_ms, now))
+            if delay < 0 or job_delay < delay:
+                delay = job_delay
+        return delay
+
+    async def run(self) -> None:
+        while True:
+            self.jobs_changed.clear()
+            delay = self.next_deadline_ms(ticks_ms())
+            if delay < 0:
+                await self.jobs_changed.wait()
+                continue
+            if delay > 0:
+                try:
+                    await asyncio.wait_for_ms(self.jobs_changed.wait(), delay)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeups += 1
+            self.run_due_jobs(ticks_ms())
+
+    def run_due_jobs(self, now: int) -> None:
+        for job in [self.jobs[name] for name in self.jobs if ticks_diff(now, self.jobs[name].due_ms) >= 0]:
+            if job.period_ms:
+                # Skip any missed periods rather than running the job repeatedly to catch up
+                job.due_ms = self.next_aligned_due(job.period_ms, now)
+            elif self.jobs.get(job.name) is job:
+                del self.jobs[job.name]
+            job.runs += 1
+            try:
+                job.callback()
+            except Exception as e:
+                self.logger.error(f"Scheduled job {job.name} failed: {e}")
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['wakeups'] = self.wakeups
+        all_data['period scale'] = self.period_scale
+        jobs = {}
+        for name in self.jobs:
+            job = self.jobs[name]
+            jobs[name] = {'period ms': job.period_ms, 'runs': job.runs, 'due in ms': ticks_diff(job.due_ms, ticks_ms())}
+        all_data['jobs'] = jobs
+        return all_data
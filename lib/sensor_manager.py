@@ -0,0 +1,77 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from pimoroni_i2c import PimoroniI2C
+import asyncio
+import config
+from lib.ulogging import uLogger
+from lib.bme_280 import BME_280
+
+class I2C_Bus:
+    """An I2C bus shared by several sensors, reads must hold the lock so transactions on the bus never interleave"""
+    def __init__(self, name: str, pins: dict) -> None:
+        self.name = name
+        self.pins = pins
+        self.i2c = PimoroniI2C(**pins)
+        self.lock = asyncio.Lock()
+        self.sensors = []
+
+class Sensor_Manager:
+    """
+    Environmental sensors on one or more I2C buses, from config.i2c_buses and config.environment_sensors.
+    All sensors are read in one batched pass per cycle by read_all, with buses read concurrently and the sensors on
+    each bus read in turn under the bus lock, yielding to the event loop between sensors.
+    A sensor that fails to initialise or read is reported with empty readings rather than failing the pass.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("Sensors", log_level)
+        self.logger.info("Init sensor manager")
+        self.buses = {}
+        for name in config.i2c_buses:
+            self.buses[name] = I2C_Bus(name, config.i2c_buses[name])
+        self.sensors = {}
+        self.readings = {}
+        self.failures = {}
+        for name in config.environment_sensors:
+            sensor_config = config.environment_sensors[name]
+            bus = self.buses[sensor_config["bus"]]
+            self.failures[name] = 0
+            self.readings[name] = {}
+            try:
+                self.sensors[name] = BME_280(log_level, bus.i2c, sensor_config.get("address", 0x76), f"BME280 {name}")
+                bus.sensors.append(name)
+            except Exception as e:
+                self.failures[name] += 1
+                self.logger.error(f"Sensor {name} on bus {bus.name} failed to initialise: {e}")
+        self.passes = 0
+
+    def get_bus_lock(self, bus: str) -> asyncio.Lock:
+        """Lock to hold while using a bus from outside the sensor manager"""
+        return self.buses[bus].lock
+
+    async def read_bus(self, bus: I2C_Bus) -> None:
+        async with bus.lock:
+            for name in bus.sensors:
+                try:
+                    self.readings[name] = self.sensors[name].get_readings()
+                except Exception as e:
+                    self.readings[name] = {}
+                    self.failures[name] += 1
+                    self.logger.error(f"Sensor {name} read failed: {e}")
+                await asyncio.sleep_ms(0)
+
+    async def read_all(self) -> dict:
+        """Read every sensor in one pass, returns readings by sensor name"""
+        await asyncio.gather(*[self.read_bus(self.buses[name]) for name in self.buses])
+        self.passes += 1
+        return self.readings
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['passes'] = self.passes
+        sensors = {}
+        for name in self.readings:
+            sensors[name] = {'bus': config.environment_sensors[name]["bus"], 'readings': self.readings[name], 'failures': self.failures[name]}
+        all_data['sensors'] = sensors
+        return all_data
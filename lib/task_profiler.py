@@ -0,0 +1,142 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from array import array
+from time import ticks_ms, ticks_us, ticks_diff
+import asyncio
+import asyncio.core
+import config
+from lib.ulogging import uLogger
+
+# Profiler installed by Environment when enabled in config, None leaves tasks unwrapped
+_profiler = None
+
+def install(profiler) -> None:
+    global _profiler
+    _profiler = profiler
+
+def create_task(coro, name: str):
+    """
+    Drop in replacement for asyncio.create_task used by module services.
+    Tasks are wrapped by the task profiler when it is installed, otherwise created directly.
+    """
+    if _profiler is None:
+        return asyncio.create_task(coro)
+    return _profiler.create_task(coro, name)
+
+class Task_Stats:
+    """
+    Per task resume statistics.
+    Run time is time spent executing between yields, lag is how late the task resumed after it was due to run.
+    """
+    def __init__(self, run_buckets_us: tuple, lag_buckets_ms: tuple) -> None:
+        self.run_buckets_us = run_buckets_us
+        self.lag_buckets_ms = lag_buckets_ms
+        self.resumes = 0
+        self.run_us_total = 0
+        self.run_us_max = 0
+        self.lag_ms_total = 0
+        self.lag_ms_max = 0
+        self.run_histogram = array('L', [0] * (len(run_buckets_us) + 1))
+        self.lag_histogram = array('L', [0] * (len(lag_buckets_ms) + 1))
+
+    def bucket(self, buckets: tuple, value: int) -> int:
+        index = 0
+        while index < len(buckets) and value >= buckets[index]:
+            index += 1
+        return index
+
+    def record_run(self, run_us: int) -> None:
+        self.resumes += 1
+        self.run_us_total += run_us
+        self.run_us_max = max(self.run_us_max, run_us)
+        self.run_histogram[self.bucket(self.run_buckets_us, run_us)] += 1
+
+    def record_lag(self, lag_ms: int) -> None:
+        lag_ms = max(0, lag_ms)
+        self.lag_ms_total += lag_ms
+        self.lag_ms_max = max(self.lag_ms_max, lag_ms)
+        self.lag_histogram[self.bucket(self.lag_buckets_ms, lag_ms)] += 1
+
+    def get_report(self) -> dict:
+        report = {}
+        report['resumes'] = self.resumes
+        report['run ms total'] = self.run_us_total // 1000
+        report['run us max'] = self.run_us_max
+        report['lag ms avg'] = self.lag_ms_total // self.resumes if self.resumes else 0
+        report['lag ms max'] = self.lag_ms_max
+        report['run us histogram'] = list(self.run_histogram)
+        report['lag ms histogram'] = list(self.lag_histogram)
+        return report
+
+class Task_Profiler:
+    """
+    Opt in instrumentation of the asyncio tasks started by module services.
+    Each task coroutine is driven through a wrapper that times every resume and reads the scheduling deadline
+    of the task from the asyncio core to measure how late it resumed against its requested sleep or wakeup.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("Task profiler", log_level)
+        self.logger.info("Init task profiler")
+        self.enabled = config.enable_task_profiler
+        self.run_buckets_us = (100, 1000, 10000, 100000)
+        self.lag_buckets_ms = (1, 5, 20, 100)
+        self.tasks = {}
+
+    def init_service(self) -> None:
+        if self.enabled:
+            self.logger.info("Loading task profiler report")
+            create_task(self.report_logger(), "task profiler report")
+        else:
+            self.logger.info("Task profiler disabled in config")
+
+    def create_task(self, coro, name: str):
+        if name not in self.tasks:
+            self.tasks[name] = Task_Stats(self.run_buckets_us, self.lag_buckets_ms)
+        return asyncio.create_task(self.profile(self.tasks[name], coro))
+
+    def profile(self, stats: Task_Stats, coro):
+        """Generator driving the wrapped coroutine, passing its yields to and resumes from the scheduler unchanged"""
+        value = None
+        exception = None
+        while True:
+            start = ticks_us()
+            try:
+                if exception is None:
+                    yielded = coro.send(value)
+                else:
+                    yielded = coro.throw(exception)
+            except StopIteration as e:
+                stats.record_run(ticks_diff(ticks_us(), start))
+                return e.value
+            stats.record_run(ticks_diff(ticks_us(), start))
+            value = None
+            exception = None
+            try:
+                value = yield yielded
+            except BaseException as e:
+                exception = e
+            # The scheduler keys each queued task by the tick it became due
+            stats.record_lag(ticks_diff(ticks_ms(), asyncio.core.cur_task.ph_key))
+
+    def get_report(self) -> dict:
+        report = {}
+        for name in self.tasks:
+            report[name] = self.tasks[name].get_report()
+        return report
+
+    async def report_logger(self) -> None:
+        while True:
+            await asyncio.sleep(config.task_profiler_report_s)
+            self.log_report()
+
+    def log_report(self) -> None:
+        for name in self.tasks:
+            self.logger.info(f"{name}: {self.tasks[name].get_report()}")
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        all_data['enabled'] = self.enabled
+        all_data['tasks'] = self.get_report()
+        return all_data
@@ -1,38 +1,168 @@
 import uasyncio as asyncio
+from io import BytesIO
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+# Idle HTTP/1.1 keep-alive connections by (host, port), reused by the next request to the same host
+_pool = {}
+# Function (host, port) -> address used in place of resolving the host on every connection
+_resolver = None
+
+
+def set_resolver(resolver):
+    global _resolver
+    _resolver = resolver
+
+
+async def _wait(coro, timeout):
+    if timeout is None:
+        return await coro
+    return await asyncio.wait_for(coro, timeout)
+
+
+def _close(stream):
+    # uasyncio v3 Stream.close() does not close the socket
+    stream.s.close()
+
+
+def close_idle_connections():
+    for key in _pool:
+        _close(_pool[key])
+    _pool.clear()
+
+
+def _gunzip(data, max_size):
+    if deflate is None:
+        raise ValueError("gzip response received but deflate module is unavailable")
+    with deflate.DeflateIO(BytesIO(data), deflate.GZIP) as stream:
+        body = stream.read(max_size + 1)
+    if len(body) > max_size:
+        raise ValueError("Decompressed response exceeds max_size")
+    return body
 
 
 class ClientResponse:
-    def __init__(self, reader):
+    def __init__(self, reader, pool_key=None, length=-1, read_timeout=None, max_size=16384):
+        # pool_key is None when the connection cannot be reused, length is -1 to read until the connection closes
         self.content = reader
+        self.pool_key = pool_key
+        self.remaining = length
+        self.read_timeout = read_timeout
+        self.max_size = max_size
+        self.gzip = False
+        self.done = length == 0
+        if self.done:
+            self._release()
+
+    def _release(self):
+        """Return the connection to the pool once the body is fully read, otherwise close it"""
+        self.done = True
+        if self.content is None:
+            return
+        if self.pool_key is not None:
+            if self.pool_key in _pool:
+                _close(_pool[self.pool_key])
+            _pool[self.pool_key] = self.content
+        else:
+            _close(self.content)
+        self.content = None
+
+    def close(self):
+        """Close the connection without reading the rest of the body"""
+        self.pool_key = None
+        self._release()
+
+    async def _read_raw(self, sz):
+        if self.done:
+            return b""
+        if self.remaining > 0:
+            sz = min(sz, self.remaining)
+        try:
+            data = await _wait(self.content.read(sz), self.read_timeout)
+        except Exception:
+            # A timed out or failed read leaves the stream mid body, so it can't be reused
+            self.close()
+            raise
+        if not data:
+            if self.remaining > 0:
+                # Closed before Content-Length was reached
+                self.pool_key = None
+            self._release()
+            return data
+        if self.remaining > 0:
+            self.remaining -= len(data)
+            if self.remaining == 0:
+                self._release()
+        return data
+
+    async def readinto(self, buf):
+        """Stream the raw body into buf, returning the number of bytes read, 0 at the end of the body"""
+        data = await self._read_raw(len(buf))
+        buf[: len(data)] = data
+        return len(data)
 
     async def read(self, sz=-1):
-        return await self.content.read(sz)
+        """
+        Read up to sz bytes of the raw body, or with sz of -1 the whole body decoded from gzip if compressed.
+        The whole body is limited to max_size bytes, larger responses raise ValueError and close the connection.
+        """
+        if sz >= 0:
+            return await self._read_raw(sz)
+        body = bytearray()
+        while True:
+            data = await self._read_raw(512)
+            if not data:
+                break
+            body += data
+            if len(body) > self.max_size:
+                self.close()
+                raise ValueError("Response exceeds max_size")
+        if self.gzip:
+            return _gunzip(body, self.max_size)
+        return bytes(body)
 
     def __repr__(self):
         return "<ClientResponse %d %s>" % (self.status, self.headers)
 
 
 class ChunkedClientResponse(ClientResponse):
-    def __init__(self, reader):
-        self.content = reader
+    def __init__(self, reader, pool_key=None, read_timeout=None, max_size=16384):
+        super().__init__(reader, pool_key, -1, read_timeout, max_size)
         self.chunk_size = 0
 
-    async def read(self, sz=4 * 1024 * 1024):
+    async def _read_raw(self, sz=4 * 1024 * 1024):
+        if self.done:
+            return b""
+        try:
+            return await self._read_chunk(sz)
+        except Exception:
+            # A timed out or failed read leaves the stream mid body, so it can't be reused
+            self.close()
+            raise
+
+    async def _read_chunk(self, sz):
         if self.chunk_size == 0:
-            line = await self.content.readline()
+            line = await _wait(self.content.readline(), self.read_timeout)
             # print("chunk line:", l)
             line = line.split(b";", 1)[0]
             self.chunk_size = int(line, 16)
             # print("chunk size:", self.chunk_size)
             if self.chunk_size == 0:
                 # End of message
-                sep = await self.content.read(2)
+                sep = await _wait(self.content.read(2), self.read_timeout)
                 assert sep == b"\r\n"
+                self._release()
                 return b""
-        data = await self.content.read(min(sz, self.chunk_size))
+        data = await _wait(self.content.read(min(sz, self.chunk_size)), self.read_timeout)
+        if not data:
+            self.close()
+            return data
         self.chunk_size -= len(data)
         if self.chunk_size == 0:
-            sep = await self.content.read(2)
+            sep = await _wait(self.content.read(2), self.read_timeout)
             assert sep == b"\r\n"
         return data
 
@@ -40,7 +170,11 @@ class ChunkedClientResponse(ClientResponse):
         return "<ChunkedClientResponse %d %s>" % (self.status, self.headers)
 
 
-async def request_raw(method, url):
+async def request_raw(method, url, connect_timeout=None, keep_alive=True, data=None, content_type="application/json"):
+    """
+    Send a request with an optional body, reusing an idle connection to the host if available.
+    Returns (reader, pool_key, reused)
+    """
     try:
         proto, dummy, host, path = url.split("/", 3)
     except ValueError:
@@ -55,50 +189,100 @@ async def request_raw(method, url):
 
     if proto != "http:":
         raise ValueError("Unsupported protocol: " + proto)
-    reader, writer = await asyncio.open_connection(host, port)
-    # Use protocol 1.0, because 1.1 always allows to use chunked
-    # transfer-encoding But explicitly set Connection: close, even
-    # though this should be default for 1.0, because some servers
-    # misbehave w/o it.
-    query = "%s /%s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\nUser-Agent: compat\r\n\r\n" % (
+    pool_key = (host, port)
+    reader = _pool.pop(pool_key, None)
+    reused = reader is not None
+    if not reused:
+        address = _resolver(host, port) if _resolver is not None else host
+        reader, writer = await _wait(asyncio.open_connection(address, port), connect_timeout)
+    # HTTP/1.1 allows the connection to be kept open for the next request to the same host
+    if isinstance(data, str):
+        data = data.encode()
+    query = "%s /%s HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\nUser-Agent: compat\r\n%s%s\r\n" % (
         method,
         path,
         host,
+        "keep-alive" if keep_alive else "close",
+        "Accept-Encoding: gzip\r\n" if deflate is not None else "",
+        "Content-Type: %s\r\nContent-Length: %d\r\n" % (content_type, len(data)) if data is not None else "",
     )
-    await writer.awrite(query.encode("latin-1"))
-    return reader
+    try:
+        await _wait(reader.awrite(query.encode("latin-1")), connect_timeout)
+        if data is not None:
+            await _wait(reader.awrite(data), connect_timeout)
+    except OSError:
+        _close(reader)
+        if not reused:
+            raise
+        # The server closed the idle connection, retry on a new one
+        return await request_raw(method, url, connect_timeout, keep_alive, data, content_type)
+    return reader, pool_key if keep_alive else None, reused
 
 
-async def request(method, url):
+async def request(method, url, connect_timeout=10, read_timeout=10, keep_alive=True, max_size=16384, data=None, content_type="application/json"):
+    """
+    Make a request, connect_timeout covers connecting and sending and read_timeout each read of the response.
+    Timeouts raise asyncio.TimeoutError. The response body must be read fully for the connection to be reused.
+    """
     redir_cnt = 0
     while redir_cnt < 2:
-        reader = await request_raw(method, url)
-        headers = []
-        sline = await reader.readline()
-        sline = sline.split(None, 2)
-        status = int(sline[1])
-        chunked = False
-        while True:
-            line = await reader.readline()
-            if not line or line == b"\r\n":
-                break
-            headers.append(line)
-            if line.startswith(b"Transfer-Encoding:"):
-                if b"chunked" in line:
-                    chunked = True
-            elif line.startswith(b"Location:"):
-                url = line.rstrip().split(None, 1)[1].decode("latin-1")
+        reader, pool_key, reused = await request_raw(method, url, connect_timeout, keep_alive, data, content_type)
+        try:
+            sline = await _wait(reader.readline(), read_timeout)
+            if not sline:
+                _close(reader)
+                if reused:
+                    # The server closed the idle connection, the next attempt opens a new one
+                    continue
+                raise OSError("Connection closed before response")
+            sline = sline.split(None, 2)
+            status = int(sline[1])
+            if sline[0] != b"HTTP/1.1":
+                pool_key = None
+            headers = []
+            chunked = False
+            gzip = False
+            length = -1
+            while True:
+                line = await _wait(reader.readline(), read_timeout)
+                if not line or line == b"\r\n":
+                    break
+                headers.append(line)
+                name, dummy, value = line.partition(b":")
+                name = name.strip().lower()
+                value = value.strip()
+                if name == b"transfer-encoding":
+                    if b"chunked" in value:
+                        chunked = True
+                elif name == b"content-length":
+                    length = int(value)
+                elif name == b"content-encoding":
+                    gzip = b"gzip" in value
+                elif name == b"connection":
+                    if value.lower() == b"close":
+                        pool_key = None
+                elif name == b"location":
+                    url = value.decode("latin-1")
+        except Exception:
+            _close(reader)
+            raise
 
         if 301 <= status <= 303:
             redir_cnt += 1
-            await reader.aclose()
+            _close(reader)
             continue
         break
 
+    if method == "HEAD" or status in (204, 304):
+        length = 0
     if chunked:
-        resp = ChunkedClientResponse(reader)
+        resp = ChunkedClientResponse(reader, pool_key, read_timeout, max_size)
     else:
-        resp = ClientResponse(reader)
+        if length < 0:
+            # Without a length the body ends when the server closes the connection
+            pool_key = None
+        resp = ClientResponse(reader, pool_key, length, read_timeout, max_size)
     resp.status = status
     resp.headers = headers
+    resp.gzip = gzip
     return resp
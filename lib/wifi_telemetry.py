@@ -0,0 +1,96 @@
+"""
+Built against Pimoroni Micropython version: v1.22.2 (https://github.com/pimoroni/pimoroni-pico/releases/download/v1.22.2/pimoroni-picow-v1.22.2-micropython.uf2)
+"""
+
+from array import array
+from time import ticks_ms, ticks_diff
+import config
+from lib.ulogging import uLogger
+
+class Wifi_Telemetry:
+    """
+    Rolling buffers of signal strength, time to connect and outage durations for diagnosing units with poor wifi.
+    Recorded by the wireless network module from its existing status samples and link transitions, so adds no wakeups.
+    Buffers are preallocated arrays, RSSI as signed bytes, so recording allocates nothing on the heap.
+    """
+    def __init__(self, log_level: int) -> None:
+        self.logger = uLogger("WiFi telemetry", log_level)
+        self.logger.info("Init wifi telemetry")
+        self.weak_rssi_dbm = config.wifi_weak_rssi_dbm
+        self.rssi_samples = array('b', [0] * config.wifi_telemetry_rssi_window)
+        self.rssi_count = 0
+        self.weak_count = 0
+        self.connect_ms = array('L', [0] * config.wifi_telemetry_event_window)
+        self.connect_count = 0
+        self.connect_failures = 0
+        self.outage_ms = array('L', [0] * config.wifi_telemetry_event_window)
+        self.outage_count = 0
+        self.total_outage_ms = 0
+        self.outage_start_ms = None
+        self.start_ms = ticks_ms()
+
+    def record_rssi(self, rssi: int) -> None:
+        self.rssi_samples[self.rssi_count % len(self.rssi_samples)] = max(-128, min(127, rssi))
+        self.rssi_count += 1
+        if rssi < self.weak_rssi_dbm:
+            self.weak_count += 1
+
+    def record_connect(self, elapsed_ms: int) -> None:
+        self.connect_ms[self.connect_count % len(self.connect_ms)] = elapsed_ms
+        self.connect_count += 1
+
+    def record_connect_failure(self) -> None:
+        self.connect_failures += 1
+
+    def link_down(self) -> None:
+        self.outage_start_ms = ticks_ms()
+
+    def link_up(self) -> None:
+        if self.outage_start_ms is None:
+            return
+        duration_ms = ticks_diff(ticks_ms(), self.outage_start_ms)
+        self.outage_start_ms = None
+        self.outage_ms[self.outage_count % len(self.outage_ms)] = duration_ms
+        self.outage_count += 1
+        self.total_outage_ms += duration_ms
+        self.logger.info(f"Link restored after {duration_ms}ms outage")
+
+    def current_outage_ms(self) -> int:
+        return 0 if self.outage_start_ms is None else ticks_diff(ticks_ms(), self.outage_start_ms)
+
+    def signal_quality(self, avg_rssi: float) -> str:
+        if self.rssi_count == 0:
+            return "Unknown"
+        if avg_rssi >= -60:
+            return "Excellent"
+        if avg_rssi >= -67:
+            return "Good"
+        if avg_rssi >= self.weak_rssi_dbm:
+            return "Fair"
+        return "Poor"
+
+    def summarise(self, samples: array, count: int) -> dict:
+        window = min(count, len(samples))
+        summary = {}
+        summary['last'] = samples[(count - 1) % len(samples)] if count else 0
+        summary['min'] = min(samples[:window]) if window else 0
+        summary['max'] = max(samples[:window]) if window else 0
+        summary['avg'] = round(sum(samples[:window]) / window, 1) if window else 0
+        return summary
+
+    def get_all_data(self) -> dict:
+        all_data = {}
+        rssi = self.summarise(self.rssi_samples, self.rssi_count)
+        all_data['rssi dbm'] = rssi
+        all_data['signal quality'] = self.signal_quality(rssi['avg'])
+        all_data['weak signal pc'] = round(100 * self.weak_count / self.rssi_count, 1) if self.rssi_count else 0
+        all_data['connect ms'] = self.summarise(self.connect_ms, self.connect_count)
+        all_data['connects'] = self.connect_count
+        all_data['connect failures'] = self.connect_failures
+        all_data['outage ms'] = self.summarise(self.outage_ms, self.outage_count)
+        all_data['outages'] = self.outage_count
+        all_data['current outage ms'] = self.current_outage_ms()
+        elapsed_ms = max(1, ticks_diff(ticks_ms(), self.start_ms))
+        outage_ms = min(elapsed_ms, self.total_outage_ms + self.current_outage_ms())
+        all_data['availability pc'] = round(100 * (elapsed_ms - outage_ms) / elapsed_ms, 2)
+        return all_data
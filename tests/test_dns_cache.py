@@ -0,0 +1,100 @@
+"""
+Host tests for lib/dns_cache.py under CPython, run with: python -m pytest tests
+The cache runs on the virtual clock from tools/host_sim.py with getaddrinfo counted by a socket shim,
+and the refresh job is called as the scheduler would, every half TTL.
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+import types
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, REPO_ROOT)
+import config
+
+spec = importlib.util.spec_from_file_location("host_sim", os.path.join(REPO_ROOT, "tools", "host_sim.py"))
+host_sim = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(host_sim)
+
+HOST = "api.open-meteo.com"
+
+
+class Resolver:
+    """Stands in for the socket and uaiohttpclient modules, counting lookups and collecting refresh tasks"""
+    def __init__(self):
+        self.lookups = 0
+        self.tasks = []
+
+    def getaddrinfo(self, host, port):
+        self.lookups += 1
+        return [(2, 1, 0, "", (f"192.0.2.{self.lookups}", port))]
+
+    def create_task(self, coro, name):
+        self.tasks.append(coro)
+
+    def run_tasks(self):
+        while self.tasks:
+            asyncio.run(self.tasks.pop(0))
+
+
+def make_cache():
+    clock = host_sim.Virtual_Clock()
+    resolver = Resolver()
+    shims = {}
+    for name, attributes in (("socket", {"getaddrinfo": resolver.getaddrinfo}), ("lib.scheduler", {"Scheduler": object}),
+                             ("lib.task_profiler", {"create_task": resolver.create_task}),
+                             ("uaiohttpclient", {"set_resolver": lambda resolve: None})):
+        shims[name] = types.ModuleType(name)
+        shims[name].__dict__.update(attributes)
+    shims["time"] = clock.time_module()
+    shims["lib.ulogging"] = host_sim.ulogging_module()
+    dns_cache = host_sim.load_module("lib/dns_cache.py", shims)
+    return dns_cache.DNS_Cache(0, None), clock, resolver
+
+
+def run(cache, clock, resolver, duration_s, poll_s):
+    """Resolve HOST every poll_s seconds, 0 for never after the first, with the refresh job every half TTL"""
+    refresh_ms = config.dns_cache_ttl_s * 1000 // 2
+    poll_ms = poll_s * 1000
+    next_poll_ms = 0
+    next_refresh_ms = refresh_ms
+    while min(next_poll_ms, next_refresh_ms) <= duration_s * 1000:
+        if next_poll_ms <= next_refresh_ms:
+            clock.advance_to_ms(next_poll_ms)
+            assert cache.resolve(HOST, 443).startswith("192.0.2.")
+            next_poll_ms = next_poll_ms + poll_ms if poll_ms else duration_s * 1000 + 1
+        else:
+            clock.advance_to_ms(next_refresh_ms)
+            cache.refresh_expiring()
+            resolver.run_tasks()
+            next_refresh_ms += refresh_ms
+
+
+def test_consumer_polling_slower_than_the_refresh_pass_keeps_its_entry():
+    cache, clock, resolver = make_cache()
+    # Polls every 1.5 half TTLs, less often than the refresh pass but within the idle time
+    poll_s = config.dns_cache_ttl_s * 3 // 4
+    assert config.dns_cache_ttl_s // 2 < poll_s < config.dns_cache_idle_s
+    run(cache, clock, resolver, 4 * 3600, poll_s)
+    assert cache.misses == 1
+    assert cache.evictions == 0
+    assert cache.entries[HOST].refreshes > 0
+    assert cache.entries[HOST].hits == 4 * 3600 // poll_s
+
+
+def test_idle_host_is_evicted_after_the_idle_time():
+    cache, clock, resolver = make_cache()
+    # Requested once at the start, then kept and refreshed by each pass up to the idle time
+    run(cache, clock, resolver, config.dns_cache_idle_s, 0)
+    assert HOST in cache.entries
+    clock.advance_to_ms((config.dns_cache_idle_s + config.dns_cache_ttl_s // 2) * 1000)
+    cache.refresh_expiring()
+    assert HOST not in cache.entries
+    assert cache.evictions == 1
+    # Refreshes stop once evicted, the next request looks the host up again
+    lookups = resolver.lookups
+    cache.resolve(HOST, 443)
+    assert resolver.lookups == lookups + 1
+    assert cache.misses == 2
@@ -0,0 +1,124 @@
+"""
+Host tests for the fan speed cap in lib/fan.py under CPython, run with: python -m pytest tests
+The machine module and the modules fan.py imports for its other services are replaced by small shims
+while the file is loaded, the PWM shim records the duty each zone fan is set to.
+"""
+
+import gc
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, REPO_ROOT)
+import config
+
+
+def load_module(name, relative_path, shims):
+    """Execute a repository file with sys.modules entries replaced by shims for the duration of the import"""
+    saved = {key: sys.modules.get(key) for key in shims}
+    sys.modules.update(shims)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for key in saved:
+            if saved[key] is None:
+                del sys.modules[key]
+            else:
+                sys.modules[key] = saved[key]
+    return module
+
+
+class Pin:
+    OUT = 1
+
+    def __init__(self, pin, mode):
+        pass
+
+
+class PWM:
+    def __init__(self, pin):
+        self.duty = 0
+
+    def freq(self, hz):
+        pass
+
+    def duty_u16(self, duty=None):
+        if duty is None:
+            return self.duty
+        self.duty = duty
+
+
+def module_shim(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+gc_shim = module_shim("gc", collect=gc.collect, mem_free=lambda: 0)
+ulogging = load_module("lib.ulogging", "lib/ulogging.py", {"gc": gc_shim})
+helpers = module_shim("lib.helpers", Status_LED=object, decimal_to_percent_str=lambda decimal: f"{decimal * 100}%")
+fan_module = load_module("fan", "lib/fan.py", {
+    "machine": module_shim("machine", Pin=Pin, PWM=PWM), "lib.ulogging": ulogging, "lib.helpers": helpers,
+    "lib.networking": module_shim("lib.networking", Wireless_Network=object),
+    "lib.open_meteo": module_shim("lib.open_meteo", Weather_API=object),
+    "lib.sensor_manager": module_shim("lib.sensor_manager", Sensor_Manager=object),
+    "lib.display": module_shim("lib.display", Display=object), "lib.events": module_shim("lib.events", Event_Publisher=object),
+    "lib.scheduler": module_shim("lib.scheduler", Scheduler=object),
+    "lib.task_profiler": module_shim("lib.task_profiler", create_task=None),
+    "lib.memory_profiler": module_shim("lib.memory_profiler", measure=None)})
+
+
+class Recorder:
+    """Stands in for the display and event publisher, recording the calls made to it"""
+    def __init__(self):
+        self.calls = []
+
+    def update_main_display_values(self, values):
+        self.calls.append(values)
+
+    def publish(self, topic, values):
+        self.calls.append((topic, values))
+
+
+def make_fan():
+    """Fan with only its zones, the full constructor needs the display, network and sensors"""
+    fan = fan_module.Fan.__new__(fan_module.Fan)
+    fan.logger = ulogging.uLogger("Fan", 0)
+    fan.display = Recorder()
+    fan.events = Recorder()
+    fan.max_speed = 1
+    fan.zones = {}
+    for name, zone_config in config.fan_zones:
+        fan.zones[name] = fan_module.Fan_Zone(0, name, zone_config)
+    fan.primary_zone = fan.zones[config.fan_zones[0][0]]
+    return fan
+
+
+@pytest.mark.parametrize("max_speed, applied", [(1, 1), (0.5, 1), (0.2, 0)])
+def test_cap_is_on_off_without_pwm(monkeypatch, max_speed, applied):
+    monkeypatch.setattr(config, "enable_PWM_fan_speed", False)
+    fan = make_fan()
+    fan.switch_on()
+    fan.set_max_speed(max_speed)
+    assert fan.get_fan_speed() == applied
+    assert not fan.pwm_active()
+    # Lifting the cap restores the requested speed
+    fan.set_max_speed(1)
+    assert fan.get_fan_speed() == 1
+
+
+def test_cap_is_partial_duty_with_pwm(monkeypatch):
+    monkeypatch.setattr(config, "enable_PWM_fan_speed", True)
+    fan = make_fan()
+    fan.switch_on()
+    fan.set_max_speed(0.2)
+    assert fan.get_fan_speed() == pytest.approx(0.2, abs=1e-4)
+    assert fan.pwm_active()
+    fan.set_speed(0.1)
+    assert fan.get_fan_speed() == pytest.approx(0.1, abs=1e-4)
@@ -0,0 +1,183 @@
+"""
+Host tests for lib/mqtt_client.py under CPython, run with: python -m pytest tests
+The client only uses asyncio streams, so it runs unmodified against a small stand-in broker
+that records the packets it receives and answers CONNECT, SUBSCRIBE and PINGREQ.
+"""
+
+import asyncio
+import importlib.util
+import os
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("mqtt_client", os.path.join(os.path.dirname(__file__), "..", "lib", "mqtt_client.py"))
+mqtt_client = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mqtt_client)
+
+
+def decode_string(body, start):
+    length = int.from_bytes(body[start:start + 2], "big")
+    return body[start + 2:start + 2 + length].decode(), start + 2 + length
+
+
+class Broker:
+    """Stand-in MQTT 3.1.1 broker for one client, echoing a retained message to each subscription"""
+    def __init__(self, return_code=0, answer_pings=True):
+        self.return_code = return_code
+        self.answer_pings = answer_pings
+        self.connect = None
+        self.publishes = []
+        self.subscriptions = []
+        self.pings = 0
+        self.disconnected = False
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def read_packet(self, reader):
+        header = (await reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return header, await reader.readexactly(length)
+
+    def parse_connect(self, body):
+        protocol, index = decode_string(body, 0)
+        level, flags = body[index], body[index + 1]
+        keepalive = int.from_bytes(body[index + 2:index + 4], "big")
+        client_id, index = decode_string(body, index + 4)
+        connect = {"protocol": protocol, "level": level, "flags": flags, "keepalive": keepalive, "client id": client_id}
+        if flags & 0x04:
+            connect["will topic"], index = decode_string(body, index)
+            connect["will message"], index = decode_string(body, index)
+        if flags & 0x80:
+            connect["user"], index = decode_string(body, index)
+        if flags & 0x40:
+            connect["password"], index = decode_string(body, index)
+        return connect
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                header, body = await self.read_packet(reader)
+                packet_type = header & 0xF0
+                if packet_type == mqtt_client.CONNECT:
+                    self.connect = self.parse_connect(body)
+                    writer.write(mqtt_client.packet(mqtt_client.CONNACK, bytes([0, self.return_code])))
+                elif packet_type == mqtt_client.PUBLISH:
+                    topic, index = decode_string(body, 0)
+                    self.publishes.append((topic, body[index:], bool(header & 0x01)))
+                elif header == mqtt_client.SUBSCRIBE:
+                    topic, index = decode_string(body, 2)
+                    self.subscriptions.append(topic)
+                    writer.write(mqtt_client.packet(mqtt_client.SUBACK, body[:2] + b"\x00"))
+                    writer.write(mqtt_client.packet(mqtt_client.PUBLISH | 0x01, mqtt_client.encode_string(topic) + b"on"))
+                elif packet_type == mqtt_client.PINGREQ:
+                    self.pings += 1
+                    if self.answer_pings:
+                        writer.write(mqtt_client.packet(mqtt_client.PINGRESP, b""))
+                elif packet_type == mqtt_client.DISCONNECT:
+                    self.disconnected = True
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+
+def run_with_broker(test, **kwargs):
+    async def main():
+        broker = Broker(**kwargs)
+        await broker.start()
+        try:
+            await test(broker)
+        finally:
+            await broker.stop()
+    asyncio.run(main())
+
+
+def test_encode_length():
+    assert mqtt_client.encode_length(0) == b"\x00"
+    assert mqtt_client.encode_length(127) == b"\x7f"
+    assert mqtt_client.encode_length(128) == b"\x80\x01"
+    assert mqtt_client.encode_length(16383) == b"\xff\x7f"
+    assert mqtt_client.encode_length(16384) == b"\x80\x80\x01"
+
+
+def test_connect_sends_will_and_credentials():
+    async def test(broker):
+        client = mqtt_client.MQTT_Client("pico-test", "127.0.0.1", broker.port, "user", "secret", 30)
+        client.set_last_will("pico/availability", "offline")
+        await client.connect(2)
+        assert client.is_connected()
+        assert broker.connect == {"protocol": "MQTT", "level": 4, "flags": 0x02 | 0x04 | 0x20 | 0x80 | 0x40, "keepalive": 30,
+                                  "client id": "pico-test", "will topic": "pico/availability", "will message": "offline",
+                                  "user": "user", "password": "secret"}
+        await client.disconnect()
+        await asyncio.sleep(0.05)
+        assert broker.disconnected
+        assert not client.is_connected()
+    run_with_broker(test)
+
+
+def test_refused_connect_raises_and_closes():
+    async def test(broker):
+        client = mqtt_client.MQTT_Client("pico-test", "127.0.0.1", broker.port)
+        with pytest.raises(mqtt_client.MQTT_Error):
+            await client.connect(2)
+        assert not client.is_connected()
+    run_with_broker(test, return_code=5)
+
+
+def test_publish_and_subscribe_round_trip():
+    async def test(broker):
+        received = []
+        client = mqtt_client.MQTT_Client("pico-test", "127.0.0.1", broker.port)
+        client.on_message = lambda topic, message: received.append((topic, message))
+        await client.connect(2)
+        receiver = asyncio.create_task(client.receive_loop())
+        await client.publish("pico/state", '{"fan_speed": 50}', retain=True)
+        await client.publish("pico/event", b"pressed")
+        await client.subscribe("pico/light/set")
+        await asyncio.sleep(0.1)
+        assert broker.publishes == [("pico/state", b'{"fan_speed": 50}', True), ("pico/event", b"pressed", False)]
+        assert broker.subscriptions == ["pico/light/set"]
+        # The SUBACK is consumed by the receive loop and only the publish is dispatched
+        assert received == [("pico/light/set", b"on")]
+        receiver.cancel()
+        await client.disconnect()
+    run_with_broker(test)
+
+
+def test_receive_loop_pings_when_idle():
+    async def test(broker):
+        client = mqtt_client.MQTT_Client("pico-test", "127.0.0.1", broker.port, keepalive_s=1)
+        await client.connect(2)
+        receiver = asyncio.create_task(client.receive_loop())
+        await asyncio.sleep(1.2)
+        assert broker.pings >= 2
+        assert not receiver.done()
+        receiver.cancel()
+        await client.disconnect()
+    run_with_broker(test)
+
+
+def test_unanswered_ping_fails_the_connection():
+    async def test(broker):
+        client = mqtt_client.MQTT_Client("pico-test", "127.0.0.1", broker.port, keepalive_s=1)
+        await client.connect(2)
+        with pytest.raises(mqtt_client.MQTT_Error):
+            await asyncio.wait_for(client.receive_loop(), 2)
+        assert broker.pings == 1
+        await client.close()
+    run_with_broker(test, answer_pings=False)
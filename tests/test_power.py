@@ -0,0 +1,88 @@
+"""
+Host tests for the low power idle sleeper in lib/power.py under CPython, run with: python -m pytest tests
+Sleep lengths are checked against an injected clock and task queue, and over an hour of the power scenario
+in tools/host_sim.py, which runs the unmodified power manager and scheduler on a virtual clock.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, REPO_ROOT)
+import config
+
+spec = importlib.util.spec_from_file_location("host_sim", os.path.join(REPO_ROOT, "tools", "host_sim.py"))
+host_sim = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(host_sim)
+
+
+class Clock:
+    """Injected clock and task queue, recording each lightsleep"""
+    def __init__(self, task_due_ms):
+        self.now = 1000
+        self.task_due_ms = task_due_ms
+        self.sleeps = []
+
+    def ticks_ms(self):
+        return self.now
+
+    def lightsleep(self, ms):
+        self.sleeps.append(ms)
+        self.now += ms
+
+    def next_task_due_ms(self):
+        return self.task_due_ms
+
+
+class Scheduler:
+    def __init__(self, deadline_ms):
+        self.deadline_ms = deadline_ms
+
+    def next_deadline_ms(self, now):
+        return self.deadline_ms
+
+
+def make_power(clock, scheduler_deadline_ms=-1):
+    virtual_clock = host_sim.Virtual_Clock()
+    power_module = host_sim.load_module("lib/power.py", {
+        "time": virtual_clock.time_module(), "machine": types.ModuleType("machine"), "asyncio.core": types.ModuleType("asyncio.core"),
+        "lib.ulogging": host_sim.ulogging_module(), "lib.task_profiler": host_sim.task_profiler_shim()})
+    idle = host_sim.Idle_Module()
+    modules = {"events": idle, "wlan": idle, "display": idle, "scheduler": Scheduler(scheduler_deadline_ms)}
+    return power_module.Power_Manager(0, modules, clock)
+
+
+def test_sleeps_until_the_next_queued_task():
+    clock = Clock(task_due_ms=1300)
+    power = make_power(clock)
+    assert power.next_wakeup_ms(clock.now) == 300
+    assert power.try_sleep()
+    assert clock.sleeps == [300]
+    assert power.get_all_data()["asleep ms"] == 300
+
+
+def test_sleep_is_capped_by_scheduler_deadline_and_max_sleep():
+    clock = Clock(task_due_ms=None)
+    assert make_power(clock).next_wakeup_ms(clock.now) == config.low_power_max_sleep_ms
+    assert make_power(clock, scheduler_deadline_ms=120).next_wakeup_ms(clock.now) == 120
+
+
+def test_does_not_sleep_when_a_task_is_due_soon():
+    clock = Clock(task_due_ms=1000 + config.low_power_min_sleep_ms - 1)
+    assert not make_power(clock).try_sleep()
+    # A task already overdue is not a negative sleep
+    clock.task_due_ms = 900
+    assert make_power(clock).next_wakeup_ms(clock.now) == 0
+    assert clock.sleeps == []
+
+
+def test_simulated_sleeps_wake_as_tasks_are_due():
+    result = host_sim.simulate_power(3600, 1)
+    assert result["sleeps"] > 0
+    assert result["min sleep ms"] >= config.low_power_min_sleep_ms
+    assert result["max sleep ms"] <= config.low_power_max_sleep_ms
+    assert result["woke on time"] > 0
+    assert result["mistimed"] == 0
+    assert result["duty cycle pc"] < 5
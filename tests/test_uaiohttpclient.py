@@ -0,0 +1,235 @@
+"""
+Host tests for lib/uaiohttpclient.py under CPython, run with: python -m pytest tests
+The uasyncio stream API and the deflate module are provided by small shims over asyncio and gzip,
+and requests go to a local HTTP server that counts its connections.
+"""
+
+import asyncio
+import gzip
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+
+class Stream_Shim:
+    """uasyncio v3 style stream over a CPython reader and writer, .s.close() closes the socket as on the Pico"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.s = self
+        self.closed = False
+        streams.append(self)
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    async def readexactly(self, n):
+        return await self.reader.readexactly(n)
+
+    async def awrite(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+
+# Client side streams opened by the module under test, newest last
+streams = []
+
+
+async def open_connection(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    stream = Stream_Shim(reader, writer)
+    return stream, stream
+
+
+uasyncio_shim = types.ModuleType("uasyncio")
+uasyncio_shim.wait_for = asyncio.wait_for
+uasyncio_shim.TimeoutError = asyncio.TimeoutError
+uasyncio_shim.open_connection = open_connection
+
+deflate_shim = types.ModuleType("deflate")
+deflate_shim.GZIP = 2
+deflate_shim.DeflateIO = lambda stream, wbits: gzip.GzipFile(fileobj=stream)
+
+sys.modules["uasyncio"] = uasyncio_shim
+sys.modules["deflate"] = deflate_shim
+spec = importlib.util.spec_from_file_location("uaiohttpclient", os.path.join(os.path.dirname(__file__), "..", "lib", "uaiohttpclient.py"))
+client = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(client)
+
+PLAIN_BODY = b"hello"
+BIG_BODY = b"x" * 2000
+GZIP_TEXT = b'{"humidity": 55}' * 20
+
+
+class HTTP_Server:
+    """Keep-alive HTTP/1.1 server with a response per path, recording connections and request paths"""
+    def __init__(self):
+        self.connections = 0
+        self.paths = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        client.close_idle_connections()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                path = request_line.split()[1].decode()
+                self.paths.append(path)
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, unused, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                headers = b""
+                body = PLAIN_BODY
+                if path == "/slow":
+                    await asyncio.sleep(1)
+                elif path == "/stall":
+                    # Headers and part of the body, then nothing
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(PLAIN_BODY), PLAIN_BODY[:2]))
+                    await writer.drain()
+                    await asyncio.sleep(1)
+                    break
+                elif path == "/stall_chunked":
+                    writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhe")
+                    await writer.drain()
+                    await asyncio.sleep(1)
+                    break
+                elif path == "/big":
+                    body = BIG_BODY
+                elif path == "/gzip":
+                    body = gzip.compress(GZIP_TEXT)
+                    headers = b"Content-Encoding: gzip\r\n"
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n%s\r\n%s" % (len(body), headers, body))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+
+def run_with_server(test):
+    async def main():
+        server = HTTP_Server()
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+
+def test_keep_alive_connection_is_reused():
+    async def test(server):
+        for unused in range(3):
+            response = await client.request("GET", server.url("/plain"))
+            assert response.status == 200
+            assert await response.read() == PLAIN_BODY
+            assert ("127.0.0.1", server.port) in client._pool
+        assert server.connections == 1
+        assert server.paths == ["/plain"] * 3
+    run_with_server(test)
+
+
+def test_request_body_is_sent_on_pooled_connection():
+    async def test(server):
+        await (await client.request("GET", server.url("/plain"))).read()
+        response = await client.request("POST", server.url("/plain"), data='{"t": 1}')
+        assert await response.read() == PLAIN_BODY
+        assert server.connections == 1
+    run_with_server(test)
+
+
+def test_unread_body_is_not_pooled():
+    async def test(server):
+        response = await client.request("GET", server.url("/plain"))
+        response.close()
+        assert client._pool == {}
+        await (await client.request("GET", server.url("/plain"))).read()
+        assert server.connections == 2
+    run_with_server(test)
+
+
+def test_wait_times_out():
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await client._wait(asyncio.sleep(1), 0.05)
+        assert await client._wait(asyncio.sleep(0, "done"), None) == "done"
+    asyncio.run(main())
+
+
+def test_read_timeout_raises_and_closes_connection():
+    async def test(server):
+        with pytest.raises(asyncio.TimeoutError):
+            await client.request("GET", server.url("/slow"), read_timeout=0.1)
+        assert client._pool == {}
+    run_with_server(test)
+
+
+@pytest.mark.parametrize("path", ["/stall", "/stall_chunked"])
+def test_body_read_timeout_closes_connection(path):
+    async def test(server):
+        response = await client.request("GET", server.url(path), read_timeout=0.1)
+        assert response.status == 200
+        with pytest.raises(asyncio.TimeoutError):
+            await response.read()
+        assert streams[-1].closed
+        assert client._pool == {}
+        assert await response.read() == b""
+    run_with_server(test)
+
+
+def test_oversize_response_is_rejected():
+    async def test(server):
+        response = await client.request("GET", server.url("/big"), max_size=1000)
+        with pytest.raises(ValueError):
+            await response.read()
+        assert client._pool == {}
+        response = await client.request("GET", server.url("/big"), max_size=len(BIG_BODY))
+        assert await response.read() == BIG_BODY
+    run_with_server(test)
+
+
+def test_gzip_response_is_decompressed():
+    async def test(server):
+        response = await client.request("GET", server.url("/gzip"))
+        assert response.gzip
+        assert await response.read() == GZIP_TEXT
+        assert server.connections == 1
+    run_with_server(test)
+
+
+def test_gzip_response_over_max_size_is_rejected():
+    async def test(server):
+        # The compressed body fits but the decompressed body does not
+        response = await client.request("GET", server.url("/gzip"), max_size=len(GZIP_TEXT) - 1)
+        with pytest.raises(ValueError):
+            await response.read()
+    run_with_server(test)
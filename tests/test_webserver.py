@@ -0,0 +1,225 @@
+"""
+Host tests for the web server request handling in http/webserver.py and routes from http/website.py under CPython,
+run with: python -m pytest tests
+MicroPython only modules are replaced by small shims while the files are loaded, and requests are fed to the
+connection handler through in-memory streams so each test sees exactly what was written back and when it returned.
+"""
+
+import asyncio
+import binascii
+import errno
+import gc
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import types
+
+import pytest
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, REPO_ROOT)
+import config
+
+
+def load_module(name, relative_path, shims):
+    """Execute a repository file with sys.modules entries replaced by shims for the duration of the import"""
+    saved = {key: sys.modules.get(key) for key in shims}
+    sys.modules.update(shims)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for key in saved:
+            if saved[key] is None:
+                del sys.modules[key]
+            else:
+                sys.modules[key] = saved[key]
+    return module
+
+
+def ticks_shim(name):
+    module = types.ModuleType(name)
+    module.ticks_ms = lambda: int(time.monotonic() * 1000)
+    module.ticks_us = lambda: int(time.monotonic() * 1000000)
+    module.ticks_diff = lambda end, start: end - start
+    module.ticks_add = lambda ticks, delta: ticks + delta
+    return module
+
+
+gc_shim = types.ModuleType("gc")
+gc_shim.collect = gc.collect
+gc_shim.mem_alloc = lambda: 0
+gc_shim.mem_free = lambda: 0
+
+webserver = load_module("webserver", "http/webserver.py", {
+    "gc": gc_shim, "utime": ticks_shim("utime"), "ujson": json, "uos": os, "uerrno": errno, "usocket": socket,
+    "uhashlib": hashlib, "ubinascii": binascii, "ustruct": struct, "asyncio.core": types.ModuleType("asyncio.core")})
+
+profiler_shims = {}
+for name, attributes in (("lib.task_profiler", ("Task_Profiler",)), ("lib.memory_profiler", ("Memory_Profiler",)), ("lib.metrics", ("Metrics",))):
+    profiler_shims[name] = types.ModuleType(name)
+    for attribute in attributes:
+        setattr(profiler_shims[name], attribute, object)
+profiler_shims["lib.task_profiler"].create_task = lambda coro, name: asyncio.create_task(coro)
+uasyncio_shim = types.ModuleType("uasyncio")
+uasyncio_shim.wait_for = asyncio.wait_for
+uasyncio_shim.TimeoutError = asyncio.TimeoutError
+website = load_module("website", "http/website.py", dict(profiler_shims, **{
+    "http.webserver": webserver, "uasyncio": uasyncio_shim, "time": ticks_shim("time")}))
+events_module = load_module("lib.events", "lib/events.py", {})
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    async def readline(self):
+        return self.data.readline()
+
+    async def readinto(self, buf):
+        return self.data.readinto(buf)
+
+
+class Writer:
+    """Collects the response, raising ECONNRESET once disconnect_after writes have been made, as when the client has gone"""
+    def __init__(self, disconnect_after=None):
+        self.written = []
+        self.disconnect_after = disconnect_after
+        self.closed = False
+        self.s = object()
+
+    async def awrite(self, data):
+        if self.disconnect_after is not None and len(self.written) >= self.disconnect_after:
+            raise OSError(errno.ECONNRESET)
+        self.written.append(data if isinstance(data, str) else data.decode())
+
+    async def aclose(self):
+        self.closed = True
+
+
+def make_web_app():
+    """Web_App with only the parts the streaming routes use, the full constructor needs every module"""
+    web_app = website.Web_App.__new__(website.Web_App)
+    asyncio.set_event_loop(asyncio.get_running_loop())
+    web_app.app = webserver.webserver()
+    web_app.events = events_module.Event_Publisher(0)
+    web_app.ulogger = website.uLogger("Web app", 0)
+    web_app.websocket_clients = 0
+    web_app.create_event_stream()
+    web_app.create_control_socket()
+    return web_app
+
+
+async def serve(web_app, request, writer, timeout_s=1):
+    """Run the connection handler, failing if it has not returned within timeout_s"""
+    web_app.app.conns[id(writer.s)] = None
+    task = asyncio.create_task(web_app.app._handler(Reader(request), writer))
+    # Not wait_for, the handler swallows cancellation so a hung handler would look like one that returned
+    await asyncio.wait({task}, timeout=timeout_s)
+    if not task.done():
+        task.cancel()
+        pytest.fail("Handler did not return")
+    assert id(writer.s) not in web_app.app.conns
+    assert writer.closed
+
+
+def test_head_on_event_stream_returns_without_a_subscriber_slot():
+    async def main():
+        web_app = make_web_app()
+        for unused in range(config.sse_max_subscribers + 1):
+            writer = Writer()
+            await serve(web_app, b"HEAD /api/events HTTP/1.1\r\n\r\n", writer)
+            assert writer.written[0].startswith("HTTP/1.0 200")
+            assert "text/event-stream" in writer.written[0]
+            assert len(writer.written) == 1
+        assert web_app.events.subscribers == []
+    asyncio.run(main())
+
+
+def test_event_stream_frees_its_slot_when_the_client_disconnects(monkeypatch):
+    monkeypatch.setattr(config, "sse_keepalive_s", 0.01)
+
+    async def main():
+        web_app = make_web_app()
+        writer = Writer(disconnect_after=3)
+        await serve(web_app, b"GET /api/events HTTP/1.1\r\n\r\n", writer)
+        assert writer.written[1:] == [": keepalive\n\n", ": keepalive\n\n"]
+        assert web_app.events.subscribers == []
+    asyncio.run(main())
+
+
+def test_head_on_control_socket_is_refused():
+    async def main():
+        web_app = make_web_app()
+        writer = Writer()
+        request = b"HEAD /api/ws HTTP/1.1\r\nUpgrade: websocket\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n"
+        await serve(web_app, request, writer)
+        assert writer.written[0].startswith("HTTP/1.0 405")
+        assert web_app.websocket_clients == 0
+    asyncio.run(main())
+
+
+class Light:
+    def __init__(self):
+        self.state = False
+
+    def on(self):
+        self.state = True
+
+    def off(self):
+        self.state = False
+
+    def get_state(self):
+        return self.state
+
+    def get_brightness_pc(self):
+        return 100
+
+
+class unsupported_result():
+
+    def get(self, data):
+        return b"raw"
+
+
+class count_result():
+
+    def get(self, data):
+        return 3
+
+
+def test_full_batch_is_accepted_and_each_result_serialised():
+    async def main():
+        web_app = make_web_app()
+        web_app.all_modules = {}
+        web_app.fan = web_app.battery_monitor = web_app.motion = web_app.offline_queue = None
+        web_app.light = Light()
+        web_app.wlan = web_app.environment = web_app.task_profiler = web_app.memory_profiler = None
+        web_app.create_api()
+        web_app.app.add_resource(unsupported_result, "/api/test/unsupported")
+        web_app.app.add_resource(count_result, "/api/test/count")
+        operations = [{"method": "PUT", "path": "/api/light/state", "data": {"state": "on"}}] * (config.batch_max_operations - 3)
+        operations += [{"method": "GET", "path": "/api/test/unsupported"}, {"method": "GET", "path": "/api/test/count"},
+                       {"method": "GET", "path": "/api/missing"}]
+        body = json.dumps(operations).encode()
+        # Larger than the default route body limit
+        assert len(body) > 1024
+        writer = Writer()
+        request = b"POST /api/batch HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        await serve(web_app, request, writer)
+        assert writer.written[0].startswith("HTTP/1.0 200")
+        results = json.loads("".join(writer.written[1:]))
+        assert [result["status"] for result in results] == [200] * (config.batch_max_operations - 3) + [500, 200, 404]
+        assert results[0]["result"] is True
+        assert "Unsupported result type" in results[-3]["result"]
+        assert results[-2]["result"] == 3
+        assert results[-1]["result"] is None
+        assert web_app.light.get_state()
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+"""
+Host side benchmark of web server route lookup, comparing the segment trie router in http/webserver.py
+with a linear scan over the registered URL patterns, the straightforward way to match multi-parameter routes.
+Registers the website API routes padded out with generated routes, then times lookups of static,
+parameterised, trailing slash and missing paths, checking both routers return the same handler and parameters.
+
+Usage (from the repository root):
+    python tools/bench_router.py [--routes 60] [--iterations 20000]
+
+Timings are CPython on the host, so compare the ratios rather than the absolute times against the Pico.
+"""
+
+import argparse
+import asyncio
+import binascii
+import errno
+import hashlib
+import importlib.util
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Routes registered by http/website.py, as (url, methods)
+WEBSITE_ROUTES = [
+    ("/", ["GET"]), ("/js/api.js", ["GET"]), ("/css/style.css", ["GET"]), ("/metrics", ["GET"]),
+    ("/api", ["GET"]), ("/api/events", ["GET"]), ("/api/ws", ["GET"]),
+    ("/api/all_data", ["GET"]), ("/api/batch", ["POST"]),
+    ("/api/fan/indoor_humidity", ["GET"]), ("/api/fan/outdoor_humidity", ["GET"]), ("/api/fan/speed", ["GET", "PUT"]),
+    ("/api/battery/voltage", ["GET"]), ("/api/light/brightness", ["GET", "PUT"]), ("/api/light/state", ["GET", "PUT"]),
+    ("/api/light/motion_detection", ["GET", "PUT"]), ("/api/motion/state", ["GET"]),
+    ("/api/wlan/mac", ["GET"]), ("/api/wlan/telemetry", ["GET"]), ("/api/offline_queue", ["GET"]),
+    ("/api/version", ["GET"]), ("/api/profiler/tasks", ["GET"]), ("/api/profiler/memory", ["GET"]),
+    ("/api/history/<channel>/<tier>", ["GET"]), ("/api/fan/zones/<zone>/speed", ["GET", "PUT"]),
+    ("/api/sensors/<sensor>", ["GET"]),
+]
+# Lookups timed per category, as (method, path)
+LOOKUPS = {
+    "static": [(b"GET", b"/api/all_data"), (b"GET", b"/api/fan/speed"), (b"PUT", b"/api/light/state"), (b"GET", b"/api/profiler/memory")],
+    "parameterised": [(b"GET", b"/api/history/indoor_humidity/hour"), (b"PUT", b"/api/fan/zones/loft/speed"), (b"GET", b"/api/sensors/outdoor")],
+    "trailing slash": [(b"GET", b"/api/fan/speed/"), (b"GET", b"/api/sensors/"), (b"GET", b"/api/history/indoor_humidity/")],
+    "miss": [(b"GET", b"/favicon.ico"), (b"GET", b"/api/fan/unknown"), (b"GET", b"/api/history/indoor_humidity/hour/extra")],
+}
+
+def load_webserver():
+    """Import http/webserver.py under CPython, mapping the MicroPython u-modules it imports to their CPython equivalents"""
+    for name, module in (("ujson", json), ("uos", os), ("uerrno", errno), ("usocket", socket), ("uhashlib", hashlib),
+                         ("ubinascii", binascii), ("ustruct", struct), ("utime", time)):
+        sys.modules.setdefault(name, module)
+    sys.modules.setdefault("asyncio.core", types.ModuleType("asyncio.core"))
+    # The stdlib http package shadows the repository folder, so load the file directly
+    spec = importlib.util.spec_from_file_location("webserver", os.path.join(REPO_ROOT, "http", "webserver.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Linear_Router:
+    """Reference router scanning every registered pattern segment by segment until one matches"""
+    def __init__(self):
+        # (segments, param names by segment index, handlers by method)
+        self.routes = []
+
+    def add_route(self, url: str, f, methods: list) -> None:
+        segments = []
+        names = {}
+        for index, segment in enumerate(url.split("/")[1:]):
+            if segment.startswith("<") and segment.endswith(">"):
+                names[index] = segment[1:-1]
+                segments.append(None)
+            else:
+                segments.append(segment.encode())
+        self.routes.append((segments, names, {method.encode(): f for method in methods}))
+
+    def lookup(self, method: bytes, path: bytes) -> tuple:
+        parts = path.split(b"/")[1:]
+        for segments, names, handlers in self.routes:
+            if len(segments) != len(parts):
+                continue
+            url_params = None
+            for index, segment in enumerate(segments):
+                part = parts[index]
+                if segment is None:
+                    if part == b"":
+                        break
+                    if url_params is None:
+                        url_params = {}
+                    url_params[names[index]] = part.decode()
+                elif segment != part:
+                    break
+            else:
+                if method == b"HEAD" and b"HEAD" not in handlers:
+                    method = b"GET"
+                return (handlers.get(method) or next(iter(handlers.values())), url_params)
+        return (None, None)
+
+def build_routes(count: int) -> list:
+    routes = list(WEBSITE_ROUTES)
+    index = 0
+    while len(routes) < count:
+        routes.append((f"/api/module{index}/value", ["GET", "PUT"]))
+        index += 1
+    return routes
+
+def time_lookups(lookup, paths: list, iterations: int) -> float:
+    """Mean microseconds per lookup over the paths"""
+    start = time.perf_counter()
+    for unused in range(iterations):
+        for method, path in paths:
+            lookup(method, path)
+    return (time.perf_counter() - start) * 1e6 / (iterations * len(paths))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark trie router lookup against a linear scan")
+    parser.add_argument("--routes", type=int, default=60, help="Routes registered, padded with generated routes")
+    parser.add_argument("--iterations", type=int, default=20000, help="Passes over the lookups of each category")
+    args = parser.parse_args()
+
+    webserver = load_webserver()
+    # webserver.__init__ fetches the event loop, which CPython only creates on request
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    app = webserver.webserver()
+    linear = Linear_Router()
+    routes = build_routes(args.routes)
+    for url, methods in routes:
+        f = lambda *unused, url=url: url
+        app.add_route(url, f, methods=methods)
+        linear.add_route(url, f, methods)
+
+    def trie_lookup(method, path):
+        f, params, url_params = app._lookup_url(method, path)
+        return (f, url_params)
+
+    for category in LOOKUPS:
+        for method, path in LOOKUPS[category]:
+            if trie_lookup(method, path) != linear.lookup(method, path):
+                sys.exit(f"Routers disagree on {method.decode()} {path.decode()}: {trie_lookup(method, path)} != {linear.lookup(method, path)}")
+
+    print(f"{len(routes)} routes, {args.iterations} iterations per lookup")
+    print(f"{'Lookup':<16}{'Trie us':>10}{'Linear us':>12}{'Speedup':>10}")
+    for category in LOOKUPS:
+        trie_us = time_lookups(trie_lookup, LOOKUPS[category], args.iterations)
+        linear_us = time_lookups(linear.lookup, LOOKUPS[category], args.iterations)
+        print(f"{category:<16}{trie_us:>10.2f}{linear_us:>12.2f}{linear_us / trie_us:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Host side benchmark of light command round trip latency, comparing a command on the /api/ws control socket
+with the HTTP requests the web UI made before it: a PUT to /api/light/state then GETs reading the state back.
+Serves the unmodified http/webserver.py connection handler and http/website.py routes over local TCP connections,
+with a light and motion detector standing in for the hardware, and checks both paths leave the light in the same state.
+
+Usage (from the repository root):
+    python tools/bench_ws.py [--iterations 500] [--rtt-ms 5]
+
+Timings are CPython over loopback, so compare the ratios rather than the absolute times against the Pico.
+Loopback has next to no network latency, so each result is also estimated with --rtt-ms added per network round trip:
+two for each new HTTP connection (TCP handshake then request), one for each command on the open socket.
+gc.collect is not run, as the handler collects several times per request and the host heap is far larger than the Pico's.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import errno
+import hashlib
+import importlib.util
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+import config
+
+# Requests made for one light command, as (method, path, form body), each on a new connection as the server speaks HTTP/1.0
+HTTP_SEQUENCES = {
+    "PUT + GET": [("PUT", "/api/light/state", "state={}"), ("GET", "/api/light/state", None)],
+    "PUT + 3 GETs (UI)": [("PUT", "/api/light/state", "state={}"), ("GET", "/api/light/state", None),
+                          ("GET", "/api/light/brightness", None), ("GET", "/api/light/motion_detection", None)],
+}
+
+def load_module(name: str, relative_path: str, shims: dict) -> types.ModuleType:
+    """Execute a repository file with sys.modules entries replaced by shims for the duration of the import"""
+    saved = {key: sys.modules.get(key) for key in shims}
+    sys.modules.update(shims)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for key in saved:
+            if saved[key] is None:
+                del sys.modules[key]
+            else:
+                sys.modules[key] = saved[key]
+    return module
+
+def load_website() -> types.ModuleType:
+    """Import http/website.py under CPython, with http/webserver.py loaded directly as the stdlib http package shadows the folder"""
+    time_shim = types.ModuleType("time")
+    time_shim.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time_shim.ticks_diff = lambda end, start: end - start
+    gc_shim = types.ModuleType("gc")
+    # The handler collects several times per request, a full collection of the host heap would dominate the timings
+    gc_shim.collect = lambda: None
+    gc_shim.mem_alloc = lambda: 0
+    gc_shim.mem_free = lambda: 0
+    webserver = load_module("webserver", "http/webserver.py", {
+        "gc": gc_shim, "utime": time_shim, "ujson": json, "uos": os, "uerrno": errno, "usocket": socket,
+        "uhashlib": hashlib, "ubinascii": binascii, "ustruct": struct, "asyncio.core": types.ModuleType("asyncio.core")})
+    shims = {"http.webserver": webserver, "time": time_shim}
+    for name, attributes in (("lib.task_profiler", ("Task_Profiler", "create_task")), ("lib.memory_profiler", ("Memory_Profiler",)),
+                             ("lib.metrics", ("Metrics",))):
+        shims[name] = types.ModuleType(name)
+        for attribute in attributes:
+            setattr(shims[name], attribute, object)
+    shims["uasyncio"] = types.ModuleType("uasyncio")
+    shims["uasyncio"].wait_for = asyncio.wait_for
+    shims["uasyncio"].TimeoutError = asyncio.TimeoutError
+    return load_module("website", "http/website.py", shims)
+
+class Light:
+    def __init__(self) -> None:
+        self.state = False
+        self.brightness_pc = 100
+
+    def on(self) -> None:
+        self.state = True
+
+    def off(self) -> None:
+        self.state = False
+
+    def get_state(self) -> bool:
+        return self.state
+
+    def set_brightness_pc(self, brightness_pc: int) -> None:
+        self.brightness_pc = brightness_pc
+
+    def get_brightness_pc(self) -> int:
+        return self.brightness_pc
+
+class Motion:
+    def __init__(self) -> None:
+        self.enabled = True
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def get_enabled(self) -> bool:
+        return self.enabled
+
+class Stream:
+    """uasyncio v3 style stream over a CPython reader and writer, as the web server handler expects"""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.s = writer.get_extra_info("socket")
+
+    async def readline(self) -> bytes:
+        return await self.reader.readline()
+
+    async def readinto(self, buf) -> int:
+        data = await self.reader.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    async def awrite(self, data) -> None:
+        self.writer.write(data.encode() if isinstance(data, str) else data)
+        await self.writer.drain()
+
+    async def aclose(self) -> None:
+        self.writer.close()
+
+def make_web_app(website: types.ModuleType):
+    """Web_App with only the light routes and control socket, the full constructor needs every module"""
+    web_app = website.Web_App.__new__(website.Web_App)
+    web_app.app = website.webserver()
+    web_app.ulogger = website.uLogger("Web app", 0)
+    web_app.light = Light()
+    web_app.motion = Motion()
+    web_app.websocket_clients = 0
+    web_app.create_control_socket()
+    for resource, url, kwargs in ((website.light_state, "/api/light/state", {"light": web_app.light, "motion": web_app.motion}),
+                                  (website.light_brightness, "/api/light/brightness", {"light": web_app.light}),
+                                  (website.light_motion_detection, "/api/light/motion_detection", {"motion": web_app.motion})):
+        web_app.app.add_resource(resource, url, ulogger=web_app.ulogger, **kwargs)
+    return web_app
+
+async def http_request(port: int, method: str, path: str, body: str) -> bytes:
+    """One request on a new connection, returning the response once the server closes it"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"{method} {path} HTTP/1.0\r\n"
+    if body is not None:
+        request += f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n"
+    writer.write((request + "\r\n" + (body or "")).encode())
+    response = await reader.read()
+    writer.close()
+    return response
+
+async def ws_connect(port: int) -> tuple:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16))
+    writer.write(b"GET /api/ws HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: " + key + b"\r\n\r\n")
+    headers = await reader.readuntil(b"\r\n\r\n")
+    if not headers.startswith(b"HTTP/1.1 101"):
+        sys.exit(f"WebSocket handshake failed: {headers.decode()}")
+    return reader, writer
+
+async def ws_command(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, command: str) -> bytes:
+    """Send a masked text frame and return the payload of the reply"""
+    payload = command.encode()
+    mask = os.urandom(4)
+    writer.write(struct.pack("!BB", 0x81, 0x80 | len(payload)) + mask + bytes(b ^ mask[i & 3] for i, b in enumerate(payload)))
+    header = await reader.readexactly(2)
+    size = header[1] & 0x7F
+    if size == 126:
+        size = struct.unpack("!H", await reader.readexactly(2))[0]
+    return await reader.readexactly(size)
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def run(iterations: int, rtt_ms: float) -> None:
+    website = load_website()
+    web_app = make_web_app(website)
+
+    async def handle(reader, writer):
+        stream = Stream(reader, writer)
+        web_app.app.conns[id(stream.s)] = None
+        await web_app.app._handler(stream, stream)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    results = {}
+    for name, sequence in HTTP_SEQUENCES.items():
+        samples = []
+        for index in range(iterations):
+            state = ("on", "off")[index % 2]
+            start = time.perf_counter()
+            for method, path, body in sequence:
+                response = await http_request(port, method, path, body.format(state) if body else None)
+                if not response.startswith(b"HTTP/1.0 200"):
+                    sys.exit(f"{method} {path} failed: {response.decode()}")
+            samples.append((time.perf_counter() - start) * 1000)
+            if web_app.light.get_state() != (state == "on"):
+                sys.exit(f"{name} did not set the light {state}")
+        results[name] = (samples, 2 * len(sequence))
+
+    reader, writer = await ws_connect(port)
+    samples = []
+    for index in range(iterations):
+        state = ("on", "off")[index % 2]
+        start = time.perf_counter()
+        reply = json.loads(await ws_command(reader, writer, f"light {state}"))
+        samples.append((time.perf_counter() - start) * 1000)
+        if reply["light_state"] != (state == "on") or web_app.light.get_state() != (state == "on"):
+            sys.exit(f"Control socket did not set the light {state}: {reply}")
+    results["WebSocket command"] = (samples, 1)
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+    baseline = sum(results["WebSocket command"][0]) / iterations
+    print(f"{iterations} light commands, websocket_max_frame_size {config.websocket_max_frame_size} B")
+    print(f"{'Command path':<22}{'Mean ms':>9}{'p95 ms':>9}{'vs WS':>8}{'Trips':>7}{f'At {rtt_ms:g} ms RTT':>16}")
+    for name in results:
+        samples, round_trips = results[name]
+        mean_ms = sum(samples) / iterations
+        print(f"{name:<22}{mean_ms:>9.3f}{percentile(samples, 0.95):>9.3f}{mean_ms / baseline:>7.1f}x{round_trips:>7}{mean_ms + round_trips * rtt_ms:>16.1f}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark control socket commands against PUT and GET requests")
+    parser.add_argument("--iterations", type=int, default=500, help="Light commands timed per command path")
+    parser.add_argument("--rtt-ms", type=float, default=5, help="Network round trip time added to the estimate")
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.rtt_ms))
+
+if __name__ == "__main__":
+    main()
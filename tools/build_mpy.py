@@ -0,0 +1,191 @@
+"""
+Host side build step cross compiling the firmware modules to .mpy bytecode with mpy-cross.
+Saves the Pico compiling every module from source on each boot, reducing start up time and peak RAM.
+
+Usage (from the repository root):
+    python tools/build_mpy.py [--mpy-cross PATH] [--output build] [--benchmark]
+
+Copy the contents of the output folder to the Pico in place of the source files.
+main.py and config.py are copied as source so the firmware can run main.py and config stays editable.
+mpy-cross must match the firmware .mpy version, pip install mpy-cross==1.22.2 matches the v1.22.2 firmware.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# .mpy version emitted for Pimoroni MicroPython v1.22.2, the firmware this code is built against
+EXPECTED_MPY_VERSION = "6.2"
+COMPILED_FOLDERS = ["lib", "http"]
+SOURCE_FILES = ["main.py", "config.py"]
+ASSET_FOLDERS = [os.path.join("http", "html")]
+# Pico firmware modules missing from the unix port, stubbed so the modules can be imported for the benchmark
+HARDWARE_MODULES = ["machine", "network", "rp2", "ntptime", "picographics", "pimoroni", "pimoroni_i2c", "breakout_bme280"]
+HARDWARE_STUB = (
+    "class Stub:\n"
+    "    def __init__(self, *args, **kwargs):\n"
+    "        pass\n"
+    "    def __call__(self, *args, **kwargs):\n"
+    "        return Stub()\n"
+    "    def __getattr__(self, name):\n"
+    "        return Stub()\n"
+    "def __getattr__(name):\n"
+    "    return Stub\n"
+)
+# Run on the unix port, prepending to the path so .frozen still provides asyncio.
+# lib is on the path as on the Pico, as some modules import their neighbours by bare name.
+IMPORT_SCRIPT = (
+    "import sys, gc, time\n"
+    "sys.path[:0] = {path!r}\n"
+    "__import__({name!r})\n"
+    "del sys.modules[{name!r}]\n"
+    "gc.collect(); a = gc.mem_alloc(); t = time.ticks_us()\n"
+    "__import__({name!r})\n"
+    "print(time.ticks_diff(time.ticks_us(), t), gc.mem_alloc() - a)\n"
+)
+
+def find_mpy_cross(path: str | None) -> str:
+    if path:
+        return path
+    found = shutil.which("mpy-cross")
+    if found:
+        return found
+    try:
+        import mpy_cross
+        return os.path.join(os.path.dirname(mpy_cross.__file__), "mpy-cross")
+    except ImportError:
+        sys.exit("mpy-cross not found, install with: pip install mpy-cross==1.22.2")
+
+def check_mpy_cross_version(mpy_cross: str, expected_version: str) -> str:
+    """Fail the build if mpy-cross emits a different .mpy version to the firmware, the Pico would refuse to import the files"""
+    output = subprocess.run([mpy_cross, "--version"], capture_output=True, text=True, check=True).stdout.strip()
+    match = re.search(r"emitting mpy v(\d+\.\d+)", output)
+    if not match:
+        sys.exit(f"Unable to read .mpy version from mpy-cross: {output}")
+    if match.group(1) != expected_version:
+        sys.exit(f"mpy-cross emits mpy v{match.group(1)} but firmware expects v{expected_version}: {output}")
+    return output
+
+def check_mpy_header(path: str, expected_version: str) -> None:
+    """Check the header of a compiled file is 'M' then the major .mpy version, the sub version is only recorded for native code"""
+    major = int(expected_version.split(".")[0])
+    with open(path, "rb") as file:
+        header = file.read(4)
+    if header[0] != ord("M") or header[1] != major:
+        sys.exit(f"{path} has unexpected .mpy header {header.hex()}")
+
+def source_modules() -> list:
+    modules = []
+    for folder in COMPILED_FOLDERS:
+        for directory, unused, files in os.walk(os.path.join(REPO_ROOT, folder)):
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    modules.append(os.path.relpath(os.path.join(directory, name), REPO_ROOT))
+    return modules
+
+def build(mpy_cross: str, output: str, expected_version: str) -> list:
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.makedirs(output)
+
+    compiled = []
+    for module in source_modules():
+        target = os.path.join(output, module[:-3] + ".mpy")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # -s sets the source name in tracebacks to the path on the device
+        subprocess.run([mpy_cross, "-s", module, "-o", target, os.path.join(REPO_ROOT, module)], check=True)
+        check_mpy_header(target, expected_version)
+        compiled.append((module, target))
+        print(f"Compiled {module}")
+
+    for name in SOURCE_FILES:
+        shutil.copy(os.path.join(REPO_ROOT, name), os.path.join(output, name))
+        print(f"Copied {name}")
+
+    for folder in ASSET_FOLDERS:
+        shutil.copytree(os.path.join(REPO_ROOT, folder), os.path.join(output, folder))
+        print(f"Copied {folder}")
+
+    return compiled
+
+def write_hardware_stubs(folder: str) -> None:
+    """Stand in modules for the Pico hardware modules, any attribute is a class that accepts any call or attribute"""
+    for name in HARDWARE_MODULES:
+        with open(os.path.join(folder, name + ".py"), "w") as file:
+            file.write(HARDWARE_STUB)
+
+def import_cost(micropython: str, stubs: str, root: str, module: str) -> list:
+    """
+    Time importing a module from root on the unix port, returning [us, RAM B] or the error.
+    The module is imported once so its dependencies are loaded, then removed from sys.modules and imported again
+    for the measurement, so only the module itself is loaded and executed.
+    """
+    name = module[:-3].replace(os.sep, ".").replace(".__init__", "")
+    result = subprocess.run([micropython, "-c", IMPORT_SCRIPT.format(path=[stubs, root, os.path.join(root, "lib")], name=name)],
+                            capture_output=True, text=True, cwd=stubs)
+    if result.returncode != 0:
+        lines = (result.stdout + result.stderr).strip().splitlines()
+        return ["-", lines[-1] if lines else f"exit {result.returncode}"]
+    return result.stdout.split()
+
+def benchmark(compiled: list, output: str) -> None:
+    """
+    Compare importing each module from source, which the Pico compiles on every boot without this build,
+    against importing the prebuilt bytecode. Both are imported the same way on the MicroPython unix port
+    if it is installed, with the Pico hardware modules stubbed. Without it only file sizes are reported.
+    """
+    micropython = shutil.which("micropython")
+    if not micropython:
+        print("MicroPython unix port not found, reporting file sizes only")
+
+    print(f"{'Module':32} {'Source B':>9} {'mpy B':>7} {'Source us':>10} {'Source RAM B':>13} {'mpy us':>8} {'mpy RAM B':>10}")
+    totals = [0, 0]
+    failures = []
+    with tempfile.TemporaryDirectory() as stubs:
+        write_hardware_stubs(stubs)
+        for module, target in compiled:
+            source_size = os.path.getsize(os.path.join(REPO_ROOT, module))
+            mpy_size = os.path.getsize(target)
+            source = ["-", "-"]
+            mpy = ["-", "-"]
+            if micropython:
+                source = import_cost(micropython, stubs, REPO_ROOT, module)
+                mpy = import_cost(micropython, stubs, output, module)
+                for side, cost in enumerate((source, mpy)):
+                    if cost[0] == "-":
+                        failures.append(f"{module} {('source', 'mpy')[side]}: {cost[1]}")
+                        cost[1] = "-"
+                    else:
+                        totals[side] += int(cost[0])
+            print(f"{module:32} {source_size:>9} {mpy_size:>7} {source[0]:>10} {source[1]:>13} {mpy[0]:>8} {mpy[1]:>10}")
+
+    if micropython:
+        print(f"Total import from source: {totals[0]}us, from bytecode: {totals[1]}us")
+        for failure in failures:
+            print(f"Import failed, {failure}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cross compile firmware modules to .mpy")
+    parser.add_argument("--mpy-cross", help="Path to mpy-cross, defaults to PATH or the mpy-cross pip package")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "build"), help="Deployable output folder")
+    parser.add_argument("--mpy-version", default=EXPECTED_MPY_VERSION, help="Expected .mpy version of the target firmware")
+    parser.add_argument("--benchmark", action="store_true", help="Compare importing each module from source and from bytecode")
+    args = parser.parse_args()
+
+    mpy_cross = find_mpy_cross(args.mpy_cross)
+    print(check_mpy_cross_version(mpy_cross, args.mpy_version))
+    start = time.time()
+    compiled = build(mpy_cross, args.output, args.mpy_version)
+    print(f"Built {len(compiled)} modules into {args.output} in {time.time() - start:.1f}s")
+
+    if args.benchmark:
+        benchmark(compiled, args.output)
+
+if __name__ == "__main__":
+    main()
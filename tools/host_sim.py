@@ -0,0 +1,379 @@
+"""
+Host side simulation of the firmware services on a virtual clock, running the unmodified lib modules under CPython.
+MicroPython only modules are replaced by shims while a module is loaded, ticks functions read the virtual clock,
+so hours of device time simulate in well under a second and results are repeatable.
+
+Reports:
+    scheduler - wakeups of the shared scheduler against the per module sleep loops it replaced
+    tasks - the task profiler report, as logged on the device, for a modelled load of the module service tasks
+    power - lightsleep lengths and wake up timing of the low power idle sleeper, idle with the scheduler jobs running
+
+Usage (from the repository root):
+    python tools/host_sim.py [--hours 1] [--report scheduler|tasks|power]
+"""
+
+import argparse
+# Imported before any time shim is installed, as the stdlib modules it pulls in need the real time module
+import asyncio
+import gc
+import heapq
+import importlib.util
+import os
+import sys
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+import config
+
+# Log level passed to simulated modules, errors only so the reports are readable
+LOG_LEVEL = 2
+# Free heap reported by the gc shim to log lines, the simulation does not model the heap
+SIM_HEAP_FREE_BYTES = 120 * 1024
+
+class Virtual_Clock:
+    """Monotonic microsecond clock advanced by the simulation, with the MicroPython ticks functions"""
+    def __init__(self) -> None:
+        self.now_us = 0
+
+    def ticks_ms(self) -> int:
+        return self.now_us // 1000
+
+    def ticks_us(self) -> int:
+        return self.now_us
+
+    def advance_ms(self, ms: int) -> None:
+        self.now_us += ms * 1000
+
+    def advance_us(self, us: int) -> None:
+        self.now_us += us
+
+    def advance_to_ms(self, ms: int) -> None:
+        self.now_us = max(self.now_us, ms * 1000)
+
+    def time_module(self) -> types.ModuleType:
+        module = types.ModuleType("time")
+        module.ticks_ms = self.ticks_ms
+        module.ticks_us = self.ticks_us
+        module.ticks_add = lambda ticks, delta: ticks + delta
+        module.ticks_diff = lambda end, start: end - start
+        module.time = lambda: self.now_us // 1000000
+        return module
+
+def load_module(relative_path: str, shims: dict) -> types.ModuleType:
+    """Execute a repository module with sys.modules entries replaced by shims for the duration of the import"""
+    saved = {name: sys.modules.get(name) for name in shims}
+    sys.modules.update(shims)
+    try:
+        name = relative_path[:-3].replace("/", ".")
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, relative_path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for name in saved:
+            if saved[name] is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = saved[name]
+    return module
+
+def ulogging_module() -> types.ModuleType:
+    gc_shim = types.ModuleType("gc")
+    gc_shim.collect = gc.collect
+    gc_shim.mem_free = lambda: SIM_HEAP_FREE_BYTES
+    return load_module("lib/ulogging.py", {"gc": gc_shim})
+
+def task_profiler_shim() -> types.ModuleType:
+    module = types.ModuleType("lib.task_profiler")
+    module.create_task = lambda coro, name: None
+    return module
+
+# Sleep loops run by the modules before the scheduler, as (loop, period s), each waking independently
+LEGACY_LOOPS = (
+    ("wlan status monitor", 5),
+    ("web status monitor", 5),
+    ("battery poll", 5),
+    ("backlight timeout", 0.1),
+    ("motion poll", 0.5),
+    ("motion light timer", 0.1),
+    ("fan assessment", config.weather_poll_frequency_in_seconds),
+)
+# Periodic scheduler jobs registered by the modules, as (job, period s)
+SCHEDULER_JOBS = (
+    ("wlan status monitor", 5),
+    ("battery poll", 5),
+    ("fan assessment", config.weather_poll_frequency_in_seconds),
+    ("dns refresh", config.dns_cache_ttl_s / 2),
+)
+# Scenarios as (name, period scale, motion interval s, button interval s), 0 for no events
+SCHEDULER_SCENARIOS = (
+    ("idle", 1, 0, 0),
+    ("motion every 5 min", 1, 300, 0),
+    ("motion and buttons", 1, 300, 120),
+    ("low battery idle", config.battery_poll_stretch["low"], 0, 0),
+)
+
+def simulate_scheduler(duration_s: int, period_scale: float, motion_interval_s: int, button_interval_s: int) -> dict:
+    """Drive the scheduler as its run task does, sleeping to each deadline, with events registering one shot jobs"""
+    clock = Virtual_Clock()
+    scheduler_module = load_module("lib/scheduler.py", {"time": clock.time_module(), "lib.ulogging": ulogging_module(),
+                                                        "lib.task_profiler": task_profiler_shim()})
+    scheduler = scheduler_module.Scheduler(LOG_LEVEL)
+    for name, period_s in SCHEDULER_JOBS:
+        scheduler.every(name, period_s, lambda: None, run_now=True)
+    scheduler.set_period_scale(period_scale)
+    events = []
+    for interval_s, name, delay_s in ((motion_interval_s, "motion light timeout", config.motion_light_off_delay),
+                                      (button_interval_s, "backlight timeout", config.backlight_timeout_s)):
+        if interval_s:
+            # Offset so events do not land on job deadlines
+            events += [(ms, name, delay_s) for ms in range(interval_s * 1000 + 137, duration_s * 1000, interval_s * 1000)]
+    events.sort()
+    one_shot_runs = 0
+
+    def one_shot() -> None:
+        nonlocal one_shot_runs
+        one_shot_runs += 1
+
+    end_ms = duration_s * 1000
+    while True:
+        now = clock.ticks_ms()
+        delay = scheduler.next_deadline_ms(now)
+        if events and (delay < 0 or events[0][0] <= now + delay):
+            # An event wakes the device and registers a job, the scheduler recomputes its deadline without running jobs
+            event_ms, name, delay_s = events.pop(0)
+            clock.advance_to_ms(event_ms)
+            scheduler.after(name, delay_s, one_shot)
+            continue
+        if delay < 0 or now + delay > end_ms:
+            break
+        clock.advance_ms(delay)
+        scheduler.wakeups += 1
+        scheduler.run_due_jobs(clock.ticks_ms())
+    periodic_runs = sum(scheduler.jobs[name].runs for name in scheduler.jobs if scheduler.jobs[name].period_ms)
+    return {"wakeups": scheduler.wakeups, "periodic runs": periodic_runs, "one shot runs": one_shot_runs}
+
+def report_scheduler(duration_s: int) -> None:
+    legacy_wakeups = sum(int(duration_s / period_s) for name, period_s in LEGACY_LOOPS)
+    print(f"Scheduler wakeups over {duration_s // 3600}h {duration_s % 3600 // 60}m")
+    print(f"Sleep loops before the scheduler: {legacy_wakeups} wakeups from {len(LEGACY_LOOPS)} loops")
+    print(f"{'Scenario':<22}{'Wakeups':>9}{'Job runs':>10}{'One shot':>10}{'Per hour':>10}{'Reduction':>11}")
+    for name, period_scale, motion_interval_s, button_interval_s in SCHEDULER_SCENARIOS:
+        result = simulate_scheduler(duration_s, period_scale, motion_interval_s, button_interval_s)
+        per_hour = round(result["wakeups"] * 3600 / duration_s)
+        reduction = legacy_wakeups / max(1, result["wakeups"])
+        print(f"{name:<22}{result['wakeups']:>9}{result['periodic runs']:>10}{result['one shot runs']:>10}{per_hour:>10}{reduction:>10.1f}x")
+
+class Sleep:
+    """Awaitable yielded to the simulated event loop to suspend the current task for ms"""
+    def __init__(self, ms: int) -> None:
+        self.ms = ms
+
+    def __await__(self):
+        yield self
+
+class Sim_Task:
+    def __init__(self, coro) -> None:
+        self.coro = coro
+        # Tick the task is due, as the uasyncio core keys queued tasks
+        self.ph_key = 0
+
+class Sim_Loop:
+    """
+    Single threaded event loop on the virtual clock standing in for uasyncio.
+    Tasks run in deadline order and a task that runs long delays every task due meanwhile, as on the device.
+    """
+    def __init__(self, clock: Virtual_Clock) -> None:
+        self.clock = clock
+        self.queue = []
+        self.sequence = 0
+        self.core = types.ModuleType("asyncio.core")
+        self.core.cur_task = None
+        # Longest a task resumed after the tick it was due
+        self.max_late_ms = 0
+
+    def asyncio_module(self) -> types.ModuleType:
+        module = types.ModuleType("asyncio")
+        module.create_task = self.create_task
+        module.sleep = lambda s: Sleep(int(s * 1000))
+        module.sleep_ms = Sleep
+        module.core = self.core
+        return module
+
+    def create_task(self, coro) -> Sim_Task:
+        task = Sim_Task(coro)
+        self.schedule(task, self.clock.ticks_ms())
+        return task
+
+    def schedule(self, task: Sim_Task, due_ms: int) -> None:
+        task.ph_key = due_ms
+        self.sequence += 1
+        heapq.heappush(self.queue, (due_ms, self.sequence, task))
+
+    def run_until(self, end_ms: int) -> None:
+        while self.queue and self.queue[0][0] <= end_ms:
+            due_ms, unused, task = heapq.heappop(self.queue)
+            self.clock.advance_to_ms(due_ms)
+            self.max_late_ms = max(self.max_late_ms, self.clock.ticks_ms() - due_ms)
+            self.core.cur_task = task
+            try:
+                yielded = task.coro.send(None)
+            except StopIteration:
+                continue
+            self.schedule(task, self.clock.ticks_ms() + yielded.ms)
+
+    def close(self) -> None:
+        """Close the unfinished tasks, outermost coroutine first as when a task is cancelled"""
+        for unused, unused, task in self.queue:
+            task.coro.close()
+        self.queue = []
+
+# Modelled service tasks as (task, steps), each step a sleep in ms then CPU time in us, cycled.
+# Costs are estimates for the Pico W, edit them to explore how a slow task delays the others.
+SERVICE_TASKS = (
+    ("scheduler", ((5000, 2500),)),
+    ("metrics sampler", ((config.metrics_sample_interval_s * 1000, 8000),)),
+    ("memory fragmentation sampler", ((config.memory_profiler_sample_s * 1000, 30000),)),
+    # Weather fetch, building the request then parsing the response after the network round trip
+    ("fan assessment", ((config.weather_poll_frequency_in_seconds * 1000, 15000), (400, 45000))),
+    ("web request", ((15000, 25000),)),
+    # Press then debounce polls
+    ("button a poller", ((120000, 200),) + ((1, 100),) * 20),
+)
+
+def simulate_tasks(duration_s: int):
+    """Run the modelled service tasks under the unmodified task profiler, returning the profiler"""
+    clock = Virtual_Clock()
+    loop = Sim_Loop(clock)
+    asyncio_shim = loop.asyncio_module()
+    profiler_module = load_module("lib/task_profiler.py", {"time": clock.time_module(), "asyncio": asyncio_shim,
+                                                           "asyncio.core": loop.core, "lib.ulogging": ulogging_module()})
+    # Info level so log_report prints as on a device logging at info
+    profiler = profiler_module.Task_Profiler(4)
+    profiler_module.install(profiler)
+
+    async def service_task(steps: tuple) -> None:
+        while True:
+            for sleep_ms, run_us in steps:
+                await Sleep(sleep_ms)
+                clock.advance_us(run_us)
+
+    for name, steps in SERVICE_TASKS:
+        profiler_module.create_task(service_task(steps), name)
+    loop.run_until(duration_s * 1000)
+    loop.close()
+    return profiler
+
+def report_tasks(duration_s: int) -> None:
+    print(f"Task profiler report after {duration_s // 3600}h {duration_s % 3600 // 60}m")
+    simulate_tasks(duration_s).log_report()
+
+class Sim_Power_Clock:
+    """Clock and task queue for the power manager on the simulated event loop, recording each lightsleep"""
+    def __init__(self, loop: Sim_Loop) -> None:
+        self.loop = loop
+        # (tick the sleep started, requested ms, tick the next task was due or None)
+        self.sleeps = []
+
+    def ticks_ms(self) -> int:
+        return self.loop.clock.ticks_ms()
+
+    def lightsleep(self, ms: int) -> None:
+        self.sleeps.append((self.ticks_ms(), ms, self.next_task_due_ms()))
+        self.loop.clock.advance_ms(ms)
+
+    def next_task_due_ms(self) -> int | None:
+        return self.loop.queue[0][0] if self.loop.queue else None
+
+class Idle_Module:
+    """Stands in for the events, wlan and display modules, idle with the backlight off"""
+    def add_listener(self, listener) -> None:
+        pass
+
+    def set_power_saving(self, enabled: bool) -> None:
+        pass
+
+    def get_backlight_state(self) -> bool:
+        return False
+
+# Modelled tasks running alongside the scheduler while idle, from SERVICE_TASKS
+POWER_TASKS = ("metrics sampler", "memory fragmentation sampler")
+# Scenarios as (name, period scale)
+POWER_SCENARIOS = (
+    ("idle", 1),
+    ("low battery idle", config.battery_poll_stretch["low"]),
+)
+
+def simulate_power(duration_s: int, period_scale: float) -> dict:
+    """Run the unmodified power manager idle sleeper against the scheduler jobs and modelled tasks on the simulated loop"""
+    clock = Virtual_Clock()
+    loop = Sim_Loop(clock)
+    shims = {"time": clock.time_module(), "lib.ulogging": ulogging_module(), "lib.task_profiler": task_profiler_shim()}
+    # The scheduler run task is modelled below, so its module keeps the CPython asyncio for the Event it constructs
+    scheduler = load_module("lib/scheduler.py", shims).Scheduler(LOG_LEVEL)
+    for name, period_s in SCHEDULER_JOBS:
+        scheduler.every(name, period_s, lambda: None, run_now=True)
+    scheduler.set_period_scale(period_scale)
+    power_clock = Sim_Power_Clock(loop)
+    power_module = load_module("lib/power.py", dict(shims, **{"asyncio": loop.asyncio_module(), "asyncio.core": loop.core,
+                                                              "machine": types.ModuleType("machine")}))
+    idle = Idle_Module()
+    power = power_module.Power_Manager(LOG_LEVEL, {"events": idle, "wlan": idle, "display": idle, "scheduler": scheduler}, power_clock)
+
+    async def scheduler_task() -> None:
+        # As Scheduler.run, sleeping to each deadline, with the run cost from SERVICE_TASKS
+        while True:
+            await Sleep(scheduler.next_deadline_ms(clock.ticks_ms()))
+            scheduler.wakeups += 1
+            scheduler.run_due_jobs(clock.ticks_ms())
+            clock.advance_us(dict(SERVICE_TASKS)["scheduler"][0][1])
+
+    async def service_task(steps: tuple) -> None:
+        while True:
+            for sleep_ms, run_us in steps:
+                await Sleep(sleep_ms)
+                clock.advance_us(run_us)
+
+    loop.create_task(scheduler_task())
+    for name in POWER_TASKS:
+        loop.create_task(service_task(dict(SERVICE_TASKS)[name]))
+    loop.create_task(power.idle_sleeper())
+    loop.run_until(duration_s * 1000)
+    loop.close()
+    lengths = [ms for start_ms, ms, due_ms in power_clock.sleeps]
+    # A sleep should end as the next task is due, or earlier only when capped at low_power_max_sleep_ms
+    on_time = sum(1 for start_ms, ms, due_ms in power_clock.sleeps if due_ms is not None and start_ms + ms == due_ms)
+    capped = sum(1 for start_ms, ms, due_ms in power_clock.sleeps if ms == power.max_sleep_ms and (due_ms is None or start_ms + ms < due_ms))
+    return {"sleeps": len(lengths), "min sleep ms": min(lengths, default=0), "max sleep ms": max(lengths, default=0),
+            "mean sleep ms": sum(lengths) / max(1, len(lengths)), "woke on time": on_time, "capped": capped,
+            "mistimed": len(lengths) - on_time - capped, "max task lateness ms": loop.max_late_ms,
+            "duty cycle pc": power.get_duty_cycle_pc()}
+
+def report_power(duration_s: int) -> None:
+    print(f"Low power idle sleeper over {duration_s // 3600}h {duration_s % 3600 // 60}m, "
+          f"sleeps of {config.low_power_min_sleep_ms} to {config.low_power_max_sleep_ms}ms")
+    print(f"{'Scenario':<20}{'Sleeps':>8}{'Mean ms':>9}{'Min ms':>8}{'Max ms':>8}{'On time':>9}{'Capped':>8}{'Mistimed':>10}{'Late ms':>9}{'Awake':>8}")
+    for name, period_scale in POWER_SCENARIOS:
+        result = simulate_power(duration_s, period_scale)
+        print(f"{name:<20}{result['sleeps']:>8}{result['mean sleep ms']:>9.0f}{result['min sleep ms']:>8}{result['max sleep ms']:>8}"
+              f"{result['woke on time']:>9}{result['capped']:>8}{result['mistimed']:>10}{result['max task lateness ms']:>9}{result['duty cycle pc']:>7}%")
+
+REPORTS = {
+    "scheduler": report_scheduler,
+    "tasks": report_tasks,
+    "power": report_power,
+}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate the firmware services on a virtual clock")
+    parser.add_argument("--hours", type=float, default=1, help="Simulated device time")
+    parser.add_argument("--report", choices=list(REPORTS) + ["all"], default="all")
+    args = parser.parse_args()
+    duration_s = int(args.hours * 3600)
+    for name in REPORTS:
+        if args.report in (name, "all"):
+            REPORTS[name](duration_s)
+            print()
+
+if __name__ == "__main__":
+    main()